@@ -748,7 +748,8 @@ export const RAYAGRO_COLORS = {
 
 // Настройки дашборда
 export const DASHBOARD_CONFIG = {
-  maxPointsOnMap: 1000,
+  maxPointsOnMap: 1000, // без тайлов; с тайлами (scripts/map_tiles.py) карта грузит только видимое
+  tilesIndexUrl: "/data/tiles/index.json",
   defaultYearRange: [2015, 2025],
   yieldThreshold: 30,
   refreshInterval: 300000 // 5 минут
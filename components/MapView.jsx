@@ -1,5 +1,6 @@
 import React, { useEffect, useRef, useState, useMemo } from "react";
 import { parseCSV } from "./csv.js";
+import { loadTable } from "./delta.js";
 import { redYellowGreen, equalBreaks, binIndex } from "./scale.js";
 import "leaflet/dist/leaflet.css";
 
@@ -54,6 +55,73 @@ const toNum = (v) => {
   return Number.isFinite(n) ? n : NaN;
 };
 
+// manifest.json (scripts/versioned.py): имя -> файл с хешем содержимого, он неизменяем и
+// кэшируется навсегда; сам манифест — всегда свежий. Нет манифеста — прежние имена.
+// Таблицы с ключом (Контрагент, Год) догружаются дельтами (components/delta.js).
+async function loadManifest() {
+  const empty = { version: 0, files: {}, deltas: [] };
+  try {
+    const r = await fetch("/data/manifest.json", { cache: "no-cache" });
+    const m = r.ok ? await r.json() : null;
+    return m && m.files ? m : empty;
+  } catch {
+    return empty;    // dev-сервер на отсутствующий файл отдаёт index.html — не JSON
+  }
+}
+const dataUrl = (files, name) => `/data/${files[name] ? files[name].path : name}`;
+// необязательный JSON (grid.json, ...): в версии манифеста его нет — значит, в этой версии
+// его нет совсем (прежнее имя на диске может остаться от старой); без манифеста — по имени
+function loadOptionalJson(manifest, name) {
+  if (manifest.version && !manifest.files[name]) return Promise.resolve(null);
+  return fetch(dataUrl(manifest.files, name)).then(r => r.ok ? r.json() : null).catch(() => null);
+}
+
+// Тайлы точек (scripts/map_tiles.py): от корней index.json спускаемся только в видимые
+// тайлы, пока не дойдём до листа с точками или до текущего зума карты.
+// index.hash — хеш набора тайлов и его каталог (tiles/<hash>/, не меняется после сборки),
+// а кэш держит только текущий набор — после перепубликации старые тайлы не показываются.
+const tileCache = { hash: null, tiles: new Map() };
+function fetchTile(index, z, x, y) {
+  if (tileCache.hash !== index.hash) {
+    tileCache.hash = index.hash;
+    tileCache.tiles.clear();
+  }
+  const key = `${z}/${x}/${y}`;
+  if (!tileCache.tiles.has(key)) {
+    const url = index.hash ? `/data/tiles/${index.hash}/${key}.json` : `/data/tiles/${key}.json`;
+    tileCache.tiles.set(key, fetch(url).then(r => r.ok ? r.json() : null).catch(() => null));
+  }
+  return tileCache.tiles.get(key);
+}
+// индекс тайлов: версия из манифеста (tiles.json, см. publish_data.py) неизменяема; в версии
+// манифеста его нет — тайлов в ней нет; без манифеста — tiles/index.json, всегда свежий
+function loadTilesIndex(manifest) {
+  if (manifest.files["tiles.json"]) return loadOptionalJson(manifest, "tiles.json");
+  if (manifest.version) return Promise.resolve(null);
+  return fetch("/data/tiles/index.json", { cache: "no-cache" }).then(r => r.ok ? r.json() : null).catch(() => null);
+}
+
+async function visibleTiles(map, index) {
+  const target = Math.max(index.zmin, Math.min(index.zmax, Math.round(map.getZoom())));
+  const bounds = map.getBounds();
+  const inView = (z, x, y) => {
+    const nw = map.project(bounds.getNorthWest(), z).divideBy(index.tile_px).floor();
+    const se = map.project(bounds.getSouthEast(), z).divideBy(index.tile_px).floor();
+    return x >= nw.x && x <= se.x && y >= nw.y && y <= se.y;
+  };
+  const out = [];
+  let level = index.roots.filter(([x, y]) => inView(index.zmin, x, y)).map(([x, y]) => [index.zmin, x, y]);
+  while (level.length) {
+    const tiles = (await Promise.all(level.map(([z, x, y]) => fetchTile(index, z, x, y)))).filter(Boolean);
+    level = [];
+    for (const t of tiles) {
+      if (t.points || t.z >= target) out.push(t);
+      else for (const [x, y] of t.children) if (inView(t.z + 1, x, y)) level.push([t.z + 1, x, y]);
+    }
+  }
+  return out;
+}
+
 function StatsTable({ rows }) {
   if (!rows || !rows.length) return null;
   const sorted = [...rows].sort((a,b) => {
@@ -97,42 +165,78 @@ function StatsTable({ rows }) {
 export default function MapView() {
   const [geoRows, setGeoRows] = useState(null);
   const [kpiRows, setKpiRows] = useState(null);
+  const [joinedRows, setJoinedRows] = useState(null);
   const [statsRows, setStatsRows] = useState(null);
+  const [pyramid, setPyramid] = useState(null);
+  const [tileIndex, setTileIndex] = useState(null);
   const [error, setError] = useState("");
 
   // единственные ссылки Leaflet (без дублирования)
   const mapEl = useRef(null);
   const mapRef = useRef(null);
 
-  // загрузка CSV
+  // загрузка CSV: сначала готовый joined.csv (scripts/join_check.py), иначе geo+kpi;
+  // вкладка снова на экране — перечитываем манифест, новая версия догружается дельтами
   useEffect(() => {
     let alive = true;
+    let version = -1;
     async function load() {
       try {
-        const [geoText, kpiText, statsText] = await Promise.all([
-          fetch("/data/geo.csv").then(r => r.ok ? r.text() : ""),
-          fetch("/data/kpi.csv").then(r => r.ok ? r.text() : ""),
-          fetch("/data/kpi_stats.csv").then(r => r.ok ? r.text() : "")
+        const manifest = await loadManifest();
+        if (manifest.version && manifest.version === version) return;
+        version = manifest.version;
+        const files = manifest.files;
+        const [joined, statsText, gridJson, tilesJson] = await Promise.all([
+          loadTable(manifest, "joined.csv"),
+          fetch(dataUrl(files, "kpi_stats.csv")).then(r => r.ok ? r.text() : ""),
+          // пирамида сеток (scripts/grid_pyramid.py); нет файла — считаем сетку в браузере
+          loadOptionalJson(manifest, "grid.json"),
+          // индекс тайлов (scripts/map_tiles.py); нет — рисуем все точки joined
+          loadTilesIndex(manifest)
         ]);
         if (!alive) return;
-        setGeoRows(geoText ? parseCSV(geoText).rows : []);
-        setKpiRows(kpiText ? parseCSV(kpiText).rows : []);
         setStatsRows(statsText ? parseCSV(statsText).rows : []);
+        // новая версия без пирамиды — сбрасываем прежнюю, а не рисуем устаревшую сетку
+        setPyramid(gridJson && Array.isArray(gridJson.levels) && gridJson.levels.length ? gridJson : null);
+        setTileIndex(tilesJson && Array.isArray(tilesJson.roots) && tilesJson.points > 0 ? tilesJson : null);
+        // dev-сервер на отсутствующий файл отдаёт index.html — проверяем заголовок
+        if (joined && joined.columns.includes("Широта")) {
+          setJoinedRows(joined.rows);
+          setGeoRows(joined.rows);
+          setKpiRows(joined.rows);
+          return;
+        }
+        const [geo, kpi] = await Promise.all([loadTable(manifest, "geo.csv"), loadTable(manifest, "kpi.csv")]);
+        if (!alive) return;
+        setGeoRows(geo ? geo.rows : []);
+        setKpiRows(kpi ? kpi.rows : []);
       } catch (e) {
         if (!alive) return;
         setError(String(e));
         setGeoRows([]); setKpiRows([]); setStatsRows([]);
       }
     }
+    const onVisible = () => { if (document.visibilityState === "visible") load(); };
     load();
-    return () => { alive = false; };
+    document.addEventListener("visibilitychange", onVisible);
+    return () => { alive = false; document.removeEventListener("visibilitychange", onVisible); };
   }, []);
 
   const hasPoints = Array.isArray(geoRows) && geoRows.length > 0;
   const hasYield  = Array.isArray(kpiRows) && kpiRows.length > 0;
 
-  // join geo×kpi
+  // join geo×kpi (если joined.csv нет — считаем в браузере)
   const joined = useMemo(() => {
+    if (joinedRows) {
+      const pts = [];
+      for (const r of joinedRows) {
+        const lat = toNum(r["Широта"]), lon = toNum(r["Долгота"]), yld = toNum(r["Урожайность_ц_га"]);
+        if (Number.isFinite(lat) && Number.isFinite(lon) && Number.isFinite(yld)) {
+          pts.push({ lat, lon, yld, contr: r["Контрагент"], year: r["Год"] });
+        }
+      }
+      return pts;
+    }
     if (!hasPoints || !hasYield) return [];
     const kpiMap = new Map();
     for (const r of kpiRows) {
@@ -155,7 +259,7 @@ export default function MapView() {
       }
     }
     return pts;
-  }, [geoRows, kpiRows, hasPoints, hasYield]);
+  }, [joinedRows, geoRows, kpiRows, hasPoints, hasYield]);
 
   // bbox
   const bbox = useMemo(() => {
@@ -170,9 +274,15 @@ export default function MapView() {
     return { minLat, maxLat, minLon, maxLon };
   }, [joined]);
 
-  // агрегирование в сетку
+  // агрегирование в сетку: готовый уровень пирамиды, иначе — в браузере
   const rowsN = 10, colsN = 20;
   const gridAgg = useMemo(() => {
+    if (pyramid) {
+      const lvl = pyramid.levels.find(l => l.rows === rowsN && l.cols === colsN) || pyramid.levels[0];
+      const grid = Array.from({ length: lvl.rows }, () => Array(lvl.cols).fill(NaN));
+      for (const [r, c, m] of lvl.cells) grid[r][c] = m;
+      return { edges: lvl.edges, grid, means: lvl.cells.map(cell => cell[2]), rows: lvl.rows, cols: lvl.cols };
+    }
     if (!bbox || !joined.length) return { edges: null, grid: null, means: [] };
     const { minLat, maxLat, minLon, maxLon } = bbox;
     const latSpan = Math.max(1e-9, maxLat - minLat);
@@ -193,16 +303,19 @@ export default function MapView() {
     const min = vals.length ? Math.min(...vals) : 0;
     const max = vals.length ? Math.max(...vals) : 1;
     const edges = equalBreaks(min, max, 6);
-    return { edges, grid: mean, means: vals };
-  }, [bbox, joined]);
+    return { edges, grid: mean, means: vals, rows: rowsN, cols: colsN };
+  }, [pyramid, bbox, joined]);
 
-  // Leaflet точки (один useEffect)
+  // Leaflet точки (один useEffect): тайлы с кластерами, если есть индекс, иначе все точки
   useEffect(() => {
     let L;
     let group;
+    let onMove;
+    let cancelled = false;
     async function init() {
       const mod = await import("leaflet");
       L = mod.default || mod;
+      if (cancelled) return;
 
       if (!mapRef.current && mapEl.current) {
         mapRef.current = L.map(mapEl.current, {
@@ -215,23 +328,60 @@ export default function MapView() {
           maxZoom: 18
         }).addTo(mapRef.current);
       }
-      if (group) group.remove();
+      const map = mapRef.current;
+      if (!map) return;
 
-      if (mapRef.current) {
-        group = L.featureGroup();
-        for (const p of joined) {
-          const m = L.circleMarker([p.lat, p.lon], { radius: 5, weight: 1 });
-          m.bindTooltip(`${p.contr} (${p.year}) — ${p.yld.toFixed(1)} ц/га`);
-          m.addTo(group);
-        }
-        if (group.getLayers().length) {
-          group.addTo(mapRef.current);
-          mapRef.current.fitBounds(group.getBounds().pad(0.25));
-        }
+      if (tileIndex) {
+        const { min, max } = tileIndex.yield;
+        const color = (v) => redYellowGreen(max > min ? (v - min) / (max - min) : 1);
+        let seq = 0;
+        onMove = async () => {
+          const my = ++seq;
+          const tiles = await visibleTiles(map, tileIndex);
+          if (cancelled || my !== seq) return;
+          const next = L.featureGroup();
+          for (const t of tiles) {
+            for (const [lat, lon, yld, contr, year] of t.points || []) {
+              const m = L.circleMarker([lat, lon], { radius: 5, weight: 1 });
+              m.bindTooltip(`${contr} (${year}) — ${yld.toFixed(1)} ц/га`);
+              m.addTo(next);
+            }
+            for (const [lat, lon, n, mean, lo, hi] of t.clusters || []) {
+              const m = L.circleMarker([lat, lon], {
+                radius: 6 + 2 * Math.log2(n), weight: 1, color: color(mean), fillOpacity: 0.6
+              });
+              m.bindTooltip(`${n} полей — ${mean.toFixed(1)} ц/га (${lo.toFixed(1)}–${hi.toFixed(1)})`);
+              m.addTo(next);
+            }
+          }
+          if (group) group.remove();
+          group = next.addTo(map);
+        };
+        const b = tileIndex.bbox;
+        map.fitBounds(L.latLngBounds([b.minLat, b.minLon], [b.maxLat, b.maxLon]).pad(0.25));
+        map.on("moveend", onMove);
+        onMove();
+        return;
+      }
+
+      group = L.featureGroup();
+      for (const p of joined) {
+        const m = L.circleMarker([p.lat, p.lon], { radius: 5, weight: 1 });
+        m.bindTooltip(`${p.contr} (${p.year}) — ${p.yld.toFixed(1)} ц/га`);
+        m.addTo(group);
+      }
+      if (group.getLayers().length) {
+        group.addTo(map);
+        map.fitBounds(group.getBounds().pad(0.25));
       }
     }
     init();
-  }, [joined]);
+    return () => {
+      cancelled = true;
+      if (onMove && mapRef.current) mapRef.current.off("moveend", onMove);
+      if (group) group.remove();
+    };
+  }, [joined, tileIndex]);
 
   return (
     <div style={{
@@ -278,9 +428,9 @@ export default function MapView() {
                 background: "#fff"
               }}
             >
-              <div style={{ display: "grid", gridTemplateRows: `repeat(${10}, 1fr)`, gap: 2, height: "100%" }}>
+              <div style={{ display: "grid", gridTemplateRows: `repeat(${gridAgg.rows}, 1fr)`, gap: 2, height: "100%" }}>
                 {gridAgg.grid.map((row, ri) => (
-                  <div key={ri} style={{ display: "grid", gridTemplateColumns: `repeat(${20}, 1fr)`, gap: 2 }}>
+                  <div key={ri} style={{ display: "grid", gridTemplateColumns: `repeat(${gridAgg.cols}, 1fr)`, gap: 2 }}>
                     {row.map((v, ci) => {
                       if (!Number.isFinite(v)) {
                         return <div key={ci} style={{ height: "100%", background: "#eee", borderRadius: 2 }} title="нет данных" />;
@@ -0,0 +1,80 @@
+import { parseCSV } from "./csv.js";
+
+/**
+ * Дельты публикации (scripts/delta.py): у кого уже есть версия файла, тот догоняет текущую
+ * патчами из manifest.deltas, а не скачивает файл целиком.
+ * snapshots — последняя загруженная версия каждого файла (sha256 + разобранные строки)
+ * на время жизни вкладки.
+ */
+const snapshots = new Map();
+// ключевые колонки шага — step.key из манифеста (scripts/versioned.py); в старых манифестах
+// его нет — тогда (Контрагент, Год)
+const DEFAULT_KEY = ["Контрагент", "Год"];
+
+// строки дельты {op, pos, ...поля}: "-" удалить ключ, "=" заменить на месте,
+// "+" вставить строкой pos новой версии (pos по возрастанию)
+export function applyDelta(rows, delta, key = DEFAULT_KEY) {
+  const keyOf = (r) => key.map(k => r[k]).join("||");
+  const drop = new Set(), repl = new Map(), ins = [];
+  for (const { op, pos, ...row } of delta) {
+    if (op === "-") drop.add(keyOf(row));
+    else if (op === "=") repl.set(keyOf(row), row);
+    else if (op === "+") ins.push([Number(pos), row]);
+  }
+  const kept = [];
+  for (const r of rows) {
+    const k = keyOf(r);
+    if (!drop.has(k)) kept.push(repl.get(k) || r);
+  }
+  if (!ins.length) return kept;
+  const out = [];
+  let j = 0;
+  for (const [pos, row] of ins) {
+    while (out.length < pos && j < kept.length) out.push(kept[j++]);
+    out.push(row);
+  }
+  while (j < kept.length) out.push(kept[j++]);
+  return out;
+}
+
+// шаги цепочки (старые -> новые) от версии файла from до to; не сходится — null
+function chain(deltas, name, from, to) {
+  const steps = [];
+  let sha = from;
+  for (const step of [...deltas].reverse()) {
+    const d = step.files && step.files[name];
+    if (d && d.from === sha) { steps.push(d); sha = d.to; }
+  }
+  return sha === to ? steps : null;
+}
+
+async function fetchText(path) {
+  const r = await fetch(`/data/${path}`);
+  if (!r.ok) throw new Error(`${path}: HTTP ${r.status}`);
+  return r.text();
+}
+
+// -> { columns, rows } текущей версии name или null (нет файла)
+export async function loadTable(manifest, name) {
+  const entry = manifest.files[name];
+  const have = snapshots.get(name);
+  if (entry && have) {
+    if (have.sha256 === entry.sha256) return have.table;
+    const steps = chain(manifest.deltas || [], name, have.sha256, entry.sha256);
+    if (steps) {
+      try {
+        let rows = have.table.rows;
+        for (const s of steps) rows = applyDelta(rows, parseCSV(await fetchText(s.path)).rows, s.key);
+        const table = { columns: have.table.columns, rows };
+        snapshots.set(name, { sha256: entry.sha256, table });
+        return table;
+      } catch {
+        // дельта не догрузилась — берём полный файл
+      }
+    }
+  }
+  const text = await fetchText(entry ? entry.path : name).catch(() => "");
+  const table = text ? parseCSV(text) : null;
+  if (entry && table) snapshots.set(name, { sha256: entry.sha256, table });
+  return table;
+}
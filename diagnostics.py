@@ -5,20 +5,43 @@ Diagnostics runner for RayAgro:
 - Build artifacts check (dist/)
 - KPI validator (scripts/validate_kpi.py data/sample_kpi.csv)
 - GEO validator (scripts/geo_check.py data/sample_geo.csv)
-- Public data presence (public/data/kpi.csv, public/data/geo.csv)
+- Public data presence (public/data/kpi.csv, public/data/geo.csv) and manifest.json consistency
 - Map/KPI policy reminder
 Exits with code>0 on build absence or validator errors; public/data missing is warn with suggested fix.
+Проверки независимы и идут параллельно (DAG в CHECKS), у каждой свой таймаут; время
+каждой — в "checks" отчёта, общее — в "wall_s"; CPU/пик RSS по проверкам — в "timings"
+(scripts/instrument.py, RAYAGRO_TRACE=1 — ещё и Chrome trace в logs/). --serial — по очереди.
+Валидаторы вызываются функциями (scripts/tools.py) в этом же процессе; RAYAGRO_INPROC=0
+или отсутствие tools.py — прежний путь через python3. Схема логов validator-*.json та же.
 """
-import json, os, subprocess, time
+import argparse, json, os, subprocess, sys, threading, time
 from pathlib import Path
 
 ROOT = Path(__file__).parent.resolve()
+sys.path.insert(0, str(ROOT / "scripts"))
+import instrument
+try:
+    import tools
+except ImportError:
+    tools = None
 DIST = ROOT / "dist"
 LOGS = ROOT / "logs"
 PUBD = ROOT / "public" / "data"
 LOGS.mkdir(exist_ok=True)
+# вход больше порога — валидатор идёт в отдельном процессе (tools.Pool): потоки одного
+# процесса делят GIL, и параллельны только проверки, ждущие диск или подпроцесс
+PROC_MIN_BYTES = int(float(os.getenv("DIAG_PROC_MIN_MB", "8")) * 1024 * 1024)
+_POOL = None
+_POOL_LOCK = threading.Lock()
 
-def run(cmd, timeout=300):
+def _pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = tools.Pool(workers=2)
+        return _POOL
+
+def run_cmd(cmd, timeout=300):
     p = subprocess.Popen(cmd, cwd=str(ROOT), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     try:
         out, err = p.communicate(timeout=timeout)
@@ -30,80 +53,109 @@ def run(cmd, timeout=300):
 def have_build():
     return (DIST / "index.html").exists() and (DIST / "assets").exists()
 
-def _run_json(cmd, log_prefix, timeout=60):
-    code, out, err = run(cmd, timeout=timeout)
-    try:
-        payload = json.loads(out) if out.strip().startswith("{") else {"raw": out}
-    except Exception:
-        payload = {"raw": out}
+def _write_log(log_prefix, code, payload):
     ts = int(time.time())
     (LOGS / f"{log_prefix}-{ts}.json").write_text(
         json.dumps({"code": code, "report": payload}, ensure_ascii=False, indent=2),
         encoding="utf-8"
     )
+
+def _failure(payload, code, timeout, detail=""):
+    """Таймаут (124) или падение без отчёта -> payload["error"]: проверка не сочтёт прогон чистым."""
+    if code == 124:
+        payload.setdefault("error", f"timeout: нет результата за {timeout} с")
+    elif code and "raw" in payload:
+        payload.setdefault("error", detail.strip()[-300:] or f"exit code {code}")
+    return payload
+
+def _run_json(cmd, log_prefix, timeout=60):
+    code, out, err = run_cmd(cmd, timeout=timeout)
+    try:
+        payload = json.loads(out) if out.strip().startswith("{") else {"raw": out}
+    except Exception:
+        payload = {"raw": out}
+    _failure(payload, code, timeout, err)
+    _write_log(log_prefix, code, payload)
     return payload, code
 
-def run_kpi():
+def _run_tool(tool, script, src, log_prefix, timeout=60):
+    """
+    Инструмент функцией в этом процессе (большой вход — в пуле); без tools.py — подпроцессом.
+    Таймаут пула, исключение инструмента и запасной подпроцесс без отчёта -> report["error"].
+    """
+    argv = [str(src)]
+    if tools is None or not tools.enabled():
+        return _run_json(["python3", str(script), *argv], log_prefix, timeout=timeout)
+    if src.stat().st_size >= PROC_MIN_BYTES:
+        res = _pool().call(tool, argv, timeout=timeout)
+    else:
+        res = tools.call(tool, argv)
+    report = res["report"] if isinstance(res["report"], dict) else {"raw": res["report"]}
+    _failure(report, res["code"], timeout, res.get("error", ""))
+    _write_log(log_prefix, res["code"], report)
+    return report, res["code"]
+
+def run_kpi(timeout=60):
     script = ROOT / "scripts" / "validate_kpi.py"
     src = ROOT / "data" / "sample_kpi.csv"
     if not script.exists() or not src.exists():
         return {"skipped": True, "reason": "missing validator or sample data"}, 0
-    return _run_json(["python3", str(script), str(src)], "validator-kpi", timeout=60)
+    return _run_tool("validate_kpi", script, src, "validator-kpi", timeout=timeout)
 
-def run_geo():
+def run_geo(timeout=60):
     script = ROOT / "scripts" / "geo_check.py"
     src = ROOT / "data" / "sample_geo.csv"
     if not script.exists() or not src.exists():
         return {"skipped": True, "reason": "missing geo validator or sample data"}, 0
-    return _run_json(["python3", str(script), str(src)], "validator-geo", timeout=60)
+    return _run_tool("geo_check", script, src, "validator-geo", timeout=timeout)
 
-def main():
-    issues = []
-    exit_code = 0
+# --- Проверки ---
+# Каждая проверка -> (issues, код выхода); порядок issues в отчёте — порядок CHECKS,
+# независимо от того, какая проверка закончилась раньше.
+def check_build(timeout):
+    if have_build():
+        return [], 0
+    return [{"kind":"assets","where":"dist","msg":"Нет build-артефактов: dist/index.html или dist/assets","level":"error"}], 1
 
-    # 1) Build artifacts
-    if not have_build():
-        issues.append({"kind":"assets","where":"dist","msg":"Нет build-артефактов: dist/index.html или dist/assets","level":"error"})
-        exit_code = 1
-
-    # 2) Policy reminder
-    issues.append({
+def check_policy(timeout):
+    return [{
         "kind":"map-kpis","where":"data",
         "msg":"Скрывать нули, округление 0.1, единицы ц/га и %, дедуп по ключу Контрагент+Год",
         "fix": None, "level":"warn"
-    })
-
-    # 3) KPI validator
-    kpi_report, _ = run_kpi()
-    if not kpi_report.get("skipped"):
-        kpi_errs = len(kpi_report.get("errors", []) or [])
-        kpi_warns = len(kpi_report.get("warnings", []) or [])
-        issues.append({
-            "kind":"kpi","where":kpi_report.get("source","data/sample_kpi.csv"),
-            "msg":f"KPI: {kpi_report.get('rows_in')}→{kpi_report.get('rows_out')}, err={kpi_errs}, warn={kpi_warns}",
-            "level":"error" if kpi_errs>0 else "info",
-            "clean_path":kpi_report.get("clean_path")
-        })
-        if kpi_errs>0: exit_code = 1
-    else:
-        issues.append({"kind":"kpi","where":"scripts/validate_kpi.py","msg":f"skipped: {kpi_report.get('reason')}","level":"info"})
-
-    # 4) GEO validator
-    geo_report, _ = run_geo()
-    if not geo_report.get("skipped"):
-        geo_errs = len(geo_report.get("errors", []) or [])
-        geo_warns = len(geo_report.get("warnings", []) or [])
-        issues.append({
-            "kind":"geo","where":geo_report.get("source","data/sample_geo.csv"),
-            "msg":f"GEO: {geo_report.get('rows_in')}→{geo_report.get('rows_out')}, err={geo_errs}, warn={geo_warns}",
-            "level":"error" if geo_errs>0 else "info",
-            "clean_path":geo_report.get("clean_path")
-        })
-        if geo_errs>0: exit_code = 1
-    else:
-        issues.append({"kind":"geo","where":"scripts/geo_check.py","msg":f"skipped: {geo_report.get('reason')}","level":"info"})
+    }], 0
+
+def _validator_issue(kind, label, script, report, default_src, code=0):
+    if report.get("skipped"):
+        return [{"kind":kind,"where":script,"msg":f"skipped: {report.get('reason')}","level":"info"}], 0
+    errs = len(report.get("errors", []) or [])
+    warns = len(report.get("warnings", []) or [])
+    # валидатор не отработал (исключение, таймаут, падение подпроцесса): код 1 бывает и
+    # при найденных ошибках данных, но тогда в отчёте есть errors и нет "error"
+    failure = report.get("error") or (f"exit code {code}" if code and not errs else None)
+    if failure:
+        return [{
+            "kind":kind,"where":script,
+            "msg":f"{label}: валидатор не отработал (код {code}): {str(failure)[:300]}",
+            "level":"error"
+        }], 1
+    return [{
+        "kind":kind,"where":report.get("source",default_src),
+        "msg":f"{label}: {report.get('rows_in')}→{report.get('rows_out')}, err={errs}, warn={warns}",
+        "level":"error" if errs>0 else "info",
+        "clean_path":report.get("clean_path")
+    }], 1 if errs>0 else 0
+
+def check_kpi(timeout):
+    report, code = run_kpi(timeout)
+    return _validator_issue("kpi", "KPI", "scripts/validate_kpi.py", report, "data/sample_kpi.csv", code)
 
-    # 5) Public data presence (front reads /data/*.csv from dist)
+def check_geo(timeout):
+    report, code = run_geo(timeout)
+    return _validator_issue("geo", "GEO", "scripts/geo_check.py", report, "data/sample_geo.csv", code)
+
+def check_public_data(timeout):
+    # front reads /data/*.csv from dist
+    issues = []
     need = [("public/data/kpi.csv","/data/kpi.csv"), ("public/data/geo.csv","/data/geo.csv")]
     for fs_path, url_path in need:
         p = ROOT / fs_path
@@ -114,8 +166,117 @@ def main():
                 "level":"warn",
                 "fix":"Запусти: /run?task=publish (если есть cleaned_*), или /run?task=ensure (создать заглушки)"
             })
+    # manifest.json (scripts/versioned.py): фронт берёт файлы с хешем и дельты — все должны быть на месте
+    manifest = ROOT / "public" / "data" / "manifest.json"
+    if manifest.exists():
+        try:
+            m = json.loads(manifest.read_text(encoding="utf-8"))
+            files = list(m.get("files", {}).values()) + \
+                    [d for step in m.get("deltas", []) for d in step.get("files", {}).values()]
+        except (ValueError, AttributeError):
+            files = None
+        broken = ["manifest.json"] if files is None else \
+                 [e.get("path", "?") for e in files if not (manifest.parent / e.get("path", "")).is_file()]
+        if broken:
+            issues.append({
+                "kind":"public-data","where":"public/data/manifest.json",
+                "msg":f"manifest.json ссылается на отсутствующие файлы: {', '.join(broken)}",
+                "level":"warn",
+                "fix":"Запусти: /run?task=publish (перепубликует и пересоберёт манифест)"
+            })
+    return issues, 0
+
+# (имя, функция, зависимости, таймаут, с) — маленький DAG: независимые проверки идут
+# параллельно, проверка с зависимостями стартует после них (упавшая/зависшая
+# зависимость -> проверка пропускается).
+CHECKS = [
+    ("build",       check_build,       (), 10),
+    ("policy",      check_policy,      (), 10),
+    ("kpi",         check_kpi,         (), 60),
+    ("geo",         check_geo,         (), 60),
+    ("public-data", check_public_data, (), 10),
+]
 
-    report = {"issues": issues}
+class _Node:
+    def __init__(self, name, fn, deps, timeout):
+        self.name, self.fn, self.deps, self.timeout = name, fn, deps, timeout
+        self.started, self.done = threading.Event(), threading.Event()
+        self.status, self.t0, self.elapsed = "pending", None, None
+        self.issues, self.code, self.error = [], 0, ""
+        self.lock = threading.Lock()
+
+    def finish(self, status, issues=(), code=0, error=""):
+        """Первый вызов побеждает: результат опоздавшего потока после таймаута отбрасывается."""
+        with self.lock:
+            if self.done.is_set():
+                return
+            self.status, self.issues, self.code, self.error = status, list(issues), code, error
+            self.elapsed = time.perf_counter() - self.t0 if self.t0 is not None else 0.0
+            self.done.set()
+
+def _run_node(node, nodes, tr):
+    for d in node.deps:
+        nodes[d].done.wait()
+    bad = [d for d in node.deps if nodes[d].status != "ok"]
+    node.t0 = time.perf_counter()
+    node.started.set()
+    if bad:
+        node.finish("skipped", error=f"dependency failed: {', '.join(bad)}")
+        return
+    try:
+        with tr.stage(node.name):
+            issues, code = node.fn(node.timeout)
+        node.finish("ok", issues, code)
+    except Exception as e:
+        node.finish("failed", error=repr(e))
+
+def run_dag(checks, tr, parallel=True):
+    """-> узлы в порядке checks. Потоки-демоны: зависшая проверка не держит выход процесса."""
+    nodes = {name: _Node(name, fn, deps, timeout) for name, fn, deps, timeout in checks}
+    t_start = time.perf_counter()
+    for node in nodes.values():
+        if parallel:
+            threading.Thread(target=_run_node, args=(node, nodes, tr), daemon=True,
+                             name=f"diag-{node.name}").start()
+        else:
+            _run_node(node, nodes, tr)
+    # в порядке checks зависимости разбираются раньше зависимых — ожидание не зациклится
+    for node in nodes.values():
+        node.started.wait()
+        if not node.done.wait(max(0.0, node.timeout - (time.perf_counter() - node.t0))):
+            node.finish("timeout", error=f"no result in {node.timeout}s")
+    return list(nodes.values()), time.perf_counter() - t_start, t_start
+
+def run_checks(parallel=True):
+    """-> (код выхода, отчёт {"issues": [...], "checks": [...], "wall_s"})."""
+    tr = instrument.Tracer("diagnostics")
+    try:
+        nodes, wall, t_start = run_dag(CHECKS, tr, parallel)
+    finally:
+        if _POOL is not None:
+            _POOL.shutdown()
+    issues, exit_code, timings = [], 0, []
+    for n in nodes:
+        issues += n.issues
+        if n.status != "ok":
+            issues.append({"kind":"check","where":n.name,"msg":f"{n.status}: {n.error}","level":"error"})
+        if n.code or n.status in ("timeout", "failed"):
+            exit_code = 1
+        timings.append({"name": n.name, "deps": list(n.deps), "status": n.status,
+                        "start_s": round(n.t0 - t_start, 4), "elapsed_s": round(n.elapsed, 4),
+                        "timeout_s": n.timeout})
+    return exit_code, tr.attach({"issues": issues, "checks": timings, "parallel": parallel, "wall_s": round(wall, 4)})
+
+def run(argv=None):
+    """-> (код выхода, отчёт); также для scripts/tools.py (тёплый пул оркестратора)."""
+    ap = argparse.ArgumentParser(description="RayAgro diagnostics")
+    ap.add_argument("--json", action="store_true", help="отчёт JSON (всегда; флаг для совместимости)")
+    ap.add_argument("--serial", action="store_true", help="проверки по очереди, без потоков")
+    args = ap.parse_args(argv)
+    return run_checks(parallel=not args.serial)
+
+def main():
+    exit_code, report = instrument.profiled("diagnostics", run)
     print(json.dumps(report, ensure_ascii=False, indent=2))
     return exit_code
 
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк конвейера на синтетических данных (офлайн, только stdlib):
+- генераторы KPI/GEO с сидом: ключи Контрагент+Год, доля дублей ключа, нулевых/пустых
+  урожайностей, плохих координат (вне диапазона/пусто/текст) и ключей без пары в GEO
+  — по умолчанию как в реальных выгрузках (RATES); файлы кэшируются в data/.cache/bench/
+- шаги: validate_kpi, geo_check, join_check, publish_data, pipeline (те же четыре одним
+  процессом, см. pipeline.py), diagnostics.py — каждый
+  отдельным процессом в песочнице data/.cache/bench/work/ (копия scripts/ + diagnostics.py),
+  так что data/ и public/data/ репозитория не трогаются
+- на шаг: лучшее из --repeat wall, пик RSS процесса (wait4), rows/sec, код выхода
+  и стадии из "timings" отчёта инструмента (см. instrument.py)
+- --save-baseline пишет bench/baseline.json (на своей машине CI: числа зависят от железа);
+  без него прогон сравнивается с базой: rows/sec ниже базы больше чем на --threshold
+  или пик RSS выше больше чем на --mem-threshold -> регрессия, код выхода 1
+Отчёт — stdout и logs/bench-<ts>.json.
+  python3 scripts/bench.py --sizes 10k,1m --repeat 3 [--save-baseline]
+"""
+import argparse, json, os, platform, random, shutil, subprocess, sys, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+CACHE = ROOT / "data" / ".cache" / "bench"
+WORK = CACHE / "work"
+BASELINE = ROOT / "bench" / "baseline.json"
+LOGS = ROOT / "logs"
+GEN_VERSION = 1
+SCHEMA = 1
+
+YEARS = list(range(2015, 2025))
+RATES = {"dup": 0.01, "zero_yield": 0.02, "bad_coord": 0.01, "geo_missing": 0.05}
+STEPS = ["validate_kpi", "geo_check", "join_check", "publish_data", "pipeline", "diagnostics"]
+NEEDS = {"join_check": ["validate_kpi", "geo_check"], "publish_data": ["validate_kpi", "geo_check"]}
+
+def parse_size(s):
+    s = s.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1:], 1)
+    return int(float(s[:-1] if mult > 1 else s) * mult)
+
+def size_label(n):
+    for div, suf in ((1_000_000, "m"), (1_000, "k")):
+        if n >= div and n % div == 0:
+            return f"{n // div}{suf}"
+    return str(n)
+
+def keys(rows, rng):
+    """Ключи Контрагент+Год по порядку; с вероятностью RATES["dup"] — повтор уже выданного."""
+    issued = []
+    for i in range(rows):
+        if issued and rng.random() < RATES["dup"]:
+            yield rng.choice(issued)
+            continue
+        key = (f"Хозяйство-{i // len(YEARS):07d}", str(YEARS[i % len(YEARS)]))
+        if len(issued) < 4096:
+            issued.append(key)
+        else:
+            issued[rng.randrange(4096)] = key
+        yield key
+
+def gen_kpi(path, rows, seed):
+    krng = random.Random(seed)         # ключи — отдельным генератором, как в gen_geo
+    rng = random.Random(seed + 2)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("Контрагент,Год,Урожайность_ц_га\n")
+        for contr, year in keys(rows, krng):
+            r = rng.random()
+            if r < RATES["zero_yield"]:
+                y = "0" if r < RATES["zero_yield"] / 2 else ""
+            else:
+                y = f"{max(0.1, rng.gauss(42.0, 9.0)):.2f}"
+            f.write(f"{contr},{year},{y}\n")
+
+def gen_geo(path, rows, seed):
+    rng = random.Random(seed)          # тот же сид -> те же ключи, что в KPI
+    crng = random.Random(seed + 1)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("Контрагент,Год,Широта,Долгота\n")
+        for contr, year in keys(rows, rng):
+            if crng.random() < RATES["geo_missing"]:
+                continue
+            r = crng.random()
+            if r < RATES["bad_coord"]:
+                lat, lon = crng.choice([("91.5", "37.6"), ("55.7", "-181.0"), ("", "37.6"), ("n/a", "x")])
+            else:
+                lat, lon = f"{crng.uniform(43.0, 58.0):.6f}", f"{crng.uniform(30.0, 60.0):.6f}"
+            f.write(f"{contr},{year},{lat},{lon}\n")
+
+def dataset(rows, seed):
+    """-> (kpi.csv, geo.csv) из кэша или свежесгенерированные."""
+    CACHE.mkdir(parents=True, exist_ok=True)
+    out = []
+    for kind, gen in (("kpi", gen_kpi), ("geo", gen_geo)):
+        path = CACHE / f"{kind}-{size_label(rows)}-s{seed}-v{GEN_VERSION}.csv"
+        if not path.exists():
+            tmp = path.with_suffix(".tmp")
+            gen(tmp, rows, seed)
+            os.replace(tmp, path)
+        out.append(path)
+    return out
+
+def prepare_work(kpi, geo):
+    """Песочница: свой ROOT для инструментов, входы — ссылками на кэш генератора."""
+    shutil.rmtree(WORK, ignore_errors=True)
+    (WORK / "scripts").mkdir(parents=True)
+    (WORK / "data").mkdir()
+    for p in (ROOT / "scripts").glob("*.py"):
+        shutil.copy2(p, WORK / "scripts" / p.name)
+    shutil.copy2(ROOT / "diagnostics.py", WORK / "diagnostics.py")
+    for src, name in ((kpi, "sample_kpi.csv"), (geo, "sample_geo.csv")):
+        (WORK / "data" / name).symlink_to(src)
+
+def run_step(step):
+    """-> (код, wall, пик RSS МБ, отчёт); wait4 даёт rusage именно этого процесса."""
+    script = WORK / ("diagnostics.py" if step == "diagnostics" else f"scripts/{step}.py")
+    argv = {"validate_kpi": ["data/sample_kpi.csv"], "geo_check": ["data/sample_geo.csv"],
+            "diagnostics": ["--json"]}.get(step, [])
+    env = {**os.environ, "RAYAGRO_TRACE": "0"}
+    t0 = time.perf_counter()
+    p = subprocess.Popen([sys.executable, str(script), *argv], cwd=WORK, env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    out = p.stdout.read()
+    p.stdout.close()
+    if hasattr(os, "wait4"):
+        _, status, ru = os.wait4(p.pid, 0)
+        code = os.waitstatus_to_exitcode(status)
+        rss = round(ru.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+        p.returncode = code
+    else:
+        code, rss = p.wait(), None
+    wall = time.perf_counter() - t0
+    try:
+        report = json.loads(out)
+    except ValueError:
+        report = {}
+    return code, wall, rss, report
+
+def step_rows(step, report, rows):
+    if step in ("validate_kpi", "geo_check"):
+        return report.get("rows_in", rows)
+    if step == "join_check":
+        return (report.get("geo_keys") or 0) + (report.get("kpi_keys") or 0)
+    if step == "pipeline":
+        stages = report.get("stages", {})
+        return sum(stages.get(s, {}).get("rows_in", rows) for s in ("validate_kpi", "geo_check"))
+    return rows   # publish_data, diagnostics — масштаб входа
+
+def bench_size(rows, seed, repeat, steps):
+    t0 = time.perf_counter()
+    kpi, geo = dataset(rows, seed)
+    gen_s = time.perf_counter() - t0
+    prepare_work(kpi, geo)
+    out = {"rows": rows, "generate_s": round(gen_s, 3),
+           "inputs": {"kpi_bytes": kpi.stat().st_size, "geo_bytes": geo.stat().st_size}, "steps": {}}
+    needed = set(steps).union(*(NEEDS.get(s, []) for s in steps))
+    for step in [s for s in STEPS if s in needed]:
+        if step not in steps:      # только подготовить входы следующих шагов
+            run_step(step)
+            continue
+        runs = [run_step(step) for _ in range(repeat)]
+        _, wall, _, report = min(runs, key=lambda r: r[1])
+        rss = min((r[2] for r in runs if r[2] is not None), default=None)
+        code = max(r[0] for r in runs)
+        n = step_rows(step, report, rows)
+        res = {"code": code, "wall_s": round(wall, 4), "peak_rss_mb": rss, "rows": n,
+               "rows_per_s": round(n / wall) if wall > 0 else None}
+        if "timings" in report:
+            res["stages"] = {s["name"]: s["wall_s"] for s in report["timings"]["stages"]}
+        if code not in (0, 1):        # 1 — найденные в данных ошибки, это ожидаемо
+            res["crashed"] = True
+        out["steps"][step] = res
+    return out
+
+def compare(result, baseline, threshold, mem_threshold):
+    """-> список регрессий относительно базы (только размеры и шаги, что есть в базе)."""
+    regressions = []
+    for label, cur in result["sizes"].items():
+        base = baseline.get("sizes", {}).get(label)
+        if not base:
+            continue
+        for step, now in cur["steps"].items():
+            ref = base["steps"].get(step)
+            if not ref:
+                continue
+            if ref.get("rows_per_s") and now.get("rows_per_s") is not None:
+                ratio = now["rows_per_s"] / ref["rows_per_s"]
+                if ratio < 1 - threshold:
+                    regressions.append({"size": label, "step": step, "metric": "rows_per_s",
+                                        "baseline": ref["rows_per_s"], "now": now["rows_per_s"],
+                                        "change": round(ratio - 1, 3)})
+            if ref.get("peak_rss_mb") and now.get("peak_rss_mb") is not None:
+                ratio = now["peak_rss_mb"] / ref["peak_rss_mb"]
+                if ratio > 1 + mem_threshold:
+                    regressions.append({"size": label, "step": step, "metric": "peak_rss_mb",
+                                        "baseline": ref["peak_rss_mb"], "now": now["peak_rss_mb"],
+                                        "change": round(ratio - 1, 3)})
+    return regressions
+
+def host_info():
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count()}
+
+def main():
+    ap = argparse.ArgumentParser(description="Pipeline benchmark on seeded synthetic KPI/GEO data")
+    ap.add_argument("--sizes", default="10k", help="через запятую: 10k,1m,10m")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--repeat", type=int, default=3, help="прогонов на шаг, берётся лучший")
+    ap.add_argument("--steps", default=",".join(STEPS),
+                    help="какие шаги замерять; нужные им входы готовятся без замера")
+    ap.add_argument("--baseline", default=str(BASELINE))
+    ap.add_argument("--save-baseline", action="store_true", help="записать результат как базу")
+    ap.add_argument("--threshold", type=float, default=0.20, help="допустимое падение rows/sec (доля)")
+    ap.add_argument("--mem-threshold", type=float, default=0.25, help="допустимый рост пика RSS (доля)")
+    ap.add_argument("--keep", action="store_true", help="не удалять песочницу после прогона")
+    args = ap.parse_args()
+
+    steps = [s for s in args.steps.split(",") if s]
+    unknown = sorted(set(steps) - set(STEPS))
+    if unknown:
+        ap.error(f"unknown steps: {', '.join(unknown)}")
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+
+    result = {"schema": SCHEMA, "seed": args.seed, "repeat": args.repeat, "rates": RATES,
+              "host": host_info(), "created": int(time.time()), "sizes": {}}
+    try:
+        for n in sizes:
+            result["sizes"][size_label(n)] = bench_size(n, args.seed, max(1, args.repeat), steps)
+    finally:
+        if not args.keep:
+            shutil.rmtree(WORK, ignore_errors=True)
+
+    baseline_path = Path(args.baseline)
+    code = 0
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        result["baseline"] = {"saved": str(baseline_path)}
+    elif baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        regressions = compare(result, baseline, args.threshold, args.mem_threshold)
+        result["baseline"] = {"path": str(baseline_path), "threshold": args.threshold,
+                              "mem_threshold": args.mem_threshold, "regressions": regressions}
+        if regressions:
+            code = 1
+    else:
+        result["baseline"] = {"path": str(baseline_path), "missing": True}
+    if any(s.get("crashed") for size in result["sizes"].values() for s in size["steps"].values()):
+        code = 1
+
+    LOGS.mkdir(parents=True, exist_ok=True)
+    (LOGS / f"bench-{int(time.time())}.json").write_text(
+        json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return code
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Типизированная колоночная копия очищенных CSV (--columnar у валидаторов):
+- Arrow IPC (<name>.arrow), если установлен pyarrow
+- иначе каталог <name>.cols/ с отдельным .npy на колонку + schema.json;
+  .npy пишется stdlib-кодом (numpy не нужен), читается np.load(..., mmap_mode="r")
+Колонки называются латиницей (contragent, year, yield, lat, lon, ...):
+числа — float64 (пусто -> NaN), год — int32 (если все значения целые), строки — юникод.
+Контрагент — int32 id словаря keydict.py (тип id), имена по id лежат в самом артефакте:
+<колонка>.values.npy ("dictionaries" в schema.json), у Arrow — dictionary-колонка. У копий
+pipeline.py id — из постоянного data/keys.csv, общие для всех файлов версии.
+"""
+import array, csv, json, math, shutil, struct, sys
+from itertools import repeat
+from pathlib import Path
+
+import keydict
+from columns import ColumnResolver, KPI_FIELDS, GEO_FIELDS, JOINED_FIELDS, STATS_FIELDS
+
+FORMATS = ("auto", "arrow", "npy")
+NPY_BLOCK = 1 << 16     # строк на один encode при записи строковой колонки
+
+# (имя колонки, тип): str | f8 | year | key
+KPI_SCHEMA = [("contragent", "key"), ("year", "year"), ("yield", "f8")]
+GEO_SCHEMA = [("contragent", "key"), ("year", "year"), ("lat", "f8"), ("lon", "f8")]
+JOINED_SCHEMA = GEO_SCHEMA + [("yield", "f8")]
+STATS_SCHEMA = [("contragent", "key"), ("mean", "f8"), ("sd", "f8"), ("cv", "f8"), ("waasb_proxy", "f8")]
+
+SCHEMAS = {
+    "kpi": (KPI_SCHEMA, KPI_FIELDS),
+    "geo": (GEO_SCHEMA, GEO_FIELDS),
+    "joined": (JOINED_SCHEMA, JOINED_FIELDS),
+    "stats": (STATS_SCHEMA, STATS_FIELDS),
+}
+
+def _f8(v):
+    try:
+        return float(v) if v != "" else math.nan
+    except ValueError:
+        return math.nan
+
+def read_columns(csv_path, kind, keys):
+    """CSV -> {колонка: (тип, значения)}; тип year сводится к int32 или str, key — к id."""
+    schema, fields = SCHEMAS[kind]
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        rdr = csv.reader(f)
+        cols = ColumnResolver(next(rdr, []), fields)
+        getters = [cols.getter(name) for name, _ in schema]
+        raw = [[] for _ in schema]
+        for row in rdr:
+            if not row:
+                continue
+            for vals, get in zip(raw, getters):
+                vals.append(get(row))
+    return typed_columns(kind, raw, keys)
+
+def typed_columns(kind, raw, keys):
+    """
+    Строковые колонки в порядке схемы kind -> {колонка: (тип, значения)}, как read_columns;
+    id колонок key — из keys (keydict.KeyDict), его же передают в write_columns.
+    """
+    schema, _ = SCHEMAS[kind]
+    out = {}
+    for (name, typ), vals in zip(schema, raw):
+        if typ == "key":
+            out[name] = ("id", array.array("i", keys.ids("contragent", vals)))
+        elif typ == "f8":
+            out[name] = ("f8", array.array("d", map(_f8, vals)))
+        elif typ == "year" and all(v.lstrip("-").isdigit() for v in vals):
+            out[name] = ("i4", array.array("i", map(int, vals)))
+        else:
+            out[name] = ("str", vals)
+    return out
+
+def _npy_header(descr, n):
+    endian = "<" if sys.byteorder == "little" else ">"
+    if descr[0] not in "<>|":
+        descr = endian + descr
+    h = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, n)
+    pad = 64 - (10 + len(h) + 1) % 64
+    h = (h + " " * (pad % 64) + "\n").encode("latin1")
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(h)) + h
+
+def write_npy(path, typ, values):
+    with open(path, "wb") as f:
+        if typ == "str":
+            width = max([len(v) for v in values] + [1])
+            f.write(_npy_header(f"<U{width}", len(values)))
+            # добивка "\0" до width символов = нулевые байты UTF-32; кодируем блоками, не по значению
+            for i in range(0, len(values), NPY_BLOCK):
+                block = values[i:i + NPY_BLOCK]
+                f.write("".join(map(str.ljust, block, repeat(width), repeat("\0"))).encode("utf-32-le"))
+        else:
+            f.write(_npy_header("i4" if typ == "id" else typ, len(values)))
+            f.write(values.tobytes())
+
+def _write_arrow(path, columns, names):
+    import pyarrow as pa
+
+    types = {"f8": pa.float64(), "i4": pa.int32(), "str": pa.string()}
+    arrays = {}
+    for name, (typ, vals) in columns.items():
+        if typ == "id":
+            arrays[name] = pa.DictionaryArray.from_arrays(pa.array(list(vals), type=pa.int32()),
+                                                          pa.array(names, type=pa.string()))
+        else:
+            arrays[name] = pa.array(list(vals), type=types[typ])
+    table = pa.table(arrays)
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as w:
+        w.write_table(table)
+
+def _arrow_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def artifact_paths(csv_path):
+    """Возможные колоночные артефакты рядом с CSV: (arrow-файл, npy-каталог)."""
+    p = Path(csv_path)
+    return p.with_suffix(".arrow"), p.with_suffix(".cols")
+
+def export(csv_path, kind, fmt="auto", keys=None):
+    """Пишет колоночную копию csv_path (keys — словарь id, по умолчанию свой); -> {"path", "format", "rows"}."""
+    keys = keys or keydict.KeyDict()
+    return write_columns(csv_path, read_columns(csv_path, kind, keys), keys, fmt)
+
+def write_columns(csv_path, columns, keys, fmt="auto"):
+    """
+    Готовые колонки (read_columns/typed_columns с тем же keys) -> артефакт рядом с csv_path;
+    другой формат убирается.
+    """
+    if fmt == "auto":
+        fmt = "arrow" if _arrow_available() else "npy"
+    arrow_path, npy_dir = artifact_paths(csv_path)
+    rows = len(next(iter(columns.values()))[1]) if columns else 0
+    if fmt == "arrow":
+        shutil.rmtree(npy_dir, ignore_errors=True)
+        _write_arrow(arrow_path, columns, keys.values["contragent"])
+        return {"path": str(arrow_path), "format": "arrow", "rows": rows}
+
+    arrow_path.unlink(missing_ok=True)
+    npy_dir.mkdir(parents=True, exist_ok=True)
+    schema = {"rows": rows, "columns": {}}
+    for name, (typ, vals) in columns.items():
+        write_npy(npy_dir / f"{name}.npy", typ, vals)
+        schema["columns"][name] = typ
+        if typ == "id":
+            write_npy(npy_dir / f"{name}.values.npy", "str", keys.values["contragent"])
+            schema.setdefault("dictionaries", {})[name] = f"{name}.values.npy"
+    (npy_dir / "schema.json").write_text(json.dumps(schema, ensure_ascii=False, indent=2), encoding="utf-8")
+    return {"path": str(npy_dir), "format": "npy", "rows": rows}
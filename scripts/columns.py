@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Разбор заголовка CSV один раз на файл:
+- логическое поле (contragent, year, yield, lat, lon) -> индексы колонок
+- алиасы те же, что были в pick() (регистр не важен, точное имя в приоритете)
+- отсутствующие и неоднозначные (совпало несколько алиасов) поля — в report()
+Строки дальше читаются по фиксированным индексам, без dict на строку.
+"""
+
+KPI_FIELDS = {
+    "contragent": ["Контрагент", "contragent", "client", "Компания"],
+    "year":       ["Год", "year"],
+    "yield":      ["Урожайность_ц_га", "Урожайность, ц/га", "Yield_c_ha", "Yield", "yield", "y"],
+}
+
+GEO_FIELDS = {
+    "contragent": KPI_FIELDS["contragent"],
+    "year":       KPI_FIELDS["year"],
+    "lat":        ["Широта", "lat", "latitude"],
+    "lon":        ["Долгота", "lon", "long", "lng", "longitude"],
+}
+
+JOINED_FIELDS = {**GEO_FIELDS, "yield": KPI_FIELDS["yield"]}
+
+STATS_FIELDS = {
+    "contragent":  KPI_FIELDS["contragent"],
+    "mean":        ["Mean_ц_га"],
+    "sd":          ["SD_ц_га"],
+    "cv":          ["CV_%"],
+    "waasb_proxy": ["WAASB_proxy"],
+}
+
+class ColumnResolver:
+    def __init__(self, header, fields):
+        self.header = list(header)
+        self.fields = fields
+        self.index = {}
+        exact = {}
+        lower = {}
+        for i, name in enumerate(self.header):
+            exact.setdefault(name, i)
+            lower.setdefault(name.lower(), []).append(i)
+        for field, aliases in fields.items():
+            idx = []
+            for a in aliases:
+                for i in [exact.get(a)] + lower.get(a.lower(), []):
+                    if i is not None and i not in idx:
+                        idx.append(i)
+            self.index[field] = tuple(idx)
+
+    @property
+    def missing(self):
+        return [f for f, idx in self.index.items() if not idx]
+
+    @property
+    def ambiguous(self):
+        return {f: [self.header[i] for i in idx] for f, idx in self.index.items() if len(idx) > 1}
+
+    def name(self, field):
+        """Каноническое имя поля (первый алиас) — для сообщений и выходных CSV."""
+        return self.fields[field][0]
+
+    def getter(self, field):
+        """
+        row(list) -> str. Одна колонка — прямой доступ по индексу; при нескольких
+        совпадениях берётся первое непустое значение в порядке алиасов (как в pick()).
+        """
+        idx = self.index[field]
+        if not idx:
+            return lambda row: ""
+        if len(idx) == 1:
+            i = idx[0]
+            return lambda row: row[i] if i < len(row) else ""
+
+        def get(row):
+            for i in idx:
+                if i < len(row) and row[i] != "":
+                    return row[i]
+            return ""
+        return get
+
+    def report(self):
+        return {
+            "resolved": {f: self.header[idx[0]] for f, idx in self.index.items() if idx},
+            "missing": self.missing,
+            "ambiguous": self.ambiguous,
+        }
+
+    def warnings(self):
+        out = [{"msg": f"Не найдена колонка для '{f}' (алиасы: {', '.join(self.fields[f])})"}
+               for f in self.missing]
+        out += [{"msg": f"Неоднозначная колонка для '{f}': {', '.join(cols)} — берётся первая непустая"}
+                for f, cols in self.ambiguous.items()]
+        return out
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Построчные дельты публикуемых таблиц с ключом (Контрагент, Год) (versioned.Publisher.deltas):
+- быстрый путь (в файлах нет кавычек): строки сравниваются как текст через множества —
+  разбираются на поля только строки, которых нет в другой версии (обычно единицы из
+  миллиона); иначе обе версии читаются fastcsv.py и сравниваются по полям
+- дельта — CSV с колонками op, pos перед колонками файла: "-" — удалить ключ (заполнены
+  только ключевые поля), "=" — заменить строку с этим ключом на месте, "+" — вставить новую
+  строку так, чтобы она стала строкой pos (с 0) новой версии; строки идут по порядку новой
+  версии, "-" — в начале
+- применение (components/delta.js): удалить "-", заменить "=", вставить "+" по возрастанию
+  pos — получается ровно новая версия, строка в строку; строка, сменившая место среди
+  уцелевших (например, после дедупа первой стала другая копия ключа), — это "-" и "+":
+  на месте остаётся наибольшая возрастающая подпоследовательность, двигается минимум строк
+- полный файл — когда дельта не выгоднее: заголовок поменялся, ключ не уникален, изменилось
+  больше MAX_RATIO (RAYAGRO_DELTA_MAX_RATIO, 0.5) строк или дельта больше этой доли файла
+Ключи уникальны в обеих версиях — валидаторы дедуплицируют по (Контрагент, Год).
+Имена — <имя>.delta.<хеш>.csv (delta_name + versioned.hashed_name), цепочка — в manifest.json.
+"""
+import csv, os
+from bisect import bisect_left
+from itertools import compress, filterfalse
+from operator import not_
+
+import fastcsv
+from columns import ColumnResolver
+
+KEYED = {"kpi.csv": "kpi", "geo.csv": "geo", "joined.csv": "joined"}   # имя -> схема fastcsv
+KEY = ("contragent", "year")
+MAX_RATIO = float(os.getenv("RAYAGRO_DELTA_MAX_RATIO", "0.5"))
+
+def delta_name(name):
+    """kpi.csv -> kpi.delta.csv (логическое имя дельты; на диске — с хешем)."""
+    stem, _, ext = name.rpartition(".")
+    return f"{stem}.delta.{ext}"
+
+def _lines(path):
+    """
+    Непустые строки файла без перевода строки; None — есть кавычки (поле может занимать
+    несколько строк) или одиночный \r (для csv — тоже перевод строки).
+    """
+    text = fastcsv.read_text(path)
+    if '"' in text:
+        return None
+    sep = "\n"
+    if "\r" in text:
+        crlf = text.count("\r\n")
+        if text.count("\r") != crlf:
+            return None
+        if text.count("\n") == crlf:     # как пишут csv.writer и fastcsv.write
+            sep = "\r\n"
+        else:
+            text = text.replace("\r\n", "\n")
+    return [ln for ln in text.split(sep) if ln]
+
+def _stable(order):
+    """Индексы наибольшей возрастающей подпоследовательности order (строки, оставшиеся на местах)."""
+    tails, at, parent = [], [], [-1] * len(order)
+    for j, v in enumerate(order):
+        k = bisect_left(tails, v)
+        if k:
+            parent[j] = at[k - 1]
+        if k == len(tails):
+            tails.append(v)
+            at.append(j)
+        else:
+            tails[k], at[k] = v, j
+    keep, j = set(), at[-1] if at else -1
+    while j >= 0:
+        keep.add(j)
+        j = parent[j]
+    return keep
+
+def _prefix(a, b):
+    """Длина общего начала списков: двоичный поиск сравнениями срезов (в C)."""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def _moved(seq_old, seq_new):
+    """Позиции в seq_new (одни и те же элементы в другом порядке), которые надо переставить."""
+    n = len(seq_new)
+    lo = _prefix(seq_old, seq_new)
+    hi = n - _prefix(seq_old[lo:][::-1], seq_new[lo:][::-1])
+    where = {t: j for j, t in enumerate(seq_old[lo:hi])}
+    keep = _stable([where[t] for t in seq_new[lo:hi]])
+    return [lo + j for j in range(hi - lo) if j not in keep]
+
+def _rows(path, schema):
+    """-> (заголовок, индексы ключевых колонок, ключи, строки) или (None, причина)."""
+    t = fastcsv.read(path, schema)
+    idx = [t.cols.index[f] for f in KEY]
+    if any(len(i) != 1 for i in idx):
+        return None, "key columns missing or ambiguous"
+    if t.ragged:
+        return None, "ragged rows"
+    keys = list(zip(*(t.raw[i[0]] for i in idx)))
+    return (t.header, [i[0] for i in idx], keys, list(zip(*t.raw))), None
+
+def diff(old_path, new_path, schema):
+    """
+    -> (дельта {header, key_idx, deleted, changed}, None) или (None, причина полного файла).
+    deleted — удалённые ключи, changed — [((op, pos), строка)] "="/"+" в порядке новой версии.
+    """
+    old, new = _lines(old_path), _lines(new_path)
+    if old and new:
+        d, why = _diff_lines(old, new, schema)
+        rows = len(new) - 1
+    else:
+        d, why = _diff_rows(old_path, new_path, schema)
+        rows = d and d.pop("rows")
+    if d is not None and len(d["deleted"]) + len(d["changed"]) > MAX_RATIO * rows:
+        return None, f"{len(d['deleted']) + len(d['changed'])} of {rows} rows changed"
+    return d, why
+
+def _diff_lines(old, new, schema):
+    """
+    diff по тексту строк: на поля разбираются только строки, которых нет в другой версии.
+    Проходы по миллиону строк — compress/filterfalse с проверкой по множеству (в C).
+    """
+    if old[0] != new[0]:
+        return None, "header changed"
+    header = next(csv.reader(old[:1]))
+    idx = [ColumnResolver(header, fastcsv.SCHEMAS[schema][0]).index[f] for f in KEY]
+    if any(len(i) != 1 for i in idx):
+        return None, "key columns missing or ambiguous"
+    key_idx = [i[0] for i in idx]
+    old, new = old[1:], new[1:]
+    in_old, in_new = set(old), set(new)
+    gone = list(filterfalse(in_new.__contains__, old))
+    fresh_at = list(compress(range(len(new)), map(not_, map(in_old.__contains__, new))))
+    fresh = [new[i] for i in fresh_at]
+    rows = dict(zip(gone + fresh, csv.reader(gone + fresh)))
+    if any(len(r) != len(header) for r in rows.values()):
+        return None, "ragged rows"
+    key = {ln: tuple(r[i] for i in key_idx) for ln, r in rows.items()}
+    gone_by_key = {key[ln]: ln for ln in gone}
+    fresh_keys = {key[ln] for ln in fresh}
+    if len(gone_by_key) != len(gone) or len(fresh_keys) != len(fresh):
+        return None, "duplicate keys"
+
+    # уцелевшие строки: общие и заменённые (новая строка того же ключа -> старая строка)
+    as_old = {ln: gone_by_key[key[ln]] for ln in fresh if key[ln] in gone_by_key}
+    survive_old = in_new.union(as_old.values())
+    survive_new = in_old.union(as_old)
+    seq_old = list(compress(old, map(survive_old.__contains__, old)))
+    seq_new = list(compress(new, map(survive_new.__contains__, new)))
+    moved = {}
+    if as_old:
+        seq_new_old = list(map(as_old.get, seq_new, seq_new))
+    else:
+        seq_new_old = seq_new
+    if seq_old != seq_new_old:
+        # сменившие порядок — удалить и вставить заново
+        at = list(compress(range(len(new)), map(survive_new.__contains__, new)))
+        for j in _moved(seq_old, seq_new_old):
+            ln = seq_new[j]
+            if ln not in rows:
+                rows[ln] = next(csv.reader([ln]))
+                key[ln] = tuple(rows[ln][k] for k in key_idx)
+            moved[key[ln]] = (at[j], ln)
+    deleted = [key[ln] for ln in gone if key[ln] not in fresh_keys] + list(moved)
+    changed = [(i, ln) for i, ln in zip(fresh_at, fresh) if key[ln] not in moved] + list(moved.values())
+    changed = [(("=", "") if ln in as_old and key[ln] not in moved else ("+", str(i)), rows[ln])
+               for i, ln in sorted(changed)]
+    return {"header": header, "key_idx": key_idx, "deleted": deleted, "changed": changed}, None
+
+def _diff_rows(old_path, new_path, schema):
+    """diff по полям (fastcsv.py) — для файлов с кавычками."""
+    old, why = _rows(old_path, schema)
+    if old is None:
+        return None, why
+    new, why = _rows(new_path, schema)
+    if new is None:
+        return None, why
+    (oh, key_idx, okeys, orows), (nh, _, nkeys, nrows) = old, new
+    if oh != nh:
+        return None, "header changed"
+    before, after = dict(zip(okeys, orows)), dict(zip(nkeys, nrows))
+    if len(before) != len(okeys) or len(after) != len(nkeys):
+        return None, "duplicate keys"
+
+    seq_old = [k for k in okeys if k in after]
+    at = [i for i, k in enumerate(nkeys) if k in before]
+    seq_new = [nkeys[i] for i in at]
+    moved = {seq_new[j]: at[j] for j in _moved(seq_old, seq_new)} if seq_old != seq_new else {}
+    deleted = [k for k in okeys if k not in after] + list(moved)
+    changed = [(("=", "") if k in before and k not in moved else ("+", str(i)), r)
+               for i, (k, r) in enumerate(zip(nkeys, nrows)) if k in moved or before.get(k) != r]
+    return {"header": nh, "key_idx": key_idx, "deleted": deleted, "changed": changed, "rows": len(nrows)}, None
+
+def write(path, d):
+    """Дельта (diff) -> CSV (fastcsv.write: побайтно как csv.writer)."""
+    header, key_idx = d["header"], d["key_idx"]
+    width = len(header)
+    blank = [""] * width
+    rows = []
+    for k in d["deleted"]:
+        r = list(blank)
+        for i, v in zip(key_idx, k):
+            r[i] = v
+        rows.append(["-", "", *r])
+    rows.extend([*op, *r] for op, r in d["changed"])
+    cols = [list(c) for c in zip(*rows)] if rows else [[] for _ in range(width + 2)]
+    fastcsv.write(path, ["op", "pos", *header], cols)
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Быстрое чтение CSV известных схем (KPI, GEO, stats, joined) сразу в колонки:
+- диалект фиксирован (запятая, кавычки "), заголовок разбирается ColumnResolver
+- файл читается целиком (или через mmap — см. MMAP_MIN_MB: декодирование прямо из
+  страничного кэша, без промежуточной копии bytes); строки переводятся в str один раз
+- быстрый путь: нет кавычек и у всех строк одна ширина — текст режется одним split
+  в плоский список, колонка i — срез flat[i::width] (без списка на строку);
+  иначе — csv.reader + транспонирование zip(*rows) с добивкой коротких строк
+- числовые поля -> array('d'): десятичная запятая правится разом на колонку, разбор
+  map(float, ...) в C; не разобралось — NaN в значении и 1 в маске ошибок (bytearray),
+  без исключений; нечисловые/пустые/inf/nan — всё в маску
+- на время разбора отключается циклический GC: миллионы мелких str не содержат ссылок,
+  а проходы сборщика по ним удваивали время чтения
+Пустые строки пропускаются, как в csv.reader-цикле валидаторов (`if r`).
+"""
+import csv, gc, io, math, mmap, os
+from array import array
+from contextlib import contextmanager
+from itertools import compress, repeat
+from operator import ne
+
+from columns import ColumnResolver, GEO_FIELDS, JOINED_FIELDS, KPI_FIELDS, STATS_FIELDS
+
+SCHEMAS = {
+    "kpi":    (KPI_FIELDS, ("yield",)),
+    "geo":    (GEO_FIELDS, ("lat", "lon")),
+    "joined": (JOINED_FIELDS, ("lat", "lon", "yield")),
+    "stats":  (STATS_FIELDS, ("mean", "sd", "cv", "waasb_proxy")),
+}
+MMAP_MIN_MB = float(os.getenv("RAYAGRO_MMAP_MIN_MB", "64"))
+NAN = math.nan
+
+@contextmanager
+def no_gc():
+    on = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if on:
+            gc.enable()
+
+def read_text(path, encoding="utf-8-sig", use_mmap=None):
+    """Весь файл строкой; use_mmap=None — mmap для файлов от MMAP_MIN_MB."""
+    size = os.path.getsize(path)
+    if use_mmap is None:
+        use_mmap = size >= MMAP_MIN_MB * 1024 * 1024
+    with open(path, "rb") as f:
+        if use_mmap and size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return str(mm, encoding)
+        return f.read().decode(encoding)
+
+def _split_simple(text):
+    """
+    -> (header, колонки, False) без кавычек и с одинаковой шириной строк, иначе None.
+    Перевод строки заменяется на "\\n," и весь текст режется одним split(","): последнее
+    поле каждой строки кончается на "\\n" — если все n таких полей стоят на позициях
+    width-1, 2·width-1, ..., строки выровнены и колонка i — срез flat[i::width].
+    """
+    if '"' in text:
+        return None
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+        if "\r" in text:            # одиночный \r — перевод строки для csv, не для split
+            return None
+    head, _, body = text.partition("\n")
+    if not head:
+        return None
+    width = head.count(",") + 1
+    if body[:1] == "\n" or body[-2:] == "\n\n":
+        body = body.strip("\n")
+    if not body:
+        return head.split(","), [[] for _ in range(width)], False
+    if "\n\n" in body:             # пустые строки внутри — через csv.reader
+        return None
+    if body[-1] != "\n":
+        body += "\n"
+    rows = body.count("\n")
+    flat = body.replace("\n", "\n,").split(",")
+    del body
+    flat.pop()                      # "" после последнего "\n,"
+    if len(flat) != rows * width:
+        return None
+    # "\n" бывает только в конце поля: все rows штук должны попасть в последнюю колонку
+    last = "".join(flat[width - 1::width])
+    if last.count("\n") != rows:
+        return None
+    cols = [flat[i::width] for i in range(width - 1)]
+    del flat
+    cols.append(last.split("\n"))
+    cols[-1].pop()
+    return head.split(","), cols, False
+
+def _split_csv(text):
+    """-> (header, колонки по ширине заголовка, есть ли строки длиннее заголовка)."""
+    rdr = csv.reader(io.StringIO(text, newline=""))
+    header = next(rdr, [])
+    body = [r for r in rdr if r]
+    width = len(header)
+    ragged = False
+    if any(len(r) != width for r in body):
+        ragged = any(len(r) > width for r in body)
+        body = [r[:width] if len(r) >= width else r + [""] * (width - len(r)) for r in body]
+    cols = [list(c) for c in zip(*body)] if body else [[] for _ in range(width)]
+    return header, cols, ragged
+
+def parse_floats(values):
+    """
+    Колонка строк -> (array('d'), маска ошибок bytearray или None, если ошибок нет).
+    Десятичная запятая правится только если встретилась в колонке (один map(str.replace)).
+    """
+    if not values:
+        return array("d"), None
+    if "," in "".join(values):
+        values = list(map(str.replace, values, repeat(","), repeat(".")))
+    if "" in values:                                 # чаще всего мешают пустые поля
+        values = [v or "nan" for v in values]
+    try:
+        out = array("d", map(float, values))
+    except ValueError:
+        out = array("d", map(_float_or_nan, values))
+    if any(map(math.isinf, out)):                    # редкость: inf -> NaN, дальше как ошибка
+        for i, x in enumerate(out):
+            if math.isinf(x):
+                out[i] = NAN
+    mask = bytearray(map(ne, out, out))              # NaN != NaN
+    return out, (mask if 1 in mask else None)
+
+def _float_or_nan(v):
+    try:
+        return float(v)
+    except ValueError:
+        return NAN
+
+def _positions(mask):
+    i = mask.find(1)
+    while i >= 0:
+        yield i
+        i = mask.find(1, i + 1)
+
+def error_rows(mask):
+    """Индексы строк с 1 в маске (маска None — пусто)."""
+    return [] if mask is None else list(_positions(mask))
+
+class Table:
+    """
+    header, cols (ColumnResolver), rows — число строк данных;
+    raw[i] — колонка i заголовка как есть (list[str]); text(field), number(field).
+    ragged — в файле есть строки длиннее заголовка (лишние поля в raw не попали).
+    """
+    def __init__(self, header, raw, ragged, fields):
+        self.header = header
+        self.raw = raw
+        self.ragged = ragged
+        self.cols = ColumnResolver(header, fields)
+        self.rows = len(raw[0]) if raw else 0
+        self._num = {}
+
+    def text(self, field, strip=True):
+        """Логическое поле -> list[str]; при неоднозначной колонке — первое непустое."""
+        idx = self.cols.index[field]
+        if not idx:
+            return [""] * self.rows
+        col = self.raw[idx[0]] if idx[0] < len(self.raw) else [""] * self.rows
+        if len(idx) > 1:
+            alts = [self.raw[i] for i in idx[1:] if i < len(self.raw)]
+            col = [v if v != "" else next((a for a in rest if a != ""), "")
+                   for v, *rest in zip(col, *alts)]
+        return list(map(str.strip, col)) if strip else col
+
+    def number(self, field):
+        """-> (array('d') с NaN на месте ошибок, маска ошибок или None)."""
+        if field not in self._num:
+            self._num[field] = parse_floats(self.text(field, strip=False))
+        return self._num[field]
+
+    def select(self, keep):
+        """Колонки raw, отфильтрованные маской keep (bytes/bytearray, 1 — оставить)."""
+        return [list(compress(c, keep)) for c in self.raw]
+
+def write(path, header, columns):
+    """
+    Колонки строк -> CSV побайтно как csv.writer (QUOTE_MINIMAL, \\r\\n): если ни в одном
+    поле нет запятой, кавычки и переводов строки — склейка join-ами, иначе csv.writer.
+    """
+    columns = [c if isinstance(c, list) else list(c) for c in columns]
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        if len(columns) < 2 or any(map(_needs_quotes, columns)):
+            w.writerows(zip(*columns))
+            return
+        lines = list(map(",".join, zip(*columns)))
+        if lines:
+            lines.append("")
+            f.write("\r\n".join(lines))
+
+def _needs_quotes(col):
+    s = "".join(col)
+    return "," in s or '"' in s or "\n" in s or "\r" in s
+
+class Columns:
+    """Колонки одинаковой длины как результат батча: len() — число строк."""
+    __slots__ = ("cols",)
+
+    def __init__(self, cols):
+        self.cols = cols
+
+    def __len__(self):
+        return len(self.cols[0]) if self.cols else 0
+
+def read(path, schema, encoding="utf-8-sig", use_mmap=None, strip=False):
+    """
+    Файл известной схемы (SCHEMAS) -> Table; числовые колонки разбираются сразу.
+    strip=True — пробелы по краям снимаются у всех полей до разбора (как normalize() в geo_check).
+    """
+    fields, numeric = SCHEMAS[schema]
+    with no_gc():
+        text = read_text(path, encoding, use_mmap)
+        parsed = _split_simple(text)
+        if parsed is None:
+            parsed = _split_csv(text)
+        del text
+        table = Table(*parsed, fields)
+        if strip:
+            table.raw = [list(map(str.strip, c)) for c in table.raw]
+        if not table.cols.missing:
+            for f in numeric:
+                table.number(f)
+    return table
@@ -3,16 +3,28 @@
 """
 Geo validator for RayAgro
 Проверяем входной CSV с координатами для карт:
-- Обязательные столбцы: Контрагент, Год, Широта, Долгота
+- Обязательные столбцы: Контрагент, Год, Широта, Долгота (или алиасы, см. columns.py)
 - Диапазоны: Широта [-90..90], Долгота [-180..180]
 - Дедуп по ключу (Контрагент+Год)
 - Округление координат до 1e-6 (≈ 0.1 м) для стабильности рендера
+--workers N: шардированный разбор в пуле процессов (тот же результат, см. shards.py)
+--incremental: разбираются только изменившиеся чанки файла (см. incremental.py)
+--columnar [--columnar-format auto|arrow|npy]: рядом пишется колоночная копия очищенного файла (см. columnar.py)
+Без --workers/--incremental файл читается колонками (fastcsv.py), проверки — масками
+по колонкам, дедуп — по int-ключу из id словаря в памяти (keydict.py); очищенный файл
+и ошибки те же, что у построчного пути
+"timings" в отчёте — время/CPU/пик RSS/rows/sec по стадиям (см. instrument.py)
 Выход: JSON-отчёт; code 0 при отсутствии ошибок, 1 если есть ошибки.
 Создаём очищенный файл data/cleaned_<name>.csv
 """
-import csv, sys, json, os, math
+import argparse, csv, sys, json, os, math
+from itertools import compress, repeat
+from operator import and_, le, ne, not_, or_
 from pathlib import Path
 
+import columnar, fastcsv, incremental, instrument, keydict, shards
+from columns import ColumnResolver, GEO_FIELDS
+
 REQ = ["Контрагент","Год","Широта","Долгота"]
 
 def to_float(v):
@@ -25,76 +37,255 @@ def to_float(v):
 def round6(x):
     return None if x is None else round(x, 6)
 
+def normalize(row, width):
+    """Строка ровно по ширине заголовка: короткая дополняется, лишние поля отбрасываются (как в fastcsv)."""
+    row = [v.strip() for v in row[:width]]
+    if len(row) < width:
+        row += [""] * (width - len(row))
+    return row
+
 def read_csv(path):
     rows = []
     with open(path, "r", encoding="utf-8-sig", newline="") as f:
-        r = csv.DictReader(f)
-        cols = r.fieldnames or []
-        miss = [c for c in REQ if c not in cols]
-        if miss:
-            return [], {"errors":[{"msg": f"Отсутствуют колонки: {', '.join(miss)}"}]}
-        for row in r:
-            rows.append({k: (v.strip() if isinstance(v,str) else v) for k,v in row.items()})
-    return rows, {}
-
-def validate(rows):
+        r = csv.reader(f)
+        cols = ColumnResolver(next(r, []), GEO_FIELDS)
+        if cols.missing:
+            return [], cols, missing_error(cols)
+        width = len(cols.header)
+        rows = [normalize(row, width) for row in r if row]
+    return rows, cols, {}
+
+def missing_error(cols):
+    miss = [cols.name(c) for c in cols.missing]
+    return {"errors":[{"msg": f"Отсутствуют колонки: {', '.join(miss)}"}]}
+
+class RowChecker:
+    """Проверка координат одной строки; ключ и геттеры колонок готовятся один раз."""
+    def __init__(self, cols):
+        self.get_contr, self.get_year = cols.getter("contragent"), cols.getter("year")
+        self.get_lat, self.get_lon = cols.getter("lat"), cols.getter("lon")
+        self.i_lat, self.i_lon = cols.index["lat"][0], cols.index["lon"][0]
+
+    def key(self, row):
+        return (self.get_contr(row), self.get_year(row))
+
+    def check(self, row):
+        """-> (очищенная строка, None) или (None, ошибка без номера строки)."""
+        lat = to_float(self.get_lat(row))
+        lon = to_float(self.get_lon(row))
+        if lat is None or lon is None:
+            return None, {"msg": "Пустые/нечисловые координаты"}
+        if not (-90 <= lat <= 90):
+            return None, {"col":"Широта", "msg": f"Вне диапазона [-90..90]: {lat}"}
+        if not (-180 <= lon <= 180):
+            return None, {"col":"Долгота", "msg": f"Вне диапазона [-180..180]: {lon}"}
+
+        out = list(row)
+        out[self.i_lat] = f"{round6(lat):.6f}"
+        out[self.i_lon] = f"{round6(lon):.6f}"
+        return out, None
+
+def dup_error(i, k):
+    return {"row": i, "msg": f"Дубликат ключа Контрагент+Год: {k}"}
+
+def validate(rows, cols):
     errors, warns, cleaned = [], [], []
     seen = set()
+    chk = RowChecker(cols)
     for i, row in enumerate(rows, start=2):  # учитываем заголовок
-        k = (row.get("Контрагент",""), row.get("Год",""))
+        k = chk.key(row)
         if k in seen:
-            errors.append({"row": i, "msg": f"Дубликат ключа Контрагент+Год: {k}"})
+            errors.append(dup_error(i, k))
             continue
         seen.add(k)
 
-        lat = to_float(row.get("Широта"))
-        lon = to_float(row.get("Долгота"))
-        if lat is None or lon is None:
-            errors.append({"row": i, "msg": "Пустые/нечисловые координаты"})
+        out, err = chk.check(row)
+        if err:
+            errors.append({"row": i, **err})
             continue
-        if not (-90 <= lat <= 90):
-            errors.append({"row": i, "col":"Широта", "msg": f"Вне диапазона [-90..90]: {lat}"})
+        cleaned.append(out)
+    return cleaned, errors, warns
+
+def check_shard(job):
+    """Воркер --workers: разбор диапазона байт, дедуп только внутри шарда."""
+    src, start, end, cols = job
+    chk = RowChecker(cols)
+    width = len(cols.header)
+    seen, first, dups = set(), [], []
+    n = 0
+    for n, row in enumerate(shards.shard_rows(src, start, end), start=1):
+        row = normalize(row, width)
+        k = chk.key(row)
+        if k in seen:
+            dups.append((n, k))
+        else:
+            seen.add(k)
+            first.append((n, k, chk.check(row)))
+    return n, first, dups
+
+def validate_sharded(src, workers, tr):
+    with tr.stage("split"):
+        header, ranges = shards.split(src, workers)
+    cols = ColumnResolver(header, GEO_FIELDS)
+    if cols.missing:
+        return 0, cols, missing_error(cols), None
+    with tr.stage("parse") as st:
+        results = shards.run(check_shard, src, ranges, (cols,), workers)
+        st.rows = sum(r[0] for r in results)
+    with tr.stage("merge", rows=st.rows):
+        merged = merge(results)
+    return st.rows, cols, {}, merged
+
+def validate_incremental(src, workers, tr):
+    """Разбираются только чанки, которых нет в манифесте (см. incremental.py)."""
+    with tr.stage("plan"):
+        header = shards.read_header(src)
+        cols = ColumnResolver(header, GEO_FIELDS)
+        if cols.missing:
+            return 0, cols, missing_error(cols), None, None
+        ranges = incremental.chunk_ranges(src)
+        man = incremental.Manifest("geo", src, header)
+        cached, fresh, _, _ = man.plan(ranges)
+    with tr.stage("parse") as st:
+        parsed = dict(zip(
+            [h for _, _, h in fresh],
+            shards.run(check_shard, src, [(a, b) for a, b, _ in fresh], (cols,), workers),
+        ))
+        st.rows = sum(r[0] for r in parsed.values())
+    results = [cached[h] if h in cached else parsed[h] for _, _, h in ranges]
+    with tr.stage("manifest"):
+        man.save(ranges, results)
+    info = {"manifest": str(man.path), "chunks": len(ranges),
+            "reused": len(ranges) - len(fresh), "parsed": len(fresh)}
+    rows_in = sum(r[0] for r in results)
+    with tr.stage("merge", rows=rows_in):
+        merged = merge(results)
+    return rows_in, cols, {}, merged, info
+
+def merge(results):
+    errors, cleaned = [], []
+    for i, k, res in shards.merge_first_seen(results, start=2):
+        if res is shards.DUPLICATE:
+            errors.append(dup_error(i, k))
             continue
-        if not (-180 <= lon <= 180):
-            errors.append({"row": i, "col":"Долгота", "msg": f"Вне диапазона [-180..180]: {lon}"})
+        out, err = res
+        if err:
+            errors.append({"row": i, **err})
             continue
-
-        out = dict(row)
-        out["Широта"] = f"{round6(lat):.6f}"
-        out["Долгота"] = f"{round6(lon):.6f}"
         cleaned.append(out)
-    return cleaned, errors, warns
+    return cleaned, errors, []
+
+def validate_columns(t, keys=None):
+    """
+    validate() для батча по колонкам fastcsv.Table (поля уже без пробелов по краям):
+    дедуп и диапазоны — масками, RowChecker — только для строк с ошибкой (те же сообщения);
+    keys — keydict.KeyDict (по умолчанию — новый, в памяти).
+    """
+    keys = keys or keydict.KeyDict()
+    cols = t.cols
+    n = t.rows
+    contr, year = t.text("contragent", strip=False), t.text("year", strip=False)
+    lat, _ = t.number("lat")
+    lon, _ = t.number("lon")
+    packed = keys.pack(keys.ids("contragent", contr), keys.ids("year", year))
+    seen = {}
+    first = map(seen.setdefault, packed, range(n))              # первая строка того же ключа
+    dup = bytes(map(ne, first, range(n)))
+    ok = bytes(map(and_, map(and_, map(le, repeat(-90.0), lat), map(le, lat, repeat(90.0))),
+                   map(and_, map(le, repeat(-180.0), lon), map(le, lon, repeat(180.0)))))
+    drop = bytes(map(or_, dup, map(not_, ok)))               # NaN (не разобралось) — не в диапазоне
 
-def write_clean(path_in, cleaned):
+    errors = []
+    chk = RowChecker(cols)
+    for i in fastcsv.error_rows(drop):
+        if dup[i]:
+            errors.append(dup_error(i + 2, (contr[i], year[i])))
+        else:
+            _, err = chk.check([c[i] for c in t.raw])
+            errors.append({"row": i + 2, **err})
+    keep = bytes(map(not_, drop))
+    out = t.select(keep) if errors else [list(c) for c in t.raw]
+    # format(x, ".6f") == f"{round6(x):.6f}": оба округляют точное значение x до 1e-6
+    for i, x in ((chk.i_lat, lat), (chk.i_lon, lon)):
+        out[i] = list(map(format, compress(x, keep), repeat(".6f")))
+    return fastcsv.Columns(out), errors, []
+
+def validate_file(src, tr, keys=None):
+    with fastcsv.no_gc():
+        with tr.stage("read") as st:
+            t = fastcsv.read(src, "geo", strip=True)
+            st.rows = t.rows
+        if t.cols.missing:
+            return 0, t.cols, missing_error(t.cols), None
+        with tr.stage("validate", rows=t.rows):
+            result = validate_columns(t, keys)
+    return t.rows, t.cols, {}, result
+
+def clean_path(path_in):
     p = Path(path_in)
-    out = p.parent / ("cleaned_" + p.name)
+    return p.parent / ("cleaned_" + p.name)
+
+def write_clean(path_in, header, cleaned):
+    return write_cleaned(clean_path(path_in), header, cleaned)
+
+def write_cleaned(out, header, cleaned):
+    """Очищенные строки или fastcsv.Columns -> CSV out; -> str(out)."""
     if not cleaned:
         with open(out, "w", encoding="utf-8", newline="") as f:
             f.write(",".join(REQ) + "\n")
         return str(out)
-    cols = list(cleaned[0].keys())
+    if isinstance(cleaned, fastcsv.Columns):
+        fastcsv.write(out, header, cleaned.cols)
+        return str(out)
     with open(out, "w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=cols)
-        w.writeheader()
-        for r in cleaned:
-            w.writerow(r)
+        w = csv.writer(f)
+        w.writerow(header)
+        w.writerows(cleaned)
     return str(out)
 
-def main():
-    src = sys.argv[1] if len(sys.argv)>1 else os.getenv("GEO_CSV","data/sample_geo.csv")
-    rows, err = read_csv(src)
-    report = {"source": src, "errors":[], "warnings":[], "clean_path": None, "rows_in": len(rows), "rows_out": 0}
+def run(argv=None):
+    """-> (код выхода, отчёт) — то же, что печатает CLI; для вызова без подпроцесса (tools.py)."""
+    ap = argparse.ArgumentParser(description="Geo validator")
+    ap.add_argument("csv", nargs="?", default=os.getenv("GEO_CSV","data/sample_geo.csv"))
+    ap.add_argument("--workers", type=int, default=1,
+                    help="разбор шардов файла в N процессах (результат как у N=1)")
+    ap.add_argument("--incremental", action="store_true",
+                    help="разбирать только изменившиеся чанки (манифест в data/.cache/)")
+    ap.add_argument("--columnar", action="store_true",
+                    help="также писать типизированную колоночную копию (Arrow IPC или .npy)")
+    ap.add_argument("--columnar-format", choices=columnar.FORMATS, default="auto")
+    args = ap.parse_args(argv)
+    src = args.csv
+    info = None
+    tr = instrument.Tracer("geo_check")
+    if args.incremental:
+        rows_in, cols, err, result, info = validate_incremental(src, args.workers, tr)
+    elif args.workers > 1:
+        rows_in, cols, err, result = validate_sharded(src, args.workers, tr)
+    else:
+        rows_in, cols, err, result = validate_file(src, tr)
+    report = {"source": src, "columns": cols.report(), "errors":[], "warnings":[], "clean_path": None,
+              "rows_in": rows_in, "rows_out": 0}
     if err:
         report["errors"] = err.get("errors",[])
-        print(json.dumps(report, ensure_ascii=False, indent=2))
-        sys.exit(1)
-    cleaned, errors, warns = validate(rows)
+        return 1, tr.attach(report)
+    cleaned, errors, warns = result
     report["errors"] = errors
-    report["warnings"] = warns
+    report["warnings"] = cols.warnings() + warns
     report["rows_out"] = len(cleaned)
-    report["clean_path"] = write_clean(src, cleaned)
+    with tr.stage("write_clean", rows=len(cleaned)):
+        report["clean_path"] = write_clean(src, cols.header, cleaned)
+    if info:
+        report["incremental"] = info
+    if args.columnar:
+        with tr.stage("columnar", rows=len(cleaned)):
+            report["columnar"] = columnar.export(report["clean_path"], "geo", args.columnar_format)
+    return (0 if not errors else 1), tr.attach(report)
+
+def main():
+    code, report = instrument.profiled("geo_check", run)
     print(json.dumps(report, ensure_ascii=False, indent=2))
-    sys.exit(0 if not errors else 1)
+    sys.exit(code)
 
 if __name__ == "__main__":
     main()
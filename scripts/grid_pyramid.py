@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Пирамида тепловых сеток для MapView (вместо gridAgg в браузере):
+- input: public/data/joined.csv (см. join_check.py)
+- bbox по всем точкам, затем для каждого уровня rows×cols (LEVELS) — средняя
+  урожайность по ячейкам; биннинг тот же, что был в MapView:
+  r = floor((1 - (lat-minLat)/latSpan) * rows), c = floor((lon-minLon)/lonSpan * cols), с зажимом в край
+- границы легенды — как equalBreaks(min, max, 6) из components/scale.js
+- output: public/data/grid.json — bbox + уровни; ячейки разреженно [r, c, mean, count]
+  (mean округлён до 0.01, границы считаются по неокруглённым средним)
+С NumPy биннинг векторный (bincount), без него — тот же расчёт циклом.
+"""
+import argparse, csv, json, math, os
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен
+    np = None
+
+import instrument
+from columns import ColumnResolver, JOINED_FIELDS
+
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "public" / "data" / "joined.csv"
+OUT = ROOT / "public" / "data" / "grid.json"
+LEVELS = [(5, 10), (10, 20), (20, 40), (40, 80), (80, 160)]
+BINS = 6
+
+def to_num(v):
+    try:
+        x = float(v.replace(",", "."))
+    except ValueError:
+        return math.nan
+    return x if math.isfinite(x) else math.nan
+
+def load_points(path):
+    """-> (lat, lon, yld) списками; строки без чисел пропускаются (как в MapView)."""
+    lat, lon, yld = [], [], []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rdr = csv.reader(f)
+        cols = ColumnResolver(next(rdr, []), JOINED_FIELDS)
+        get_lat, get_lon, get_y = cols.getter("lat"), cols.getter("lon"), cols.getter("yield")
+        for r in rdr:
+            if not r:
+                continue
+            a, b, y = to_num(get_lat(r)), to_num(get_lon(r)), to_num(get_y(r))
+            if math.isnan(a) or math.isnan(b) or math.isnan(y):
+                continue
+            lat.append(a); lon.append(b); yld.append(y)
+    return lat, lon, yld
+
+def equal_breaks(lo, hi, bins):
+    """Порт equalBreaks из components/scale.js (те же операции во float64)."""
+    if not (math.isfinite(lo) and math.isfinite(hi)) or bins <= 0:
+        return [0, 1]
+    if lo == hi:
+        return [lo, hi]
+    step = (hi - lo) / bins
+    return [lo + step * i for i in range(bins + 1)]
+
+def bbox_of(lat, lon):
+    return {"minLat": min(lat), "maxLat": max(lat), "minLon": min(lon), "maxLon": max(lon)}
+
+def _cells_numpy(lat, lon, yld, box, rows, cols):
+    lat_span = max(1e-9, box["maxLat"] - box["minLat"])
+    lon_span = max(1e-9, box["maxLon"] - box["minLon"])
+    ry = np.floor((1 - (lat - box["minLat"]) / lat_span) * rows)
+    cx = np.floor(((lon - box["minLon"]) / lon_span) * cols)
+    cell = np.clip(ry, 0, rows - 1).astype(np.int64) * cols + np.clip(cx, 0, cols - 1).astype(np.int64)
+    cnt = np.bincount(cell, minlength=rows * cols)
+    s = np.bincount(cell, weights=yld, minlength=rows * cols)
+    nz = np.flatnonzero(cnt)
+    return [(int(i) // cols, int(i) % cols, float(s[i] / cnt[i]), int(cnt[i])) for i in nz]
+
+def _cells_python(lat, lon, yld, box, rows, cols):
+    lat_span = max(1e-9, box["maxLat"] - box["minLat"])
+    lon_span = max(1e-9, box["maxLon"] - box["minLon"])
+    acc = {}
+    for a, b, y in zip(lat, lon, yld):
+        r = min(rows - 1, max(0, math.floor((1 - (a - box["minLat"]) / lat_span) * rows)))
+        c = min(cols - 1, max(0, math.floor(((b - box["minLon"]) / lon_span) * cols)))
+        s = acc.setdefault((r, c), [0.0, 0])
+        s[0] += y
+        s[1] += 1
+    return [(r, c, s / n, n) for (r, c), (s, n) in sorted(acc.items())]
+
+def build_level(cells, rows, cols):
+    means = [m for _, _, m, _ in cells]
+    lo, hi = (min(means), max(means)) if means else (0, 1)
+    return {
+        "rows": rows,
+        "cols": cols,
+        "min": lo,
+        "max": hi,
+        "edges": equal_breaks(lo, hi, BINS),
+        "cells": [[r, c, round(m, 2), n] for r, c, m, n in cells],
+    }
+
+def build(lat, lon, yld, levels, engine):
+    box = bbox_of(lat, lon)
+    if engine == "numpy":
+        lat, lon, yld = (np.asarray(v, dtype=np.float64) for v in (lat, lon, yld))
+        cells_of = _cells_numpy
+    else:
+        cells_of = _cells_python
+    return box, [build_level(cells_of(lat, lon, yld, box, r, c), r, c) for r, c in levels]
+
+def run(argv=None):
+    """-> (код выхода, отчёт) — то же, что печатает CLI."""
+    ap = argparse.ArgumentParser(description="Grid pyramid for MapView heat grid")
+    ap.add_argument("csv", nargs="?", default=str(SRC))
+    ap.add_argument("--out", default=str(OUT))
+    ap.add_argument("--engine", choices=["python", "numpy", "auto"], default="auto")
+    args = ap.parse_args(argv)
+
+    src, out_path = Path(args.csv), Path(args.out)
+    if not src.exists():
+        return 2, {"error": f"not found: {src}"}
+    engine = args.engine
+    if engine == "auto":
+        engine = "numpy" if np is not None else "python"
+    elif engine == "numpy" and np is None:
+        return 2, {"error": "numpy is not installed (--engine numpy)"}
+
+    lat, lon, yld = load_points(src)
+    if lat:
+        box, levels = build(lat, lon, yld, LEVELS, engine)
+    else:
+        box, levels = None, []
+    payload = {"source": src.name, "points": len(lat), "bins": BINS, "bbox": box, "levels": levels}
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(payload, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp, out_path)
+
+    return 0, {
+        "source": str(src),
+        "out_path": str(out_path),
+        "engine": engine,
+        "points": len(lat),
+        "levels": [{"rows": l["rows"], "cols": l["cols"], "cells": len(l["cells"])} for l in levels],
+        "bytes": out_path.stat().st_size,
+    }
+
+def main():
+    code, out = instrument.profiled("grid_pyramid", run)
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    return code
+
+if __name__ == "__main__":
+    raise SystemExit(main())
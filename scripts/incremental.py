@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Инкрементальная перепроверка (--incremental) для validate_kpi.py / geo_check.py:
+- файл режется на чанки по содержимому (граница — строка, чей crc32 попал в маску),
+  поэтому правка одного сезона меняет один-два чанка, а не сдвигает все следующие
+- манифест data/.cache/<kind>-<name>-<path hash>.json хранит sha1 чанков
+  и результат воркера (check_shard) для каждого чанка
+- повторный прогон разбирает только новые чанки, остальное берёт из манифеста;
+  склейка (shards.merge_first_seen) та же, что и у --workers, итог идентичен
+"""
+import hashlib, json, os, zlib
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+CACHE_DIR = ROOT / "data" / ".cache"
+CACHE_VERSION = 3     # 2: nan/inf урожайности — None, как пустые; 3: строки GEO по ширине заголовка
+
+MIN_CHUNK = 256 << 10
+MAX_CHUNK = 4 << 20
+MASK = (1 << 12) - 1  # в среднем граница раз в ~4096 строк после MIN_CHUNK
+
+def chunk_ranges(path):
+    """-> [(start, end, sha1)] для тела файла (после строки заголовка)."""
+    out = []
+    with open(path, "rb") as f:
+        f.readline()
+        start = pos = f.tell()
+        h = hashlib.sha1()
+        for line in f:
+            h.update(line)
+            pos += len(line)
+            size = pos - start
+            if size >= MAX_CHUNK or (size >= MIN_CHUNK and zlib.crc32(line) & MASK == 0):
+                out.append((start, pos, h.hexdigest()))
+                start, h = pos, hashlib.sha1()
+        if pos > start:
+            out.append((start, pos, h.hexdigest()))
+    return out
+
+def _restore(result):
+    """JSON -> формат check_shard: ключи снова кортежи."""
+    n, first, dups = result
+    return n, [(i, tuple(k), p) for i, k, p in first], [(i, tuple(k)) for i, k in dups]
+
+class Manifest:
+    def __init__(self, kind, src, header):
+        src = Path(src).resolve()
+        tag = hashlib.sha1(str(src).encode("utf-8")).hexdigest()[:8]
+        self.path = CACHE_DIR / f"{kind}-{src.stem}-{tag}.json"
+        self.header = list(header)
+        self.chunks = {}     # sha1 -> результат check_shard
+        self.order = []      # sha1 чанков прошлого прогона, по порядку
+        self.extra = {}      # данные валидатора (например, статистика по Контрагентам)
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if data.get("version") != CACHE_VERSION or data.get("header") != self.header:
+            return
+        self.chunks = {h: _restore(r) for h, r in data.get("chunks", {}).items()}
+        self.order = data.get("order", [])
+        self.extra = data.get("extra", {})
+
+    def plan(self, ranges):
+        """
+        -> (cached {sha1: result}, fresh [(start, end, sha1)], removed [sha1], reordered)
+        reordered=True, если уцелевшие чанки идут не в прежнем порядке
+        (тогда «победитель» среди дублей мог смениться где угодно).
+        """
+        hashes = [h for _, _, h in ranges]
+        cached = {h: self.chunks[h] for h in hashes if h in self.chunks}
+        fresh = [r for r in ranges if r[2] not in cached]
+        current = set(hashes)
+        removed = [h for h in self.order if h not in current]
+        kept_old = [h for h in self.order if h in current]
+        kept_new = [h for h in dict.fromkeys(hashes) if h in set(self.order)]
+        return cached, fresh, removed, kept_old != kept_new
+
+    def save(self, ranges, results, extra=None):
+        chunks = {}
+        for (_, _, h), r in zip(ranges, results):
+            chunks[h] = r
+        data = {"version": CACHE_VERSION, "header": self.header,
+                "order": [h for _, _, h in ranges], "chunks": chunks, "extra": extra or {}}
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+def keys_of(results):
+    """Все ключи (Контрагент, Год), встретившиеся в результатах чанков."""
+    for _, first, dups in results:
+        for _, k, _ in first:
+            yield k
+        for _, k in dups:
+            yield k
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Замеры стадий конвейера (разбор, дедуп, статистика, запись CSV, публикация):
+- with tr.stage("parse") as st: ...; st.rows = n
+- по стадии: wall (perf_counter), CPU (thread_time — этот поток; работа пула
+  процессов --workers сюда не входит), пик RSS процесса на конец стадии, rows/sec
+- tr.attach(report) кладёт сводку в report["timings"]; при RAYAGRO_TRACE=1 ещё и
+  logs/trace-<tool>-<ms>.json в формате Chrome trace events (chrome://tracing,
+  ui.perfetto.dev), путь — в report["trace_path"]
+Пик RSS — за всю жизнь процесса (getrusage), в тёплом пуле он общий для всех вызовов.
+
+Профилирование (--profile[=MODE] у любого скрипта или RAYAGRO_PROFILE=MODE; profiled()):
+- cprofile (по умолчанию, "1") — logs/profile-<tool>-<ms>.pstats (python -m pstats,
+  snakeviz) + топ функций по собственному времени в report["profile"]["top"]
+- sample — сэмплер стеков всех потоков (RAYAGRO_PROFILE_HZ, 200 Гц) ->
+  logs/profile-<tool>-<ms>.collapsed ("a;b;c N" — flamegraph.pl, speedscope)
+- both — оба файла
+cProfile видит только вызывающий поток: для diagnostics.py (проверки в потоках) — sample
+или --serial. Профиль один на процесс: вложенный вызов (diagnostics -> validate_kpi), в том
+числе из другого потока, и вызов под чужим профилировщиком идут без своего профиля — на 3.12+
+второй cProfile.enable() падает с "Another profiling tool is already active".
+"""
+import cProfile, json, os, pstats, sys, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = Path(__file__).resolve().parents[1]
+LOGS = ROOT / "logs"
+
+def trace_enabled():
+    return os.getenv("RAYAGRO_TRACE", "0") not in ("0", "", "false", "no")
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux — КБ, macOS — байты
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+class Stage:
+    __slots__ = ("name", "rows", "t0", "wall", "cpu", "rss", "tid")
+
+    def __init__(self, name, rows=None):
+        self.name, self.rows = name, rows
+        self.t0 = self.wall = self.cpu = 0.0
+        self.rss, self.tid = None, threading.get_ident()
+
+    def view(self):
+        out = {"name": self.name, "wall_s": round(self.wall, 4), "cpu_s": round(self.cpu, 4),
+               "peak_rss_mb": self.rss}
+        if self.rows is not None:
+            out["rows"] = self.rows
+            out["rows_per_s"] = round(self.rows / self.wall) if self.wall > 0 else None
+        return out
+
+class Tracer:
+    def __init__(self, tool, trace=None):
+        self.tool = tool
+        self.trace = trace_enabled() if trace is None else trace
+        self.stages = []
+        self._lock = threading.Lock()
+        self._t0, self._cpu0 = time.perf_counter(), time.process_time()
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        st = Stage(name, rows)
+        cpu0, st.t0 = time.thread_time(), time.perf_counter()
+        try:
+            yield st
+        finally:
+            st.wall = time.perf_counter() - st.t0
+            st.cpu = time.thread_time() - cpu0
+            st.rss = peak_rss_mb()
+            with self._lock:
+                self.stages.append(st)
+
+    def summary(self):
+        return {
+            "wall_s": round(time.perf_counter() - self._t0, 4),
+            "cpu_s": round(time.process_time() - self._cpu0, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": [st.view() for st in sorted(self.stages, key=lambda s: s.t0)],
+        }
+
+    def chrome_events(self):
+        """Полные события ("ph": "X") в микросекундах от старта трассировщика."""
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": self.tool}}]
+        for st in sorted(self.stages, key=lambda s: s.t0):
+            args = {"cpu_ms": round(st.cpu * 1000, 3), "peak_rss_mb": st.rss}
+            if st.rows is not None:
+                args["rows"] = st.rows
+            events.append({"name": st.name, "cat": self.tool, "ph": "X", "pid": pid, "tid": st.tid,
+                           "ts": round((st.t0 - self._t0) * 1e6, 1), "dur": round(st.wall * 1e6, 1),
+                           "args": args})
+        return events
+
+    def write_trace(self, path=None):
+        path = Path(path) if path else LOGS / f"trace-{self.tool}-{int(time.time() * 1000)}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"traceEvents": self.chrome_events(), "displayTimeUnit": "ms"},
+                                   ensure_ascii=False), encoding="utf-8")
+        return str(path)
+
+    def attach(self, report):
+        """report["timings"] (+ report["trace_path"] при RAYAGRO_TRACE=1); -> report."""
+        report["timings"] = self.summary()
+        if self.trace:
+            report["trace_path"] = self.write_trace()
+        return report
+
+# --- Профилирование ---
+PROFILE_MODES = ("cprofile", "sample", "both")
+_active = threading.Lock()   # занят — профиль уже пишется (в любом потоке процесса)
+
+def _profiler_busy():
+    """Профилировщик уже стоит: sys.setprofile этого потока или (3.12+) sys.monitoring."""
+    if sys.getprofile() is not None:
+        return True
+    monitoring = getattr(sys, "monitoring", None)
+    return monitoring is not None and monitoring.get_tool(monitoring.PROFILER_ID) is not None
+
+def profile_mode(value):
+    """Значение --profile / RAYAGRO_PROFILE -> cprofile | sample | both | None."""
+    v = (value or "").strip().lower()
+    if v in ("", "0", "false", "no", "off"):
+        return None
+    if v in ("sample", "collapsed", "flame"):
+        return "sample"
+    return "both" if v == "both" else "cprofile"
+
+def split_profile_flag(argv):
+    """Убирает --profile[=MODE] из argv: -> (режим или None, остальные аргументы)."""
+    mode, rest = None, []
+    for a in argv:
+        if a == "--profile":
+            mode = "cprofile"
+        elif a.startswith("--profile="):
+            mode = profile_mode(a.split("=", 1)[1])
+        else:
+            rest.append(a)
+    return mode, rest
+
+class Sampler(threading.Thread):
+    """Стеки всех потоков процесса раз в 1/hz с -> счётчики collapsed-стеков."""
+    def __init__(self, hz=None):
+        super().__init__(daemon=True, name="profile-sampler")
+        hz = hz or float(os.getenv("RAYAGRO_PROFILE_HZ", "200"))
+        self.interval = 1.0 / max(1.0, hz)
+        self.counts = {}
+        self.samples = 0
+        self._halt = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._halt.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    co = frame.f_code
+                    stack.append(f"{Path(co.co_filename).stem}:{co.co_name}")
+                    frame = frame.f_back
+                if tid not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(tid, str(tid)))
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+    def write(self, path):
+        lines = [f"{k} {n}" for k, n in sorted(self.counts.items())]
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+def top_functions(prof, limit=15):
+    """Функции с наибольшим собственным временем (tottime) из cProfile."""
+    st = pstats.Stats(prof)
+    rows = sorted(st.stats.items(), key=lambda kv: kv[1][2], reverse=True)[:limit]
+    return [{"func": f"{Path(fn).name}:{line}({name})", "calls": nc, "self_s": round(tt, 4),
+             "cum_s": round(ct, 4)} for (fn, line, name), (_, nc, tt, ct, _) in rows]
+
+def profiled(tool, run, argv=None, mode=None):
+    """
+    run(argv) -> (код, отчёт) под профилировщиком, если просили (mode, --profile в argv,
+    RAYAGRO_PROFILE); пути к файлам — в report["profile"]. Без профиля — просто run(argv).
+    """
+    flag, argv = split_profile_flag(list(sys.argv[1:] if argv is None else argv))
+    mode = profile_mode(mode) if mode else flag or profile_mode(os.getenv("RAYAGRO_PROFILE"))
+    if not mode or not _active.acquire(blocking=False):
+        return run(argv)
+    try:
+        stem = LOGS / f"profile-{tool}-{int(time.time() * 1000)}"
+        prof = cProfile.Profile() if mode in ("cprofile", "both") and not _profiler_busy() else None
+        sampler = Sampler() if mode in ("sample", "both") else None
+        if not prof and not sampler:
+            return run(argv)
+        if sampler:
+            sampler.start()
+        if prof:
+            prof.enable()
+        try:
+            code, report = run(argv)
+        finally:
+            if prof:
+                prof.disable()
+            if sampler:
+                sampler.stop()
+    finally:
+        _active.release()
+
+    LOGS.mkdir(parents=True, exist_ok=True)
+    info = {"mode": mode}
+    if prof:
+        path = stem.with_suffix(".pstats")
+        prof.dump_stats(str(path))
+        info["pstats"] = str(path)
+        info["top"] = top_functions(prof)
+    if sampler:
+        path = stem.with_suffix(".collapsed")
+        sampler.write(path)
+        info["collapsed"] = str(path)
+        info["samples"] = sampler.samples
+    if isinstance(report, dict):
+        report["profile"] = info
+    return code, report
@@ -1,53 +1,137 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Join check between cleaned GEO and KPI:
+Join stage between cleaned GEO and KPI:
 - keys: (Контрагент, Год)
 - input: data/cleaned_sample_geo.csv, data/cleaned_sample_kpi.csv
-- output: JSON with counts and small samples of unmatched keys
+- меньший (по размеру) файл читается в хеш-индекс, больший идёт потоком и пробует индекс;
+  ключ индекса — int из id словаря в памяти (keydict.py), строка потоковой стороны ищет
+  свои id без добавления в словарь: значения нет в словаре — нет и совпадения
+- output: public/data/joined.csv (Контрагент, Год, Широта, Долгота, Урожайность_ц_га) —
+  только строки с координатами и урожайностью > 0, как раньше считал MapView в браузере;
+  рядом колоночная копия (joined.arrow или joined.cols/, см. columnar.py)
+- JSON with counts and small samples of unmatched keys
+  (входы уже дедуплицированы валидаторами, поэтому ключей потоковой стороны = строк)
+- "timings": стадии index / probe / columnar (см. instrument.py)
 Exit code: 0 if any matches > 0, 1 otherwise.
 """
-import csv, json
+import bisect, csv, json, math, os
 from pathlib import Path
 
+import columnar, instrument, keydict
+from columns import ColumnResolver, GEO_FIELDS, KPI_FIELDS
+
 ROOT = Path(__file__).resolve().parents[1]
 GEO = ROOT / "data" / "cleaned_sample_geo.csv"
 KPI = ROOT / "data" / "cleaned_sample_kpi.csv"
+JOINED = ROOT / "public" / "data" / "joined.csv"
+JOINED_COLS = ["Контрагент", "Год", "Широта", "Долгота", "Урожайность_ц_га"]
+HINT = "Совпадений 0 — проверьте написание 'Контрагент' и 'Год' в обоих наборах и их значения."
+
+SIDES = {
+    "geo": (GEO, GEO_FIELDS, ("lat", "lon")),
+    "kpi": (KPI, KPI_FIELDS, ("yield",)),
+}
+
+def to_num(v):
+    try:
+        x = float(str(v).replace(",", "."))
+    except ValueError:
+        return math.nan
+    return x if math.isfinite(x) else math.nan
 
-def read_keys(path, cols):
-    rows = []
+def read_side(name):
+    """(ключ, [сырые значения]) для строк с непустым ключом."""
+    path, fields, values = SIDES[name]
     if not path.exists():
-        return rows
-    with open(path, "r", encoding="utf-8") as f:
-        rdr = csv.DictReader(f)
+        return
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rdr = csv.reader(f)
+        cols = ColumnResolver(next(rdr, []), fields)
+        get_c, get_y = cols.getter("contragent"), cols.getter("year")
+        getters = [cols.getter(v) for v in values]
         for r in rdr:
-            key = (str(r.get(cols[0], "")).strip(), str(r.get(cols[1], "")).strip())
+            if not r:
+                continue
+            key = (get_c(r).strip(), get_y(r).strip())
             if key[0] and key[1]:
-                rows.append(key)
-    return rows
+                yield key, [g(r).strip() for g in getters]
 
-def main():
-    geo_keys = read_keys(GEO, ("Контрагент","Год"))
-    kpi_keys = read_keys(KPI, ("Контрагент","Год"))
+class Smallest:
+    """k наименьших различных ключей потока (аналог sorted(set)[:k] без множества)."""
+    def __init__(self, k=10):
+        self.k, self.items = k, []
+
+    def add(self, key):
+        i = bisect.bisect_left(self.items, key)
+        if i < self.k and (i == len(self.items) or self.items[i] != key):
+            self.items.insert(i, key)
+            del self.items[self.k:]
 
-    sg = set(geo_keys)
-    sk = set(kpi_keys)
-    inter = sg & sk
-    only_geo = sorted(sg - sk)[:10]
-    only_kpi = sorted(sk - sg)[:10]
+def run(argv=None):
+    """-> (код выхода, отчёт); аргументов нет, argv — для единообразия с другими инструментами."""
+    sizes = {n: (SIDES[n][0].stat().st_size if SIDES[n][0].exists() else 0) for n in SIDES}
+    build, probe = sorted(SIDES, key=lambda n: sizes[n])
+    tr = instrument.Tracer("join_check")
 
+    keys = keydict.KeyDict()
+    with tr.stage("index") as st:
+        bkeys, bvals = [], []
+        for key, vals in read_side(build):
+            bkeys.append(key)
+            bvals.append(vals)
+        contr, year = [k[0] for k in bkeys], [k[1] for k in bkeys]
+        packed = keys.pack(keys.ids("contragent", contr), keys.ids("year", year))
+        index = dict(zip(packed, bvals))   # при повторе побеждает последний, как kpiMap в MapView
+        del bkeys, bvals, contr, year
+        st.rows = len(index)
+
+    matched, probe_keys, joined_rows = set(), 0, 0
+    only_probe = Smallest()
+    JOINED.parent.mkdir(parents=True, exist_ok=True)
+    tmp = JOINED.with_suffix(".tmp")
+    with tr.stage("probe") as st, open(tmp, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(JOINED_COLS)
+        for key, vals in read_side(probe):
+            probe_keys += 1
+            k = keys.key(*key)
+            hit = index.get(k)
+            if hit is None:
+                only_probe.add(key)
+                continue
+            matched.add(k)
+            (lat, lon), (yld,) = (hit, vals) if build == "geo" else (vals, hit)
+            if math.isnan(to_num(lat)) or math.isnan(to_num(lon)) or not to_num(yld) > 0:
+                continue
+            w.writerow([key[0], key[1], lat, lon, yld])
+            joined_rows += 1
+        st.rows = probe_keys
+    os.replace(tmp, JOINED)
+
+    counts = {build: len(index), probe: probe_keys}
+    only = {build: sorted(map(keys.unpack, set(index) - matched))[:10], probe: only_probe.items}
     out = {
         "geo_file": str(GEO),
         "kpi_file": str(KPI),
-        "geo_keys": len(sg),
-        "kpi_keys": len(sk),
-        "matched": len(inter),
-        "only_geo_samples": only_geo,
-        "only_kpi_samples": only_kpi,
-        "hint": "Совпадений 0 — проверьте написание 'Контрагент' и 'Год' в обоих наборах и их значения."
+        "geo_keys": counts["geo"],
+        "kpi_keys": counts["kpi"],
+        "matched": len(matched),
+        "only_geo_samples": only["geo"],
+        "only_kpi_samples": only["kpi"],
+        "build_side": build,
+        "joined_path": str(JOINED),
+        "joined_rows": joined_rows,
+        "hint": HINT,
     }
+    with tr.stage("columnar", rows=joined_rows):
+        out["columnar"] = columnar.export(JOINED, "joined", keys=keys)
+    return (0 if len(matched) > 0 else 1), tr.attach(out)
+
+def main():
+    code, out = instrument.profiled("join_check", run)
     print(json.dumps(out, ensure_ascii=False, indent=2))
-    return 0 if len(inter) > 0 else 1
+    return code
 
 if __name__ == "__main__":
     raise SystemExit(main())
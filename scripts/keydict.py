@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Словарь ключей (интернирование): Контрагент и Год -> целые id.
+- KeyDict() — в памяти процесса: отдельные validate_kpi / geo_check / join_check дедуплицируют
+  и соединяют по id и ничего не пишут; колоночные копии несут свой словарь (columnar.py)
+- KeyDict(KEYS) — постоянный data/keys.csv (kind,id,value): открывает только публикующий
+  прогон (pipeline.py); id раздаются по порядку первого появления и больше не меняются —
+  файл только дописывается, поэтому id опубликованных версий сопоставимы между собой
+- ids(kind, values): колонка строк -> колонка id; новые значения дописываются в файл одним
+  куском под flock (два прогона могут идти одновременно), перед этим дочитывается то, что
+  успели дописать другие процессы
+- pack(cids, yids): ключ (Контрагент, Год) одним int (cid << YEAR_BITS | yid) — дедуп, join
+  и группировка хешируют int, а не кортеж двух строк, и не держат кортеж на строку
+- недописанная последняя строка (процесс упал посреди записи) при чтении пропускается,
+  следующий рост словаря её отрезает
+public/data/keys.csv — опубликованная копия (общая таблица id всех файлов версии).
+"""
+import csv, io
+from itertools import filterfalse, repeat
+from operator import lshift, or_
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировки, как и без resource в instrument.py
+    fcntl = None
+
+ROOT = Path(__file__).resolve().parents[1]
+KEYS = ROOT / "data" / "keys.csv"
+HEADER = ["kind", "id", "value"]
+KINDS = ("contragent", "year")
+YEAR_BITS = 24
+YEAR_MASK = (1 << YEAR_BITS) - 1
+
+class KeyDict:
+    """
+    k = KeyDict(); cids = k.ids("contragent", contr); key = k.pack(cids, k.ids("year", year)).
+    values[kind][id] — значение по id (таблица для показа), unpack(key) -> (Контрагент, Год).
+    """
+    def __init__(self, path=None):
+        self.path = Path(path) if path is not None else None   # None — только в памяти
+        self.index = {k: {} for k in KINDS}     # значение -> id
+        self.values = {k: [] for k in KINDS}    # id -> значение
+        self.offset = 0                         # байт файла уже прочитано (до конца полной строки)
+        if self.path is not None and self.path.exists():
+            with open(self.path, "rb") as f:
+                self._read(f)
+
+    def _read(self, f):
+        """Дочитывает полные строки файла с self.offset."""
+        f.seek(self.offset)
+        chunk = f.read()
+        end = chunk.rfind(b"\n") + 1
+        if not end:
+            return
+        for row in csv.reader(io.StringIO(chunk[:end].decode("utf-8"), newline="")):
+            if row == HEADER or len(row) != 3 or row[0] not in self.index:
+                continue
+            kind, i, value = row
+            if int(i) == len(self.values[kind]):
+                self.index[kind][value] = int(i)
+                self.values[kind].append(value)
+        self.offset += end
+
+    def _grow(self, kind, new):
+        """Дописывает в файл новые значения kind (под блокировкой, дочитав чужие)."""
+        if self.path is None:
+            self._add(kind, new)
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._read(f)
+                buf = io.StringIO()
+                w = csv.writer(buf, lineterminator="\n")
+                if self.offset == 0:
+                    w.writerow(HEADER)
+                start = len(self.values[kind])
+                self._add(kind, new)
+                w.writerows([kind, i, v] for i, v in enumerate(self.values[kind][start:], start))
+                data = buf.getvalue().encode("utf-8")
+                f.truncate(self.offset)         # хвост недописанной строки, если был
+                f.write(data)
+                f.flush()
+                self.offset += len(data)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _add(self, kind, new):
+        index, values = self.index[kind], self.values[kind]
+        for v in new:
+            if v not in index:
+                index[v] = len(values)
+                values.append(v)
+        if len(self.values["year"]) > YEAR_MASK + 1:
+            raise ValueError(f"keys.csv: больше 2^{YEAR_BITS} различных значений Год")
+
+    def ids(self, kind, values):
+        """Колонка строк -> колонка id; новые значения получают следующие id и сохраняются."""
+        index = self.index[kind]
+        try:
+            return list(map(index.__getitem__, values))     # обычно все значения уже известны
+        except KeyError:
+            pass
+        self._grow(kind, list(filterfalse(index.__contains__, dict.fromkeys(values))))
+        return list(map(index.__getitem__, values))
+
+    def pack(self, cids, yids):
+        """Колонки id Контрагента и Года -> колонка ключей int."""
+        return list(map(or_, map(lshift, cids, repeat(YEAR_BITS)), yids))
+
+    def key(self, contr, year):
+        """Один ключ по значениям или None, если какого-то значения нет в словаре (без записи)."""
+        cid, yid = self.index["contragent"].get(contr), self.index["year"].get(year)
+        return None if cid is None or yid is None else cid << YEAR_BITS | yid
+
+    def unpack(self, key):
+        return self.values["contragent"][key >> YEAR_BITS], self.values["year"][key & YEAR_MASK]
+
+    def groups(self, cids):
+        """id Контрагентов строк -> (имена в порядке первого появления, код группы на строку)."""
+        order = {c: i for i, c in enumerate(dict.fromkeys(cids))}
+        names = self.values["contragent"]
+        return [names[c] for c in order], list(map(order.__getitem__, cids))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Настоящий WAASB (Olivoto et al., 2019) по AMMI-разложению взаимодействия G×E:
+- input: data/cleaned_sample_kpi.csv (Контрагент = генотип, Год = среда)
+- матрица G×E средних урожайностей; пропуски (нет данных за год) заполняются
+  EM-AMMI: аддитивная оценка, затем итерации SVD низкого ранга только по пустым ячейкам
+- GEI = y_ij - ȳ_i. - ȳ_.j + ȳ_..; SVD тонкое (G×E, E мало) — тысячи генотипов за секунды
+- WAASB_i = Σ_k |IPCA_ik · EP_k| / Σ_k EP_k, где IPCA_ik = u_ik·√λ_k, EP_k — доля λ_k²
+- output: data/kpi_stability.csv или --out (Контрагент, Лет, Mean_ц_га, WAASB, WAASB_rank; 1 — стабильнее)
+Генотипы меньше чем с MIN_YEARS годами и годы меньше чем с 2 генотипами не участвуют.
+Требует NumPy; без него — JSON с ошибкой и код 2.
+"""
+import argparse, csv, json, math
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import instrument
+from columns import ColumnResolver, KPI_FIELDS
+
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "data" / "cleaned_sample_kpi.csv"
+OUT = ROOT / "data" / "kpi_stability.csv"
+COLS = ["Контрагент", "Лет", "Mean_ц_га", "WAASB", "WAASB_rank"]
+MIN_YEARS = 2
+
+def round01(x):
+    return None if x is None or not math.isfinite(x) else round(x*10)/10.0
+
+def load_table(path):
+    """-> {(Контрагент, Год): [урожайности]} в порядке первого появления."""
+    cells = {}
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rdr = csv.reader(f)
+        cols = ColumnResolver(next(rdr, []), KPI_FIELDS)
+        get_c, get_y, get_v = cols.getter("contragent"), cols.getter("year"), cols.getter("yield")
+        for row in rdr:
+            if not row:
+                continue
+            try:
+                v = float(get_v(row).replace(",", "."))
+            except ValueError:
+                continue
+            cells.setdefault((get_c(row).strip(), get_y(row).strip()), []).append(v)
+    return cells
+
+def build_matrix(cells):
+    """Матрица G×E (NaN — нет наблюдения) с отсевом редких генотипов и годов."""
+    years_per_g, gens_per_e = {}, {}
+    for g, e in cells:
+        years_per_g[g] = years_per_g.get(g, 0) + 1
+        gens_per_e[e] = gens_per_e.get(e, 0) + 1
+    gens = [g for g, n in years_per_g.items() if n >= MIN_YEARS]
+    keep = set(gens)
+    envs = sorted({e for (g, e) in cells if g in keep and gens_per_e[e] >= 2})
+    gi = {g: i for i, g in enumerate(gens)}
+    ei = {e: j for j, e in enumerate(envs)}
+    Y = np.full((len(gens), len(envs)), np.nan)
+    for (g, e), vs in cells.items():
+        if g in gi and e in ei:
+            Y[gi[g], ei[e]] = sum(vs) / len(vs)
+    # отсев взаимозависим: повторяем, пока и строки, и столбцы не станут достаточными
+    while Y.size:
+        obs = ~np.isnan(Y)
+        rk, ck = obs.sum(axis=1) >= MIN_YEARS, obs.sum(axis=0) >= 2
+        if rk.all() and ck.all():
+            break
+        gens = [g for g, m in zip(gens, rk) if m]
+        envs = [e for e, m in zip(envs, ck) if m]
+        Y = Y[rk][:, ck]
+    return gens, envs, Y
+
+def _gei(Y):
+    gm = Y.mean()
+    r = Y.mean(axis=1, keepdims=True)
+    c = Y.mean(axis=0, keepdims=True)
+    return Y - r - c + gm, r, c, gm
+
+def em_impute(Y, axes=2, tol=1e-6, max_iter=200):
+    """EM-AMMI: пустые ячейки итеративно заменяются подгонкой AMMI-axes. -> (Y, итерации, сошлось)."""
+    miss = np.isnan(Y)
+    if not miss.any():
+        return Y, 0, True
+    obs = np.where(miss, 0.0, Y)
+    cnt_r = (~miss).sum(axis=1, keepdims=True)
+    cnt_c = (~miss).sum(axis=0, keepdims=True)
+    gm = obs.sum() / (~miss).sum()
+    r = obs.sum(axis=1, keepdims=True) / np.maximum(cnt_r, 1)
+    c = obs.sum(axis=0, keepdims=True) / np.maximum(cnt_c, 1)
+    Y = np.where(miss, r + c - gm, Y)
+    axes = max(0, min(axes, min(Y.shape) - 2))
+    it = 0
+    for it in range(1, max_iter + 1):
+        Z, r, c, gm = _gei(Y)
+        fit = r + c - gm
+        if axes:
+            U, s, Vt = np.linalg.svd(Z, full_matrices=False)
+            fit = fit + (U[:, :axes] * s[:axes]) @ Vt[:axes]
+        delta = np.abs(fit[miss] - Y[miss]).max()
+        Y[miss] = fit[miss]
+        if delta < tol * max(1.0, np.abs(Y).max()):
+            return Y, it, True
+    return Y, it, False
+
+def waasb(Y, axes=None):
+    """-> (WAASB по генотипам, доли EP_k по всем осям, число использованных осей)."""
+    Z = _gei(Y)[0]
+    U, s, _ = np.linalg.svd(Z, full_matrices=False)
+    rank = max(0, min(Z.shape) - 1)   # у матрицы взаимодействия ранг <= min(G, E) - 1
+    s = s[:rank]
+    total = float((s ** 2).sum())
+    if rank == 0 or total <= 0:
+        return np.zeros(Z.shape[0]), [], 0
+    ep = s ** 2 / total
+    p = rank if not axes else min(axes, rank)
+    scores = U[:, :p] * np.sqrt(s[:p])
+    return np.abs(scores) @ ep[:p] / ep[:p].sum(), ep.tolist(), p
+
+def write_rows(path, rows):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=COLS)
+        w.writeheader()
+        w.writerows(rows)
+
+def run(argv=None):
+    """-> (код выхода, отчёт) — то же, что печатает CLI."""
+    ap = argparse.ArgumentParser(description="WAASB / AMMI stability")
+    ap.add_argument("csv", nargs="?", default=str(SRC))
+    ap.add_argument("--out", default=str(OUT), help="куда писать (e2e: сразу в public/data/)")
+    ap.add_argument("--axes", type=int, default=None,
+                    help="сколько IPCA-осей брать в WAASB (по умолчанию — все)")
+    args = ap.parse_args(argv)
+    if np is None:
+        return 2, {"error": "numpy is required for kpi_stability.py"}
+    src, dst = Path(args.csv), Path(args.out)
+    if not src.exists():
+        return 2, {"error": f"not found: {src}"}
+
+    cells = load_table(src)
+    gens, envs, Y = build_matrix(cells)
+    out = {"source": str(src), "out_path": str(dst), "genotypes": len(gens), "years": len(envs),
+           "warnings": []}
+    if len(gens) < 2 or len(envs) < 2:
+        out["warnings"].append({"msg": f"Недостаточно данных для AMMI: нужно >=2 контрагентов с >={MIN_YEARS} годами"})
+        write_rows(dst, [])
+        return 0, out
+
+    observed = ~np.isnan(Y)
+    means = np.where(observed, Y, 0.0).sum(axis=1) / observed.sum(axis=1)
+    filled, iters, converged = em_impute(Y.copy())
+    scores, ep, p = waasb(filled, args.axes)
+    order = np.lexsort((np.arange(len(gens)), scores))
+    rank = np.empty(len(gens), dtype=int)
+    rank[order] = np.arange(1, len(gens) + 1)
+
+    rows = [
+        {"Контрагент": g, "Лет": int(n), "Mean_ц_га": round01(float(m)),
+         "WAASB": round(float(w), 4), "WAASB_rank": int(r)}
+        for g, n, m, w, r in zip(gens, observed.sum(axis=1), means, scores, rank)
+    ]
+    write_rows(dst, rows)
+    out.update({
+        "missing_cells": int((~observed).sum()),
+        "em_iterations": iters,
+        "em_converged": converged,
+        "axes_used": p,
+        "explained_pct": [round(100 * e, 1) for e in ep],
+    })
+    return 0, out
+
+def main():
+    code, out = instrument.profiled("kpi_stability", run)
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    return code
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Статические тайлы точек для карты (вместо маркера на каждую строку в MapView):
+- input: public/data/joined.csv (см. join_check.py)
+- точки -> пиксели Web Mercator на зуме ZMAX (та же схема {z}/{x}/{y}, что у Leaflet/OSM)
+- z-order: один раз сортируем точки по коду Мортона; тайл любого зума и ячейка
+  кластера внутри тайла — это непрерывный отрезок отсортированного массива (квадродерево)
+- тайл с <= POINTS_LIMIT точками (и любой тайл на ZMAX) — лист: хранит сами точки,
+  более глубокие тайлы под ним не пишутся; иначе — кластеры по ячейкам 32×32 px
+  (центр, число, урожайность mean/min/max) и список непустых детей "children"
+- клиент спускается по дереву от ZMIN только в видимые тайлы, пока не дойдёт до
+  листа или текущего зума карты — 404 не бывает, лишних файлов тоже
+- output: public/data/tiles/<hash>/{z}/{x}/{y}.json (только непустые) + tiles/index.json
+  (зумы, bbox, диапазон урожайности, корневые тайлы ZMIN, число тайлов по зумам)
+- "hash" в index.json — sha256[:12] всех тайлов (путь + содержимое) и имя каталога набора:
+  набор собирается рядом и переносится в tiles/<hash>/ одним os.replace, готовый каталог
+  больше не меняется — клиент с прошлым манифестом догружает свои тайлы по старому hash;
+  индекс публикуется в манифест как tiles.json (publish_data.py), старые наборы удаляет
+  сборка мусора versioned.py вместе с последней версией tiles.json, которая на них ссылается
+"""
+import argparse, csv, hashlib, json, math, os, shutil
+from itertools import groupby
+from pathlib import Path
+
+import instrument
+from columns import ColumnResolver, JOINED_FIELDS
+
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "public" / "data" / "joined.csv"
+OUT = ROOT / "public" / "data" / "tiles"
+TILE_PX = 256
+TILE_BITS = 8          # log2(TILE_PX)
+CELL_BITS = 5          # ячейка кластера 32×32 px -> до 8×8 кластеров на тайл
+POINTS_LIMIT = 256
+MAX_LAT = 85.05112878
+
+def to_num(v):
+    try:
+        x = float(v.replace(",", "."))
+    except ValueError:
+        return math.nan
+    return x if math.isfinite(x) else math.nan
+
+def load_points(path):
+    """-> [(lat, lon, yld, Контрагент, Год)] для строк с числовыми координатами и урожайностью."""
+    out = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rdr = csv.reader(f)
+        cols = ColumnResolver(next(rdr, []), JOINED_FIELDS)
+        get_c, get_y = cols.getter("contragent"), cols.getter("year")
+        get_lat, get_lon, get_v = cols.getter("lat"), cols.getter("lon"), cols.getter("yield")
+        for r in rdr:
+            if not r:
+                continue
+            lat, lon, yld = to_num(get_lat(r)), to_num(get_lon(r)), to_num(get_v(r))
+            if math.isnan(lat) or math.isnan(lon) or math.isnan(yld):
+                continue
+            out.append((lat, lon, yld, get_c(r), get_y(r)))
+    return out
+
+def world_px(lat, lon, bits):
+    """Целые пиксельные координаты Web Mercator в мире 2**bits × 2**bits."""
+    size = 1 << bits
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    s = math.sin(math.radians(lat))
+    x = (lon + 180.0) / 360.0 * size
+    y = (0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * size
+    return min(size - 1, max(0, int(x))), min(size - 1, max(0, int(y)))
+
+def _spread(v):
+    """Биты v через один (0b1011 -> 0b1000101) — для кода Мортона."""
+    out, bit = 0, 0
+    while v:
+        out |= (v & 1) << (2 * bit)
+        v >>= 1
+        bit += 1
+    return out
+
+def morton(x, y):
+    return _spread(x) | (_spread(y) << 1)
+
+def unmorton(m):
+    x = y = 0
+    bit = 0
+    while m:
+        x |= (m & 1) << bit
+        y |= ((m >> 1) & 1) << bit
+        m >>= 2
+        bit += 1
+    return x, y
+
+def summary(items):
+    ys = [p[2] for p in items]
+    return {"count": len(ys), "mean": round(sum(ys) / len(ys), 2), "min": min(ys), "max": max(ys)}
+
+def cluster(items):
+    """[lat, lon, count, mean, min, max] — центр масс ячейки."""
+    n = len(items)
+    ys = [p[2] for p in items]
+    return [round(sum(p[0] for p in items) / n, 5), round(sum(p[1] for p in items) / n, 5),
+            n, round(sum(ys) / n, 2), min(ys), max(ys)]
+
+def build_tiles(points, zmin, zmax, out_dir):
+    """Пишет тайлы в out_dir; -> ({зум: число тайлов}, корневые тайлы ZMIN [[x, y], ...])."""
+    bits = zmax + TILE_BITS
+    keyed = sorted(((morton(*world_px(p[0], p[1], bits)), p) for p in points), key=lambda kp: kp[0])
+    per_zoom = {}
+    leaves = set()    # коды тайлов предыдущего зума, ниже которых уже не спускаемся
+    roots = []
+    for z in range(zmin, zmax + 1):
+        tile_shift = 2 * (zmax - z + TILE_BITS)
+        cell_shift = 2 * (zmax - z + CELL_BITS)
+        n_tiles = 0
+        below = set()
+        for tile_code, run in groupby(keyed, key=lambda kp: kp[0] >> tile_shift):
+            if tile_code >> 2 in leaves:
+                below.add(tile_code)
+                continue
+            run = list(run)
+            tx, ty = unmorton(tile_code)
+            tile = {"z": z, "x": tx, "y": ty, **summary([p for _, p in run])}
+            if z == zmax or len(run) <= POINTS_LIMIT:
+                tile["points"] = [[p[0], p[1], p[2], p[3], p[4]] for _, p in run]
+                below.add(tile_code)
+            else:
+                tile["clusters"] = [cluster([p for _, p in cell])
+                                    for _, cell in groupby(run, key=lambda kp: kp[0] >> cell_shift)]
+                tile["children"] = [list(unmorton(c)) for c, _ in groupby(run, key=lambda kp: kp[0] >> (tile_shift - 2))]
+            path = out_dir / str(z) / str(tx) / f"{ty}.json"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(tile, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+            n_tiles += 1
+            if z == zmin:
+                roots.append([tx, ty])
+        per_zoom[z] = n_tiles
+        leaves = below
+    return per_zoom, roots
+
+def tileset_hash(out_dir):
+    """sha256[:12] по всем тайлам каталога (путь + байты) — версия набора тайлов."""
+    h = hashlib.sha256()
+    for path in sorted(out_dir.rglob("*.json")):
+        h.update(path.relative_to(out_dir).as_posix().encode("utf-8") + b"\0")
+        h.update(path.read_bytes())
+    return h.hexdigest()[:12]
+
+def run(argv=None):
+    """-> (код выхода, отчёт) — то же, что печатает CLI."""
+    ap = argparse.ArgumentParser(description="Static z/x/y point tiles for MapView")
+    ap.add_argument("csv", nargs="?", default=str(SRC))
+    ap.add_argument("--out", default=str(OUT))
+    ap.add_argument("--zmin", type=int, default=3)
+    ap.add_argument("--zmax", type=int, default=12)
+    args = ap.parse_args(argv)
+
+    src, out_dir = Path(args.csv), Path(args.out)
+    if not src.exists():
+        return 2, {"error": f"not found: {src}"}
+    if not 0 <= args.zmin <= args.zmax <= 20:
+        return 2, {"error": "требуется 0 <= zmin <= zmax <= 20"}
+
+    points = load_points(src)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp = out_dir / f".build-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+    per_zoom, roots = build_tiles(points, args.zmin, args.zmax, tmp)
+    index = {
+        "source": src.name,
+        "points": len(points),
+        "zmin": args.zmin,
+        "zmax": args.zmax,
+        "tile_px": TILE_PX,
+        "points_limit": POINTS_LIMIT,
+        "bbox": ({"minLat": min(p[0] for p in points), "maxLat": max(p[0] for p in points),
+                  "minLon": min(p[1] for p in points), "maxLon": max(p[1] for p in points)}
+                 if points else None),
+        "yield": ({"min": min(p[2] for p in points), "max": max(p[2] for p in points)} if points else None),
+        "roots": roots,
+        "tiles": {str(z): n for z, n in per_zoom.items()},
+        "hash": tileset_hash(tmp),
+    }
+    # набор с тем же hash уже опубликован — он и есть этот набор, не трогаем
+    final = out_dir / index["hash"]
+    if final.exists():
+        shutil.rmtree(tmp)
+    else:
+        os.replace(tmp, final)
+    index_tmp = out_dir / f".index.json.{os.getpid()}.tmp"
+    index_tmp.write_text(json.dumps(index, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(index_tmp, out_dir / "index.json")
+    for legacy in out_dir.iterdir():     # плоская раскладка tiles/{z}/... прежних версий
+        if legacy.is_dir() and legacy.name.isdigit():
+            shutil.rmtree(legacy, ignore_errors=True)
+
+    return 0, {"source": str(src), "out_dir": str(final), **{k: index[k] for k in ("points", "zmin", "zmax", "tiles", "hash")}}
+
+def main():
+    code, out = instrument.profiled("map_tiles", run)
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    return code
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,24 +1,83 @@
 #!/usr/bin/env python3
-import os, json, subprocess, time, tempfile, glob, hmac, hashlib
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import os, re, json, subprocess, time, tempfile, glob, hmac, hashlib, threading, uuid, signal
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs
 from pathlib import Path
 
+try:
+    import instrument   # scripts/instrument.py — профилирование (--profile / RAYAGRO_PROFILE)
+    import tools        # scripts/tools.py — валидаторы как функции, тёплый пул процессов
+except ImportError:
+    instrument = tools = None
+
 REPO_DIR = os.getcwd()
+JOB_LOGS = Path(REPO_DIR, "logs", "jobs")
+TAIL_KEEP = 64 * 1024    # сколько последних символов stdout/stderr держит в памяти run(job=...)
+LINE_MAX  = 8192         # длинные строки читаются кусками — память на поток постоянна
+LOG_CHUNK = 64 * 1024    # блок чтения лог-файла для GET /jobs/<id>/log
 BRANCH   = os.getenv("WORK_BRANCH", "msp-dev")
 HOST     = "127.0.0.1"
 PORT     = 8078
 
-def run(cmd, cwd=None, timeout=600):
-    p = subprocess.Popen(cmd, cwd=cwd or REPO_DIR,
-                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+def kill_tree(p):
+    """bash -lc запускает npm/python дочерними — гасим всю группу процессов."""
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError, OSError):
+        p.kill()
+
+class Ring:
+    """Последние limit символов потока: память не растёт с объёмом вывода."""
+    def __init__(self, limit):
+        self.limit, self.parts, self.size = limit, deque(), 0
+
+    def append(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        while len(self.parts) > 1 and self.size - len(self.parts[0]) >= self.limit:
+            self.size -= len(self.parts.popleft())
+
+    def text(self):
+        return "".join(self.parts)[-self.limit:]
+
+def run(cmd, cwd=None, timeout=600, job=None, keep=TAIL_KEEP, env=None):
+    """
+    job — вывод идёт построчно в лог-файл задачи (GET /jobs/<id>/log), в памяти
+    остаются только последние keep символов каждого потока; процесс идёт в своей
+    группе и может быть снят job.cancel().
+    """
+    p = subprocess.Popen(cmd, cwd=cwd or REPO_DIR, env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                         start_new_session=job is not None)
+    if job is None:
+        try:
+            out, err = p.communicate(timeout=timeout)
+            out = out or ""
+            code = p.returncode
+        except subprocess.TimeoutExpired:
+            p.kill(); out, err = p.communicate(); code = 124
+        return code, out, err
+
+    chunks = {"stdout": Ring(keep), "stderr": Ring(keep)}
+    def pump(stream, name):
+        for line in iter(lambda: stream.readline(LINE_MAX), ""):
+            chunks[name].append(line)
+            job.log(name, line)
+    readers = [threading.Thread(target=pump, args=(p.stdout, "stdout"), daemon=True),
+               threading.Thread(target=pump, args=(p.stderr, "stderr"), daemon=True)]
+    for t in readers:
+        t.start()
+    job.attach(p)
     try:
-        out, err = p.communicate(timeout=timeout)
-        out = out or ""
-        code = p.returncode
+        code = p.wait(timeout=timeout)
     except subprocess.TimeoutExpired:
-        p.kill(); out, err = p.communicate(); code = 124
-    return code, out, err
+        kill_tree(p); p.wait(); code = 124
+    finally:
+        job.attach(None)
+    for t in readers:
+        t.join()
+    return code, chunks["stdout"].text(), chunks["stderr"].text()
 
 def ensure_branch():
     run(["git", "fetch", "origin"])
@@ -69,12 +128,321 @@ SAFE_TASKS = {
     "test":    ["bash","-lc","npm test --if-present -- --ci --reporters=default || true"],
     "smoke":   ["bash","-lc","chmod +x scripts/smoke.sh && scripts/smoke.sh || true"],
     "kpi":     ["bash","-lc","chmod +x scripts/validate_kpi.py && scripts/validate_kpi.py data/sample_kpi.csv || true"],
+    "stability": ["bash","-lc","chmod +x scripts/kpi_stability.py && scripts/kpi_stability.py || true"],
     "geo":     ["bash","-lc","chmod +x scripts/geo_check.py && scripts/geo_check.py data/sample_geo.csv || true"],
     "join":    ["bash","-lc","chmod +x scripts/join_check.py && scripts/join_check.py || true"],
+    "grid":    ["bash","-lc","chmod +x scripts/grid_pyramid.py && scripts/grid_pyramid.py || true"],
+    "tiles":   ["bash","-lc","chmod +x scripts/map_tiles.py && scripts/map_tiles.py || true"],
     "publish": ["bash","-lc","chmod +x scripts/publish_data.py && scripts/publish_data.py || true"],
     "ensure":  ["bash","-lc","chmod +x scripts/ensure_public_data.py && scripts/ensure_public_data.py || true"],
-    "e2e":     ["bash","-lc","chmod +x scripts/validate_kpi.py scripts/geo_check.py scripts/publish_data.py >/dev/null 2>&1 || true; scripts/validate_kpi.py data/sample_kpi.csv || true; scripts/geo_check.py data/sample_geo.csv || true; scripts/publish_data.py || true; npm run -s build || true; chmod +x scripts/smoke.sh; scripts/smoke.sh || true; python3 diagnostics.py --json || true; echo 'E2E done'"]
+    "pipeline": ["bash","-lc","python3 scripts/pipeline.py --columnar || true"],
+    "e2e":     ["bash","-lc","python3 scripts/pipeline.py --columnar --no-commit --kpi data/sample_kpi.csv --geo data/sample_geo.csv || true; python3 scripts/kpi_stability.py public/data/kpi.csv --out public/data/kpi_stability.csv || true; python3 scripts/grid_pyramid.py || true; python3 scripts/map_tiles.py || true; python3 scripts/publish_data.py --in-place || true; npm run -s build || true; chmod +x scripts/smoke.sh; scripts/smoke.sh || true; python3 diagnostics.py --json || true; echo 'E2E done'"]
+}
+
+# --- Валидаторы в тёплом пуле ---
+# Задачи из INPROC_TASKS не платят bash -lc + python3 + импорты на каждый шаг: шаг
+# (инструмент, argv) — вызов run(argv) в заранее поднятом процессе (tools.Pool),
+# строка — как раньше через bash -lc. Коды шагов — в "steps", код задачи — 0, как
+# у "|| true" в SAFE_TASKS (124 — таймаут). RAYAGRO_INPROC=0 — всё через SAFE_TASKS.
+E2E_SHELL = "npm run -s build || true; chmod +x scripts/smoke.sh; scripts/smoke.sh || true"
+INPROC_TASKS = {
+    "kpi":       [("validate_kpi", ["data/sample_kpi.csv"])],
+    "stability": [("kpi_stability", [])],
+    "geo":       [("geo_check", ["data/sample_geo.csv"])],
+    "join":      [("join_check", [])],
+    "grid":      [("grid_pyramid", [])],
+    "tiles":     [("map_tiles", [])],
+    "publish":   [("publish_data", [])],
+    "pipeline":  [("pipeline", ["--columnar"])],
+    "diag":      [("diagnostics", ["--json"])],
+    "e2e":       [*(tools.E2E_TOOLS if tools else []), E2E_SHELL, ("diagnostics", ["--json"])],
 }
+POOL = tools.Pool(int(os.getenv("ORCH_POOL_WORKERS", "2"))) if tools and tools.enabled() else None
+
+# --- Профили ---
+# /run?task=...&profile=cprofile|sample|both (или RAYAGRO_PROFILE у оркестратора) — шаги
+# идут под профилировщиком, файлы logs/profile-<tool>-<ms>.pstats|.collapsed; в ответе
+# "profiles": [{"path", "url"}], файл отдаёт GET /profiles/<имя>.
+PROFILES_DIR = Path(REPO_DIR, "logs")
+PROFILE_NAME = re.compile(r"^profile-[\w.-]+\.(pstats|collapsed)$")
+
+def profile_paths(report):
+    info = report.get("profile") if isinstance(report, dict) else None
+    return [info[k] for k in ("pstats", "collapsed") if info and info.get(k)]
+
+def profiles_since(ts):
+    """Профили, записанные после ts — для подпроцессов, чей отчёт не разбираем."""
+    return sorted(p for p in glob.glob(str(PROFILES_DIR / "profile-*")) if os.path.getmtime(p) >= ts)
+
+def profile_links(paths):
+    return [{"path": os.path.relpath(p, REPO_DIR), "url": f"/profiles/{Path(p).name}"} for p in paths]
+
+def run_steps(steps, job, timeout, profile=None):
+    """-> (код, stdout, stderr, [{step, code, via, elapsed_s}], профили); отчёты — в лог задачи."""
+    out, err = Ring(TAIL_KEEP), Ring(TAIL_KEEP)
+    timings, code, profiles = [], 0, []
+    deadline = time.monotonic() + timeout
+    for step in steps:
+        if job.cancelled:
+            break
+        left = max(1.0, deadline - time.monotonic())
+        t0 = time.perf_counter()
+        if isinstance(step, str):
+            c, o, e = run(["bash", "-lc", step], timeout=left, job=job)
+            name, via = "shell", "bash"
+        else:
+            res = POOL.call(*step, timeout=left, profile=profile, cancelled=lambda: job.cancelled)
+            c, name, via = res["code"], res["tool"], res["via"]
+            profiles += profile_paths(res["report"])
+            o = json.dumps(res["report"], ensure_ascii=False, indent=2) + "\n"
+            e = res.get("error", "")
+            for line in o.splitlines(keepends=True):
+                job.log("stdout", line)
+            for line in e.splitlines(keepends=True):
+                job.log("stderr", line)
+        out.append(o); err.append(e)
+        timings.append({"step": name, "code": c, "via": via, "elapsed_s": round(time.perf_counter() - t0, 4)})
+        if c == 124:
+            code = 124
+            break
+    return code, out.text(), err.text(), timings, profiles
+
+def run_task(task, job, timeout=1800, profile=None):
+    """-> (код, stdout, stderr, доп. поля результата) — через пул, если можно."""
+    if POOL is not None and task in INPROC_TASKS:
+        c, o, e, steps, profiles = run_steps(INPROC_TASKS[task], job, timeout, profile)
+        extra = {"via": "pool", "steps": steps}
+    else:
+        t0 = time.time()
+        env = {**os.environ, "RAYAGRO_PROFILE": profile} if profile else None
+        c, o, e = run(SAFE_TASKS[task], timeout=timeout, job=job, env=env)
+        extra = {}
+        profiles = profiles_since(t0) if profile or os.getenv("RAYAGRO_PROFILE") else []
+    if profiles:
+        extra["profiles"] = profile_links(profiles)
+    return c, o, e, extra
+
+# --- Очередь задач ---
+# Каждая задача — Job в своём потоке. Перед запуском берутся:
+# общий лимит ORCH_MAX_PARALLEL, лимит на задачу (TASK_LIMITS, по умолчанию 1 —
+# два build в один dist/ не пишут) и замок рабочего дерева: задачи, которые пишут
+# dist/, data/, public/data/ (и manifest.json с его сборкой мусора) или меняют ветку,
+# идут только поодиночке; параллельно — лишь читатели (WORKSPACE_READERS).
+# diag тоже пишет: diagnostics.py гоняет валидаторы, а те — data/cleaned_*.csv.
+def _parse_limits(spec):
+    out = {}
+    for part in (spec or "").split(","):
+        name, _, n = part.partition("=")
+        if name.strip() and n.strip().isdigit():
+            out[name.strip()] = max(1, int(n))
+    return out
+
+MAX_PARALLEL = max(1, int(os.getenv("ORCH_MAX_PARALLEL", "4")))
+TASK_LIMITS  = _parse_limits(os.getenv("ORCH_TASK_LIMITS", ""))
+WORKSPACE_READERS = {"test", "donesheet"}    # только читают дерево — остальные под замок писателя
+JOBS_KEEP    = 200
+
+class Stat:
+    """Счётчик времени ожидания: n, среднее, максимум, последние значения."""
+    def __init__(self, keep=100):
+        self.n, self.total, self.max = 0, 0.0, 0.0
+        self.recent = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def add(self, v):
+        with self._lock:
+            self.n += 1
+            self.total += v
+            self.max = max(self.max, v)
+            self.recent.append(v)
+
+    def view(self):
+        with self._lock:
+            r = sorted(self.recent)
+        return {"n": self.n, "avg_s": round(self.total / self.n, 3) if self.n else None,
+                "max_s": round(self.max, 3), "p50_recent_s": round(r[len(r) // 2], 3) if r else None}
+
+class RWLock:
+    """Много читателей или один писатель; ждущий писатель не пропускает новых читателей."""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting = 0
+
+    def acquire(self, write):
+        with self._cond:
+            if write:
+                self._waiting += 1
+                while self._writer or self._readers:
+                    self._cond.wait()
+                self._waiting -= 1
+                self._writer = True
+            else:
+                while self._writer or self._waiting:
+                    self._cond.wait()
+                self._readers += 1
+
+    def release(self, write):
+        with self._cond:
+            if write:
+                self._writer = False
+            else:
+                self._readers -= 1
+            self._cond.notify_all()
+
+class Job:
+    def __init__(self, task, fn):
+        self.id = uuid.uuid4().hex[:12]
+        self.task, self.fn = task, fn
+        self.status = "queued"          # queued | running | done | failed | cancelled
+        self.cancelled = ""             # причина отмены (например, "superseded by <sha>")
+        self._proc = None
+        self.created, self.started, self.finished = time.time(), None, None
+        self.code, self.result, self.http, self.error = None, None, 200, ""
+        self.log_path = JOB_LOGS / f"{self.id}.log"
+        self.log_bytes = 0
+        self._log = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def attach(self, proc):
+        with self._lock:
+            self._proc = proc
+            if proc is not None and self.cancelled:
+                kill_tree(proc)
+
+    def cancel(self, reason):
+        """
+        Снять задачу: в очереди — не стартует, в работе — процесс убивается; шаг в тёплом
+        пуле снимается через tools.Pool.call(cancelled=...) — воркер убивается, пул пересоздаётся.
+        """
+        with self._lock:
+            if self.done.is_set():
+                return False
+            self.cancelled = reason
+            if self._proc is not None and self._proc.poll() is None:
+                kill_tree(self._proc)
+        return True
+
+    def log(self, stream, line):
+        """Строка в logs/jobs/<id>.log (stderr — с префиксом "[stderr] "), сразу на диск."""
+        data = (line if stream == "stdout" else "[stderr] " + line).encode("utf-8", "replace")
+        with self._lock:
+            if self._log is None:
+                JOB_LOGS.mkdir(parents=True, exist_ok=True)
+                self._log = open(self.log_path, "ab")
+            self._log.write(data)
+            self._log.flush()
+            self.log_bytes += len(data)
+
+    def close_log(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def view(self, full=False):
+        now = time.time()
+        out = {
+            "id": self.id, "task": self.task, "status": self.status, "code": self.code,
+            "created": int(self.created),
+            "wait_s": round((self.started or now) - self.created, 3),
+            "run_s": round((self.finished or now) - self.started, 3) if self.started else None,
+            "log_bytes": self.log_bytes,
+        }
+        if self.cancelled:
+            out["cancelled"] = self.cancelled
+        if full:
+            out["result"] = self.result
+            if self.error:
+                out["error"] = self.error
+        return out
+
+class JobQueue:
+    def __init__(self):
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(MAX_PARALLEL)
+        self._task_slots = {}
+        self.workspace = RWLock()
+        self.wait = Stat()
+
+    def _task_sem(self, task):
+        with self._lock:
+            if task not in self._task_slots:
+                self._task_slots[task] = threading.BoundedSemaphore(TASK_LIMITS.get(task, 1))
+            return self._task_slots[task]
+
+    def submit(self, task, fn):
+        """fn(job) -> payload или (payload, http-статус); задача стартует в фоне."""
+        job = Job(task, fn)
+        self._add(job)
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return job
+
+    def _add(self, job):
+        """Новая запись; сверх JOBS_KEEP уходят самые старые завершённые (с логами)."""
+        with self._lock:
+            self.jobs[job.id] = job
+            for jid in [j.id for j in self.jobs.values() if j.done.is_set()][:max(0, len(self.jobs) - JOBS_KEEP)]:
+                self.jobs.pop(jid).log_path.unlink(missing_ok=True)
+
+    def _run(self, job):
+        write = job.task not in WORKSPACE_READERS
+        with self._task_sem(job.task), self._slots:
+            self.workspace.acquire(write)
+            try:
+                job.status, job.started = "running", time.time()
+                self.wait.add(job.started - job.created)
+                if job.cancelled:
+                    job.result = {"ok": False, "cancelled": job.cancelled}
+                else:
+                    res = job.fn(job)
+                    job.result, job.http = res if isinstance(res, tuple) else (res, 200)
+                    job.code = job.result.get("code") if isinstance(job.result, dict) else None
+                job.status = "cancelled" if job.cancelled else "done"
+            except Exception as e:
+                job.status, job.error = "failed", repr(e)
+                job.result, job.http = {"ok": False, "error": repr(e)}, 500
+            finally:
+                self.workspace.release(write)
+                job.close_log()
+                job.finished = time.time()
+                job.done.set()
+
+    def get(self, jid):
+        with self._lock:
+            return self.jobs.get(jid)
+
+    def list(self):
+        with self._lock:
+            return [j.view() for j in reversed(self.jobs.values())]
+
+    def record(self, task, result):
+        """Готовый результат (из кэша) как завершённая задача — виден в /jobs."""
+        job = Job(task, None)
+        job.status, job.started, job.finished = "done", job.created, job.created
+        job.result = result
+        job.code = result.get("code") if isinstance(result, dict) else None
+        job.done.set()
+        self._add(job)
+        return job
+
+    def counts(self):
+        with self._lock:
+            out = {}
+            for j in self.jobs.values():
+                out[j.status] = out.get(j.status, 0) + 1
+            return out
+
+QUEUE = JobQueue()
+
+def task_fn(task, timeout=1800, profile=None):
+    def fn(job):
+        c, o, e, extra = run_task(task, job, timeout, profile)
+        return {"ok": True, "task": task, "code": c, "stdout_tail": o[-1200:], "stderr_tail": e[-1200:], **extra}
+    return fn
 
 def collect_donesheet():
     dist_ok = Path(REPO_DIR, "dist", "index.html").exists()
@@ -104,25 +472,465 @@ def gh_pr_update_body(extra_body):
     ok = (c == 0)
     return {"ok": ok, "url": url, "stdout_tail": o[-400:], "stderr_tail": e[-400:]}
 
+def do_diagnostics(job, profile=None):
+    if POOL is not None:
+        res = POOL.call("diagnostics", ["--json"], profile=profile)
+        payload = res["report"] if isinstance(res["report"], dict) else {"raw": res["report"]}
+        for line in json.dumps(payload, ensure_ascii=False, indent=2).splitlines(keepends=True):
+            job.log("stdout", line)
+        payload["meta"] = {"code": res["code"], "stderr_tail": res.get("error", "")[-400:],
+                           "via": res["via"], "elapsed_s": res["elapsed_s"]}
+        if profile_paths(payload):
+            payload["profiles"] = profile_links(profile_paths(payload))
+        return payload
+    flag = [f"--profile={profile}"] if profile else []
+    c,o,e = run(["python3","diagnostics.py","--json", *flag], job=job, keep=1 << 22)  # JSON разбираем целиком
+    try:
+        payload = json.loads(o) if o.strip().startswith("{") else {"raw": o}
+    except Exception:
+        payload = {"raw": o}
+    payload["meta"] = {"code": c, "stderr_tail": e[-400:]}
+    if profile_paths(payload):
+        payload["profiles"] = profile_links(profile_paths(payload))
+    return payload
+
+def do_webhook_e2e(events, branch, sha, merged):
+    def fn(job):
+        c,o,e,extra = run_task("e2e", job)
+        out = {"ok": True, "events": events, "branch": branch, "sha": sha, "merged_events": merged,
+               "code": c, "stdout_tail": o[-1200:], "stderr_tail": e[-1200:], **extra}
+        if job.cancelled:   # прогон устарел — PR не трогаем
+            return {**out, "ok": False, "cancelled": job.cancelled}
+        sheet = collect_donesheet()
+        out["donesheet"] = gh_pr_update_body(sheet)
+        return out
+    return fn
+
+def do_patch(diff_text, msg):
+    def fn(job):
+        ensure_branch()
+        with tempfile.NamedTemporaryFile("w+", delete=False) as tf:
+            tf.write(diff_text); tf.flush()
+            c1,o1,e1 = run(["git","apply","--whitespace=fix",tf.name])
+            if c1 != 0:
+                c2,o2,e2 = run(["git","apply","--reject",tf.name])
+                if c2 != 0:
+                    return {"ok": False, "apply_err": (e1+"\n"+e2)[-800:]}, 422
+        run(["git","add","-A"])
+        cc,oc,ec = run(["git","commit","-m",msg])
+        if cc != 0 and "nothing to commit" not in (oc+ec):
+            return {"ok": False, "commit_err": ec[-400:]}, 500
+        cp,op,ep = run(["git","push","origin",BRANCH], timeout=1200, job=job)
+        cd,od,ed = run(["python3","scripts/diag_report.py"], job=job)
+        return {
+            "ok": cp==0,
+            "push_stdout_tail": op[-400:], "push_stderr_tail": ep[-400:],
+            "diag": {"code": cd, "stdout_tail": od[-400:], "stderr_tail": ed[-400:]}
+        }, 200 if cp==0 else 500
+    return fn
+
+def do_pr(body):
+    def fn(job):
+        ensure_branch()
+        title = "chore(msp): automated PR from micro_orchestrator"
+        result = gh_pr_create_or_get(title, body if body.strip() else "Automated PR")
+        ok = "error" not in result
+        return {"ok": ok, **result}
+    return fn
+
+def do_donesheet(job):
+    sheet = collect_donesheet()
+    res = gh_pr_update_body(sheet)
+    return {"ok": res.get("ok", False), **res}
+
+# --- Кэш результатов идемпотентных задач ---
+# Ключ: задача + sha1 исходников инструментов (TOOL_SOURCES) + sha1 объявленных входов —
+# не дерево git: выходы задач лежат в нём же, и каждый прогон сбивал бы свой ключ.
+# Запись хранит и хеши выходов задачи: если выход удалён или изменён руками — промах,
+# задача перезапускается и снова их пишет. Хеши файлов мемоизируются по (size, mtime).
+CACHE_DIR         = Path(REPO_DIR, "data", ".cache", "results")
+CACHE_MAX_ENTRIES = int(os.getenv("ORCH_CACHE_ENTRIES", "256"))
+CACHE_MAX_BYTES   = int(float(os.getenv("ORCH_CACHE_MB", "64")) * 1024 * 1024)
+TOOL_SOURCES = ["scripts/*.py", "scripts/*.sh", "diagnostics.py"]
+DIAG_INPUTS = ["data/*.csv", "public/data/*.csv", "dist/index.html", "dist/assets/*"]
+CACHEABLE = {
+    # задача: (входы, выходы) — glob от корня репозитория
+    "kpi":         (["data/sample_kpi.csv"], ["data/cleaned_sample_kpi.csv", "data/kpi_stats.csv"]),
+    "geo":         (["data/sample_geo.csv"], ["data/cleaned_sample_geo.csv"]),
+    "join":        (["data/cleaned_sample_geo.csv", "data/cleaned_sample_kpi.csv"], ["public/data/joined.csv"]),
+    "pipeline":    (["data/sample_kpi.csv", "data/sample_geo.csv", "data/kpi_stability.csv", "data/keys.csv"],
+                    ["public/data/kpi.csv", "public/data/geo.csv", "public/data/kpi_stats.csv", "public/data/joined.csv",
+                     "public/data/manifest.json"]),
+    "diag":        (DIAG_INPUTS, []),
+    "diagnostics": (DIAG_INPUTS, []),
+}
+
+class ResultCache:
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._digests = {}    # путь -> (size, mtime_ns, sha1)
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "stale_outputs": 0}
+
+    def digest(self, path):
+        st = path.stat()
+        memo = self._digests.get(path)
+        if memo and memo[:2] == (st.st_size, st.st_mtime_ns):
+            return memo[2]
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        self._digests[path] = (st.st_size, st.st_mtime_ns, h.hexdigest())
+        return h.hexdigest()
+
+    def files(self, patterns):
+        root = Path(REPO_DIR)
+        return sorted({p for pat in patterns for p in root.glob(pat) if p.is_file()})
+
+    def hashes(self, patterns):
+        root = Path(REPO_DIR)
+        return {str(p.relative_to(root)): self.digest(p) for p in self.files(patterns)}
+
+    def key(self, task):
+        inputs, _ = CACHEABLE[task]
+        h = hashlib.sha1(f"{task}\n".encode("utf-8"))
+        for rel, d in self.hashes(TOOL_SOURCES + inputs).items():
+            h.update(f"{rel}\t{d}\n".encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, task, key):
+        path = self.root / f"{key}.json"
+        with self._lock:
+            try:
+                entry = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self.counters["misses"] += 1
+                return None
+            if self.hashes(CACHEABLE[task][1]) != entry.get("outputs"):
+                self.counters["stale_outputs"] += 1
+                self.counters["misses"] += 1
+                return None
+            os.utime(path)    # LRU: mtime = последнее обращение
+            self.counters["hits"] += 1
+            return entry["result"]
+
+    def put(self, task, key, result):
+        entry = {"task": task, "key": key, "created": int(time.time()),
+                 "outputs": self.hashes(CACHEABLE[task][1]), "result": result}
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self.root / f"{key}.tmp"
+            tmp.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.root / f"{key}.json")
+            self.counters["stores"] += 1
+            self._evict()
+
+    def _entries(self):
+        out = []
+        for p in self.root.glob("*.json"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            out.append((st.st_mtime, st.st_size, p))
+        return sorted(out)
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > CACHE_MAX_ENTRIES or total > CACHE_MAX_BYTES):
+            _, size, p = entries.pop(0)
+            p.unlink(missing_ok=True)
+            total -= size
+            self.counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            entries = self._entries() if self.root.exists() else []
+            return {**self.counters, "entries": len(entries), "bytes": sum(s for _, s, _ in entries),
+                    "max_entries": CACHE_MAX_ENTRIES, "max_bytes": CACHE_MAX_BYTES}
+
+CACHE = ResultCache(CACHE_DIR)
+
+def submit_cached(task, fn, nocache=False):
+    """
+    -> (job, hit). Попадание — готовый Job без запуска; промах — обычная задача,
+    результат которой (если не снята и не по таймауту) кладётся в кэш.
+    nocache — кэш не читается, но свежий результат записывается.
+    Ключ промаха считается заново уже в задаче, под замком рабочего дерева: задача могла
+    ждать писателя (publish, pipeline, e2e), и входы к её старту уже не те, что при приёме
+    запроса; тогда же кэш проверяется ещё раз.
+    """
+    if task not in CACHEABLE:
+        return QUEUE.submit(task, fn), False
+    key = CACHE.key(task)
+    cached = None if nocache else CACHE.get(task, key)
+    if cached is not None:
+        return QUEUE.record(task, {**cached, "cache": {"hit": True, "key": key}}), True
+
+    def store(job):
+        key = CACHE.key(task)
+        cached = None if nocache else CACHE.get(task, key)
+        if cached is not None:
+            return {**cached, "cache": {"hit": True, "key": key}}, 200
+        res = fn(job)
+        payload, http = res if isinstance(res, tuple) else (res, 200)
+        code = payload.get("code", (payload.get("meta") or {}).get("code"))
+        if not job.cancelled and http == 200 and code != 124 and "profiles" not in payload:
+            CACHE.put(task, key, payload)
+        return {**payload, "cache": {"hit": False, "key": key, "bypass": nocache}}, http
+    return QUEUE.submit(task, store), False
+
+# --- Webhook: дебаунс и слияние e2e по ветке ---
+# События одной ветки в пределах ORCH_DEBOUNCE_S сливаются в один запуск (таймер
+# сдвигается с каждым событием, но не дольше ORCH_DEBOUNCE_MAX_S от первого).
+# Новый SHA снимает уже идущий или ждущий в очереди e2e этой ветки.
+DEBOUNCE_S     = float(os.getenv("ORCH_DEBOUNCE_S", "15"))
+DEBOUNCE_MAX_S = float(os.getenv("ORCH_DEBOUNCE_MAX_S", "120"))
+
+def event_ref(event, payload):
+    """-> (ветка, sha) из push / pull_request / workflow_run."""
+    if event == "push":
+        ref = payload.get("ref") or ""
+        return ref.rsplit("refs/heads/", 1)[-1], payload.get("after") or ""
+    if event == "pull_request":
+        head = (payload.get("pull_request") or {}).get("head") or {}
+        return head.get("ref") or "", head.get("sha") or ""
+    if event == "workflow_run":
+        wr = payload.get("workflow_run") or {}
+        return wr.get("head_branch") or "", wr.get("head_sha") or ""
+    return "", ""
+
+class WebhookDebouncer:
+    def __init__(self, queue):
+        self.queue = queue
+        self._lock = threading.Lock()
+        self.pending = {}     # ветка -> {"sha", "events", "event_types", "first", "timer"}
+        self.active = {}      # ветка -> (sha, Job) последнего поставленного e2e
+        self.counters = {"events": 0, "coalesced": 0, "runs": 0, "superseded": 0, "duplicates": 0}
+        self.debounce_wait = Stat()
+
+    def duplicate(self, branch, sha):
+        """sha уже ждёт дебаунса или его e2e в очереди/идёт/прошёл — повторная доставка."""
+        if not sha:
+            return None
+        p = self.pending.get(branch)
+        if p and p["sha"] == sha:
+            return {"pending": True}
+        cur = self.active.get(branch)
+        if cur and cur[0] == sha and cur[1].status in ("queued", "running", "done"):
+            return {"job_id": cur[1].id, "status": cur[1].status}
+        return None
+
+    def push(self, event, branch, sha):
+        now = time.time()
+        with self._lock:
+            self.counters["events"] += 1
+            dup = self.duplicate(branch, sha)
+            if dup is not None:
+                self.counters["duplicates"] += 1
+                return {"branch": branch, "sha": sha, "duplicate": True, **dup}
+            cur = self.active.get(branch)
+            if cur and cur[0] != sha and cur[1].cancel(f"superseded by {sha[:12] or event}"):
+                self.counters["superseded"] += 1
+            p = self.pending.get(branch)
+            if p:
+                p["timer"].cancel()
+                self.counters["coalesced"] += 1
+                p["events"] += 1
+                p["sha"] = sha or p["sha"]
+                p["event_types"].add(event)
+            else:
+                p = self.pending[branch] = {"sha": sha, "events": 1, "event_types": {event}, "first": now}
+            delay = max(0.0, min(DEBOUNCE_S, p["first"] + DEBOUNCE_MAX_S - now))
+            p["timer"] = threading.Timer(delay, self._fire, args=(branch,))
+            p["timer"].daemon = True
+            p["timer"].start()
+            return {"branch": branch, "sha": sha, "events_pending": p["events"], "fires_in_s": round(delay, 1)}
+
+    def _fire(self, branch):
+        with self._lock:
+            p = self.pending.pop(branch, None)
+            if p is None:
+                return
+            self.debounce_wait.add(time.time() - p["first"])
+            self.counters["runs"] += 1
+            job = self.queue.submit("e2e", do_webhook_e2e(sorted(p["event_types"]), branch, p["sha"], p["events"]))
+            self.active[branch] = (p["sha"], job)
+
+    def metrics(self):
+        now = time.time()
+        with self._lock:
+            return {
+                **self.counters,
+                "pending": {b: {"sha": p["sha"], "events": p["events"], "waiting_s": round(now - p["first"], 1)}
+                            for b, p in self.pending.items()},
+                "active": {b: {"sha": sha, "job_id": j.id, "status": j.status} for b, (sha, j) in self.active.items()},
+                "debounce_wait": self.debounce_wait.view(),
+                "debounce_s": DEBOUNCE_S,
+                "debounce_max_s": DEBOUNCE_MAX_S,
+            }
+
+WEBHOOKS = WebhookDebouncer(QUEUE)
+
 class H(BaseHTTPRequestHandler):
     def log_message(self, fmt, *args): return
 
+    def sync(self, task, fn, nocache=False):
+        """Задача через общую очередь (лимиты, замок рабочего дерева, кэш), ответ — когда она завершится."""
+        job, _ = submit_cached(task, fn, nocache)
+        job.done.wait()
+        return json_reply(self, job.result, job.http)
+
+    def send_profile(self, name):
+        """Файл профиля из logs/: .pstats — бинарный (python -m pstats), .collapsed — текст."""
+        path = PROFILES_DIR / name
+        if not PROFILE_NAME.match(name) or not path.is_file():
+            return json_reply(self, {"ok": False, "error": "unknown profile"}, 404)
+        data = path.read_bytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream" if name.endswith(".pstats")
+                         else "text/plain; charset=utf-8")
+        self.send_header("Content-Disposition", f'attachment; filename="{name}"')
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_log(self, job, offset):
+        """Лог с байта offset до текущего конца; X-Log-Offset — откуда читать дальше."""
+        try:
+            size = job.log_path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        offset = min(offset, size)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(size - offset))
+        self.send_header("X-Log-Offset", str(size))
+        self.send_header("X-Job-Status", job.status)
+        self.end_headers()
+        if size > offset:
+            with open(job.log_path, "rb") as f:
+                f.seek(offset)
+                left = size - offset
+                while left > 0:
+                    block = f.read(min(LOG_CHUNK, left))
+                    if not block:
+                        break
+                    self.wfile.write(block)
+                    left -= len(block)
+
+    def follow_log(self, job, offset):
+        """
+        SSE: строка лога -> событие (id — байтовое смещение после строки, годится для
+        Last-Event-ID), в конце "event: end" со статусом. Читаем файл блоками по LOG_CHUNK —
+        память на подписчика постоянна, сколько бы ни писала задача.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        pos, pending, idle = offset, b"", 0.0
+
+        def emit(chunk, end):
+            text = chunk.decode("utf-8", "replace").rstrip("\r")
+            self.wfile.write(f"id: {end}\ndata: {text}\n\n".encode("utf-8"))
+
+        try:
+            while True:
+                finished = job.done.is_set()   # до чтения: хвост, дописанный перед концом, не теряется
+                data = b""
+                if job.log_path.exists():
+                    with open(job.log_path, "rb") as f:
+                        f.seek(pos)
+                        data = f.read(LOG_CHUNK)
+                if data:
+                    pos += len(data)
+                    pending += data
+                    *lines, pending = pending.split(b"\n")
+                    end = pos - len(pending) - sum(len(l) + 1 for l in lines)
+                    for line in lines:
+                        end += len(line) + 1
+                        emit(line, end)
+                    if len(pending) >= LOG_CHUNK:   # строка без \n длиннее блока — отдаём как есть
+                        emit(pending, pos)
+                        pending = b""
+                    self.wfile.flush()
+                    idle = 0.0
+                    continue
+                if finished:
+                    if pending:
+                        emit(pending, pos)
+                    end = {"status": job.status, "code": job.code, "offset": pos}
+                    self.wfile.write(f"event: end\ndata: {json.dumps(end)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    return
+                if idle >= 15:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    idle = 0.0
+                time.sleep(0.5)
+                idle += 0.5
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
     def do_GET(self):
+        parsed = urlparse(self.path)
+        parts = [p for p in parsed.path.split("/") if p]
+
         if self.path.startswith("/health"):
-            return json_reply(self, {"ok": True, "ts": int(time.time()), "branch": BRANCH})
+            return json_reply(self, {"ok": True, "ts": int(time.time()), "branch": BRANCH, "jobs": QUEUE.counts()})
+
+        if parts == ["metrics"]:
+            jobs = QUEUE.list()
+            return json_reply(self, {
+                "ok": True,
+                "queue": {"depth": sum(1 for j in jobs if j["status"] == "queued"),
+                          "running": sum(1 for j in jobs if j["status"] == "running"),
+                          "by_status": QUEUE.counts(), "wait": QUEUE.wait.view()},
+                "webhook": WEBHOOKS.metrics(),
+                "cache": CACHE.stats(),
+            })
+
+        if parts == ["jobs"]:
+            return json_reply(self, {"ok": True, "jobs": QUEUE.list()})
+
+        if parts == ["profiles"]:
+            names = sorted((Path(p).name for p in glob.glob(str(PROFILES_DIR / "profile-*"))), reverse=True)
+            return json_reply(self, {"ok": True, "profiles": profile_links(
+                [str(PROFILES_DIR / n) for n in names if PROFILE_NAME.match(n)][:200])})
+
+        if len(parts) == 2 and parts[0] == "profiles":
+            return self.send_profile(parts[1])
+
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = QUEUE.get(parts[1])
+            if job is None:
+                return json_reply(self, {"ok": False, "error": "unknown job"}, 404)
+            if len(parts) == 2:
+                return json_reply(self, {"ok": True, **job.view(full=True)})
+            if parts[2] == "log":
+                qs = parse_qs(parsed.query or "")
+                try:
+                    offset = max(0, int(self.headers.get("Last-Event-ID") or qs.get("offset", ["0"])[0]))
+                except ValueError:
+                    offset = 0
+                follow = (qs.get("follow", ["0"])[0] in ("1", "true", "yes")
+                          or "text/event-stream" in (self.headers.get("Accept") or ""))
+                return self.follow_log(job, offset) if follow else self.send_log(job, offset)
         return json_reply(self, {"ok": False, "error": "not found"}, 404)
 
     def do_POST(self):
         parsed = urlparse(self.path)
 
+        nocache = parse_qs(parsed.query or "").get("nocache", ["0"])[0] in ("1", "true", "yes")
+        # профиль из кэша не получить — профилируемый запуск всегда настоящий
+        profile = instrument.profile_mode(parse_qs(parsed.query or "").get("profile", [""])[0]) if instrument else None
+        nocache = nocache or bool(profile)
+
         if parsed.path == "/diagnostics":
-            c,o,e = run(["python3","diagnostics.py","--json"])
-            try:
-                payload = json.loads(o) if o.strip().startswith("{") else {"raw": o}
-            except Exception:
-                payload = {"raw": o}
-            payload["meta"] = {"code": c, "stderr_tail": e[-400:]}
-            return json_reply(self, payload)
+            return self.sync("diagnostics", lambda job: do_diagnostics(job, profile), nocache)
 
         # GitHub webhook → запускаем e2e по push/PR/успешному workflow_run
         if parsed.path == "/webhook":
@@ -151,12 +959,9 @@ class H(BaseHTTPRequestHandler):
                          (payload.get("workflow_run",{}).get("conclusion") == "success"))
             if not allow:
                 return json_reply(self, {"ok": True, "skipped": True, "event": event})
-            c,o,e = run(SAFE_TASKS["e2e"], timeout=1800)
-            sheet = collect_donesheet()
-            res = gh_pr_update_body(sheet)
-            return json_reply(self, {"ok": True, "event": event, "code": c,
-                                     "stdout_tail": o[-1200:], "stderr_tail": e[-1200:],
-                                     "donesheet": res})
+            branch, sha = event_ref(event, payload)
+            queued = WEBHOOKS.push(event, branch or BRANCH, sha)
+            return json_reply(self, {"ok": True, "event": event, "queued": queued}, 202)
 
         if parsed.path == "/patch":
             length = int(self.headers.get("Content-Length") or "0")
@@ -171,54 +976,40 @@ class H(BaseHTTPRequestHandler):
                 diff_text = body.decode("utf-8", errors="ignore")
             if not any(diff_text.strip().startswith(p) for p in ("diff --git","--- ","+++ ")):
                 return json_reply(self, {"ok": False, "error": "body must contain unified diff"}, 400)
-            ensure_branch()
-            with tempfile.NamedTemporaryFile("w+", delete=False) as tf:
-                tf.write(diff_text); tf.flush()
-                c1,o1,e1 = run(["git","apply","--whitespace=fix",tf.name])
-                if c1 != 0:
-                    c2,o2,e2 = run(["git","apply","--reject",tf.name])
-                    if c2 != 0:
-                        return json_reply(self, {"ok": False, "apply_err": (e1+"\n"+e2)[-800:]}, 422)
             qs = parse_qs(parsed.query or "")
             msg = qs.get("msg", ["chore: patch via micro_orchestrator"])[0]
-            run(["git","add","-A"])
-            cc,oc,ec = run(["git","commit","-m",msg])
-            if cc != 0 and "nothing to commit" not in (oc+ec):
-                return json_reply(self, {"ok": False, "commit_err": ec[-400:]}, 500)
-            cp,op,ep = run(["git","push","origin",BRANCH], timeout=1200)
-            cd,od,ed = run(["python3","scripts/diag_report.py"])
-            return json_reply(self, {
-                "ok": cp==0,
-                "push_stdout_tail": op[-400:], "push_stderr_tail": ep[-400:],
-                "diag": {"code": cd, "stdout_tail": od[-400:], "stderr_tail": ed[-400:]}
-            }, 200 if cp==0 else 500)
+            return self.sync("patch", do_patch(diff_text, msg))
 
         if parsed.path == "/pr":
-            ensure_branch()
             length = int(self.headers.get("Content-Length") or "0")
             body = self.rfile.read(length).decode("utf-8") if length else ""
-            title = "chore(msp): automated PR from micro_orchestrator"
-            result = gh_pr_create_or_get(title, body if body.strip() else "Automated PR")
-            ok = "error" not in result
-            return json_reply(self, {"ok": ok, **result}, 200)
+            return self.sync("pr", do_pr(body))
 
+        # /run?task=...           -> 202 {job_id}; статус: GET /jobs/<id>, лог: GET /jobs/<id>/log
+        # /run?task=...&wait=1    -> как раньше, ответ после завершения
         if parsed.path == "/run":
             qs = parse_qs(parsed.query or "")
             task = (qs.get("task", [""])[0] or "").strip().lower()
             if task not in SAFE_TASKS:
                 return json_reply(self, {"ok": False, "error": f"unknown task '{task}'"}, 400)
-            c,o,e = run(SAFE_TASKS[task], timeout=1800)
-            return json_reply(self, {"ok": True, "task": task, "code": c, "stdout_tail": o[-1200:], "stderr_tail": e[-1200:]})
+            if qs.get("wait", ["0"])[0] in ("1", "true", "yes"):
+                return self.sync(task, task_fn(task, profile=profile), nocache)
+            job, hit = submit_cached(task, task_fn(task, profile=profile), nocache)
+            if hit:   # кэш: результат сразу, без запуска
+                return json_reply(self, {**job.result, "job_id": job.id, "status": job.status})
+            return json_reply(self, {"ok": True, "task": task, "job_id": job.id, "status": job.status,
+                                     "status_url": f"/jobs/{job.id}", "log_url": f"/jobs/{job.id}/log"}, 202)
 
         if parsed.path == "/donesheet":
-            sheet = collect_donesheet()
-            res = gh_pr_update_body(sheet)
-            return json_reply(self, {"ok": res.get("ok", False), **res}, 200)
+            return self.sync("donesheet", do_donesheet)
 
         return json_reply(self, {"ok": False, "error": "not found"}, 404)
 
 def main():
-    httpd = HTTPServer((HOST, PORT), H)
+    httpd = ThreadingHTTPServer((HOST, PORT), H)
+    httpd.daemon_threads = True
+    if POOL is not None:
+        POOL.warm()    # первый /run не ждёт старта воркеров и импортов
     print(f"[micro_orchestrator] listening on http://{HOST}:{PORT} (branch={BRANCH})")
     httpd.serve_forever()
 
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Слитый конвейер e2e в одном процессе: validate_kpi -> geo_check -> публикация -> join:
+- каждый сырой вход читается один раз (fastcsv.py), дальше стадии передают друг другу
+  колонки в памяти: очищенные KPI/GEO не пишутся в data/ и не перечитываются join-ом,
+  publish_data не копирует файлы — public/data/{kpi,geo,kpi_stats,joined}.csv пишутся
+  сразу новой версией с хешем в имени, .gz/.br к ним — в конце, затем один раз
+  подменяется manifest.json (см. versioned.py, precompress.py)
+- проверки, дедуп, kpi_stats.csv и join — те же функции и правила, что у отдельных
+  инструментов; файлы побайтно те же, что после validate_kpi, geo_check, join_check, publish_data
+- отчёт: "stages" — отчёты validate_kpi / geo_check / publish_data / join_check в прежнем
+  виде (с "timings" своей стадии), "codes" — их коды выхода; код конвейера — наибольший
+- --keep-cleaned: ещё и data/cleaned_*.csv и data/kpi_stats.csv — для отдельных запусков
+  kpi_stability.py / join_check.py / publish_data.py
+- --columnar [--columnar-format]: колоночные копии kpi/geo/kpi_stats — из колонок в памяти;
+  у joined — всегда, как у join_check.py
+- один постоянный словарь ключей (keydict.py, data/keys.csv) на все стадии: дедуп,
+  группировка статистики и join идут по int id Контрагента/Года, колоночные копии хранят
+  id, общие для всех файлов версии; словарь публикуется как public/data/keys.csv.
+  Только этот, публикующий, прогон пишет data/keys.csv — у отдельных инструментов словарь
+  в памяти, поэтому id в их колоночных копиях свои (CSV те же)
+- --no-commit: версии с хешем и прежние имена пишутся, манифест — нет (versioned.Publisher.stage);
+  e2e после grid_pyramid/map_tiles коммитит всё одной версией через publish_data.py --in-place
+"""
+import argparse, heapq, json, os, shutil
+from itertools import compress, repeat
+from operator import and_, eq, gt, is_
+from pathlib import Path
+
+import columnar, fastcsv, geo_check, instrument, join_check, keydict, publish_data, stats_numpy, validate_kpi, versioned
+from columns import GEO_FIELDS, KPI_FIELDS
+
+PUB = publish_data.PUB
+JOINED = PUB / "joined.csv"
+
+def publish_written(pub, name, write):
+    """write(tmp) в каталоге публикации -> новая версия name в pub (versioned.Publisher)."""
+    tmp = versioned.tmp_path(PUB / name)
+    write(tmp)
+    return pub.add(name, tmp, move=True)
+
+def kpi_stage(src, engine, keys):
+    """validate_kpi батчем -> (код, отчёт, очищенные колонки, строки kpi_stats.csv)."""
+    tr = instrument.Tracer("validate_kpi", trace=False)
+    with tr.stage("read") as st:
+        t = fastcsv.read(src, "kpi")
+        st.rows = t.rows
+    with tr.stage("validate", rows=t.rows):
+        contr, year, tenths, errors, cids = validate_kpi.check_columns(t, keys)
+    with tr.stage("stats", rows=len(contr)):
+        table = validate_kpi.batch_stats(contr, tenths, engine, cids, keys)
+    clean = [contr, year, list(validate_kpi.format_tenths(tenths))]
+    out = validate_kpi.report(src, "batch", engine, t.cols, errors, t.rows, len(contr),
+                              PUB / "kpi.csv", PUB / "kpi_stats.csv")
+    return (0 if not errors else 1), tr.attach(out), clean, table
+
+def geo_stage(src, keys):
+    """geo_check батчем -> (код, отчёт, (заголовок, очищенные колонки) или None)."""
+    tr = instrument.Tracer("geo_check", trace=False)
+    rows_in, cols, err, result = geo_check.validate_file(src, tr, keys)
+    out = {"source": src, "columns": cols.report(), "errors": [], "warnings": [], "clean_path": None,
+           "rows_in": rows_in, "rows_out": 0}
+    if err:
+        out["errors"] = err.get("errors", [])
+        return 1, tr.attach(out), None
+    cleaned, errors, warns = result
+    out.update(errors=errors, warnings=cols.warnings() + warns, rows_out=len(cleaned),
+               clean_path=str(PUB / "geo.csv"))
+    return (0 if not errors else 1), tr.attach(out), (cols.header, cleaned.cols, cleaned)
+
+def publish_stage(pub, kpi, geo, stats, fmt, keep_cleaned, geo_src, keys):
+    """
+    Публикация прямо из памяти: CSV (+ колоночная копия при fmt) в public/data/;
+    -> (отчёт как у publish_data.py, трассировщик) — манифест пишет publish_commit после join.
+    """
+    tr = instrument.Tracer("publish_data", trace=False)
+    out = {"copied": [], "missing": []}
+    items = [
+        ("kpi.csv", validate_kpi.OUT_CLEAN, "kpi", validate_kpi.CLEAN_COLS, kpi),
+        ("geo.csv", geo_check.clean_path(geo_src), "geo", geo and geo[0], geo and geo[2]),
+        ("kpi_stats.csv", validate_kpi.OUT_STATS, "stats", validate_kpi.STATS_COLS,
+         validate_kpi.stats_columns(stats)),
+    ]
+    for name, data_path, kind, header, cols in items:
+        dst = PUB / name
+        if cols is None:
+            out["missing"].append(str(publish_data.SRC[name]))
+            continue
+        with tr.stage(f"publish:{name}", rows=len(cols) if kind == "geo" else len(cols[0])):
+            if kind == "geo":
+                publish_written(pub, name, lambda p: geo_check.write_cleaned(p, header, cols))
+            else:
+                publish_written(pub, name, lambda p: fastcsv.write(p, header, cols))
+            out["copied"].append(str(dst))
+            if keep_cleaned:
+                data_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(pub.path(name), data_path)
+        if fmt:
+            with tr.stage(f"columnar:{name}"):
+                raw = geo[1] if kind == "geo" else cols
+                res = columnar.write_columns(dst, typed(kind, header, raw, keys), keys, fmt)
+                out["copied"].append(res["path"])
+
+    for name, src_path in publish_data.OPTIONAL.items():
+        if src_path.exists():
+            with tr.stage(f"publish:{name}"):
+                pub.add(name, src_path)
+            out["copied"].append(str(PUB / name))
+    return out, tr
+
+def publish_commit(pub, out, tr, keys, commit=True):
+    """
+    Словарь ключей, дельты, предсжатие, манифест новой версии, прежние имена, сборка мусора
+    -> (код, отчёт publish_data); commit=False — только прежние имена, манифест не трогается.
+    """
+    if keys.path.exists():
+        with tr.stage("publish:keys.csv"):
+            pub.add("keys.csv", keys.path)
+        out["copied"].append(str(PUB / "keys.csv"))
+    if not commit:
+        with tr.stage("stage"):
+            out.update(pub.stage())
+        return 0, tr.attach(out)
+    with tr.stage("delta"):
+        out["delta"] = pub.deltas()
+    with tr.stage("compress"):
+        out["compress"] = pub.compress()
+    with tr.stage("manifest"):
+        out.update(pub.commit())
+    return 0, tr.attach(out)
+
+def typed(kind, header, raw, keys):
+    """Колонки очищенного файла -> типизированные колонки схемы kind (как columnar.read_columns)."""
+    schema, fields = columnar.SCHEMAS[kind]
+    t = fastcsv.Table(header, raw, False, fields)
+    return columnar.typed_columns(kind, [t.text(name, strip=False) for name, _ in schema], keys)
+
+def side(header, raw, fields, values, keys):
+    """
+    Очищенные колонки -> (int-ключи keydict, Контрагенты, Годы, колонки значений) строк
+    с непустым ключом — то же, что join_check.read_side по записанному файлу (Table.text
+    выбирает колонку как getter; strip не нужен — валидаторы уже сняли пробелы со всех полей).
+    """
+    t = fastcsv.Table(header, raw, False, fields)
+    contr, year = t.text("contragent", strip=False), t.text("year", strip=False)
+    vals = [t.text(v, strip=False) for v in values]
+    keep = bytes(map(and_, map(bool, contr), map(bool, year)))
+    if 0 in keep:
+        contr, year = list(compress(contr, keep)), list(compress(year, keep))
+        vals = [list(compress(v, keep)) for v in vals]
+    return keys.pack(keys.ids("contragent", contr), keys.ids("year", year)), contr, year, vals
+
+def numeric_ok(name, vals):
+    """Маска строк, которые join_check пропускает в joined.csv: координаты числа / урожайность > 0."""
+    nums = [fastcsv.parse_floats(v)[0] for v in vals]
+    if name == "kpi":
+        return bytes(map(gt, nums[0], repeat(0.0)))
+    lat, lon = nums
+    return bytes(map(and_, map(eq, lat, lat), map(eq, lon, lon)))     # NaN != NaN
+
+def join_stage(pub, kpi, geo, fmt, keys):
+    """
+    join_check по колонкам в памяти: меньший (по размеру опубликованного CSV) набор —
+    индекс (при повторе ключа побеждает последний), больший пробует его по порядку строк.
+    Ключи — int keydict; образцы несовпавших распаковываются обратно в (Контрагент, Год).
+    """
+    tr = instrument.Tracer("join_check", trace=False)
+    with tr.stage("keys", rows=len(kpi[0])):
+        sides = {
+            "geo": side(geo[0], geo[1], GEO_FIELDS, ("lat", "lon"), keys) if geo else ([], [], [], [[], []]),
+            "kpi": side(validate_kpi.CLEAN_COLS, kpi, KPI_FIELDS, ("yield",), keys),
+        }
+    sizes = {n: (pub.files[f"{n}.csv"]["bytes"] if f"{n}.csv" in pub.sources else 0) for n in sides}
+    build, probe = sorted(sides, key=lambda n: sizes[n])
+
+    with tr.stage("index") as st:
+        bkeys, _, _, bvals = sides[build]
+        index = dict(zip(bkeys, range(len(bkeys))))
+        bok = numeric_ok(build, bvals)
+        st.rows = len(index)
+
+    pkeys, pcontr, pyear, pvals = sides[probe]
+    with tr.stage("probe", rows=len(pkeys)):
+        hits = list(map(index.get, pkeys))
+        miss = bytes(map(is_, hits, repeat(None)))
+        matched = set(compress(pkeys, miss.translate(validate_kpi.FLIP)))
+        only_probe = heapq.nsmallest(10, map(keys.unpack, set(compress(pkeys, miss))))
+        pok = numeric_ok(probe, pvals)
+        sel, rows = [], []
+        for j, h in enumerate(hits):
+            if h is not None and bok[h] and pok[j]:
+                sel.append(j)
+                rows.append(h)
+
+    with tr.stage("write", rows=len(sel)):
+        contr = [pcontr[j] for j in sel]
+        year = [pyear[j] for j in sel]
+        picked = {build: [[v[h] for h in rows] for v in bvals],
+                  probe: [[v[j] for j in sel] for v in pvals]}
+        cols = [contr, year, *picked["geo"], *picked["kpi"]]
+        publish_written(pub, JOINED.name, lambda p: fastcsv.write(p, join_check.JOINED_COLS, cols))
+
+    counts = {build: len(index), probe: len(pkeys)}
+    only = {build: heapq.nsmallest(10, map(keys.unpack, set(index) - matched)), probe: only_probe}
+    out = {
+        "geo_file": str(PUB / "geo.csv"),
+        "kpi_file": str(PUB / "kpi.csv"),
+        "geo_keys": counts["geo"],
+        "kpi_keys": counts["kpi"],
+        "matched": len(matched),
+        "only_geo_samples": only["geo"],
+        "only_kpi_samples": only["kpi"],
+        "build_side": build,
+        "joined_path": str(JOINED),
+        "joined_rows": len(sel),
+        "hint": join_check.HINT,
+    }
+    with tr.stage("columnar", rows=len(sel)):
+        out["columnar"] = columnar.write_columns(JOINED, columnar.typed_columns("joined", cols, keys), keys, fmt)
+    return (0 if matched else 1), tr.attach(out)
+
+def run(argv=None):
+    """-> (код выхода, отчёт) — то же, что печатает CLI."""
+    ap = argparse.ArgumentParser(description="Fused validate -> join -> stats -> publish pipeline")
+    ap.add_argument("--kpi", default="data/sample_kpi.csv")
+    ap.add_argument("--geo", default=os.getenv("GEO_CSV", "data/sample_geo.csv"))
+    ap.add_argument("--engine", choices=["python", "numpy", "auto"], default="python",
+                    help="движок kpi_stats.csv (как у validate_kpi.py)")
+    ap.add_argument("--keep-cleaned", action="store_true",
+                    help="также писать data/cleaned_*.csv и data/kpi_stats.csv для отдельных инструментов")
+    ap.add_argument("--columnar", action="store_true",
+                    help="колоночные копии kpi/geo/kpi_stats рядом с публикуемыми CSV")
+    ap.add_argument("--columnar-format", choices=columnar.FORMATS, default="auto")
+    ap.add_argument("--no-commit", action="store_true",
+                    help="не писать manifest.json — версию соберёт publish_data.py --in-place")
+    args = ap.parse_args(argv)
+    if not Path(args.kpi).exists():
+        return 2, {"error": f"not found: {args.kpi}"}
+    engine = args.engine
+    if engine == "auto" or (engine == "numpy" and not stats_numpy.available()):
+        engine = "numpy" if stats_numpy.available() else "python"
+    fmt = args.columnar_format if args.columnar else None
+
+    tr = instrument.Tracer("pipeline")
+    pub = versioned.Publisher(PUB)
+    keys = keydict.KeyDict(keydict.KEYS)
+    reports, codes = {}, {}
+    with fastcsv.no_gc():
+        with tr.stage("validate_kpi") as st:
+            codes["validate_kpi"], reports["validate_kpi"], kpi, stats = kpi_stage(args.kpi, engine, keys)
+            st.rows = reports["validate_kpi"]["rows_in"]
+        with tr.stage("geo_check") as st:
+            codes["geo_check"], reports["geo_check"], geo = geo_stage(args.geo, keys)
+            st.rows = reports["geo_check"]["rows_in"]
+        with tr.stage("publish_data"):
+            published, pub_tr = publish_stage(pub, kpi, geo, stats, fmt, args.keep_cleaned, args.geo, keys)
+        with tr.stage("join_check", rows=len(kpi[0])):
+            codes["join_check"], reports["join_check"] = join_stage(pub, kpi, geo, args.columnar_format, keys)
+        with tr.stage("commit"):
+            codes["publish_data"], reports["publish_data"] = publish_commit(pub, published, pub_tr, keys, not args.no_commit)
+    out = {"kpi": args.kpi, "geo": args.geo, "engine": engine, "codes": codes, "stages": reports}
+    return max(codes.values()), tr.attach(out)
+
+def main():
+    code, out = instrument.profiled("pipeline", run)
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    return code
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Предсжатые копии публикуемых файлов (versioned.Publisher.compress) — статический сервер
+отдаёт готовые байты (nginx gzip_static/brotli_static), а не сжимает на каждый запрос:
+- <файл>.gz — gzip -9, mtime=0: один и тот же вход даёт побайтно тот же .gz
+- <файл>.br — brotli quality 11, если установлен модуль brotli (необязателен; нет — только .gz)
+- сжимаются только файлы с хешем в имени: содержимое такого файла не меняется, поэтому
+  готовая копия рядом всегда актуальна — есть копия, значит сжимать нечего
+- пары (файл, кодировка) сжимаются параллельно в потоках: zlib и brotli отпускают GIL
+  на время сжатия; RAYAGRO_COMPRESS_WORKERS (по умолчанию — число CPU)
+- файлы меньше MIN_BYTES (RAYAGRO_PRECOMPRESS_MIN_BYTES, 1024) не сжимаются: заголовок
+  gzip съедает выигрыш, .gz выходит не меньше исходника
+- запись через временный файл + rename, как у versioned.py
+RAYAGRO_PRECOMPRESS — кодировки через запятую (по умолчанию gzip,br), 0 — не сжимать.
+"""
+import gzip, os, time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен
+    brotli = None
+
+SUFFIX = {"gzip": ".gz", "br": ".br"}
+WORKERS = int(os.getenv("RAYAGRO_COMPRESS_WORKERS", "0")) or os.cpu_count() or 1
+MIN_BYTES = int(os.getenv("RAYAGRO_PRECOMPRESS_MIN_BYTES", "1024"))
+
+def _gzip(data):
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def _brotli(data):
+    return brotli.compress(data, quality=11)
+
+CODECS = {"gzip": _gzip, "br": _brotli}
+
+def wanted():
+    """RAYAGRO_PRECOMPRESS -> список кодировок (0 или пусто — ни одной)."""
+    want = os.getenv("RAYAGRO_PRECOMPRESS", "gzip,br").strip()
+    if want in ("", "0"):
+        return []
+    return [e for e in dict.fromkeys(w.strip() for w in want.split(",")) if e in CODECS]
+
+def encodings():
+    """Кодировки этого запуска: wanted() без недоступных (br без модуля brotli)."""
+    return [e for e in wanted() if e != "br" or brotli is not None]
+
+def sibling(path, enc):
+    path = Path(path)
+    return path.with_name(path.name + SUFFIX[enc])
+
+def _compress(path, enc):
+    """path -> <path>.gz|.br; -> (байт на входе, байт на выходе, секунды)."""
+    t0 = time.perf_counter()
+    data = Path(path).read_bytes()
+    packed = CODECS[enc](data)
+    dst = sibling(path, enc)
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(packed)
+    os.replace(tmp, dst)
+    return len(data), len(packed), time.perf_counter() - t0
+
+def compress(paths, encs=None, workers=None):
+    """
+    Сжимает файлы paths (от MIN_BYTES) во все encs, кроме уже сжатых; -> отчёт
+    {encodings, workers, wall_s, files: {имя: {enc: {bytes, ratio, s}}}, total: {enc: {...}}, small}.
+    ratio — доля исходного размера (0.2 — копия впятеро меньше).
+    """
+    encs = encodings() if encs is None else encs
+    paths = [Path(p) for p in paths]
+    small = [p.name for p in paths if p.stat().st_size < MIN_BYTES]
+    jobs = [(p, e) for p in paths if p.name not in small for e in encs if not sibling(p, e).exists()]
+    workers = max(1, min(workers or WORKERS, len(jobs)))
+    t0 = time.perf_counter()
+    if workers == 1:
+        done = [_compress(p, e) for p, e in jobs]
+    else:
+        with ThreadPoolExecutor(workers) as ex:
+            done = list(ex.map(lambda job: _compress(*job), jobs))
+    files, total = {}, {}
+    for (p, e), (n_in, n_out, s) in zip(jobs, done):
+        files.setdefault(p.name, {})[e] = {"bytes": n_out, "ratio": _ratio(n_out, n_in), "s": round(s, 4)}
+        t = total.setdefault(e, {"in": 0, "out": 0, "s": 0.0})
+        t["in"] += n_in
+        t["out"] += n_out
+        t["s"] += s
+    for t in total.values():
+        t.update(ratio=_ratio(t["out"], t["in"]), s=round(t["s"], 4))
+    report = {"encodings": encs, "workers": workers, "wall_s": round(time.perf_counter() - t0, 4),
+              "files": files, "total": total, "small": small}
+    if brotli is None and "br" in wanted():
+        report["note"] = "brotli is not installed: .br skipped"
+    return report
+
+def _ratio(n_out, n_in):
+    return round(n_out / n_in, 4) if n_in else 0.0
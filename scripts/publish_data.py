@@ -5,26 +5,113 @@
 - data/cleaned_sample_kpi.csv -> public/data/kpi.csv
 - data/cleaned_sample_geo.csv -> public/data/geo.csv
 - data/kpi_stats.csv          -> public/data/kpi_stats.csv
+- data/kpi_stability.csv      -> public/data/kpi_stability.csv (если есть, см. kpi_stability.py)
+Если валидаторы запускались с --columnar, рядом публикуются и колоночные копии
+(kpi.arrow или kpi.cols/*.npy и т.д.) — фронт/аналитика читают числа без разбора CSV.
+- data/keys.csv               -> public/data/keys.csv (постоянный словарь id, если его уже
+  завёл pipeline.py, см. keydict.py; всегда из data/, в том числе с --in-place — он только
+  дописывается)
+Версии (см. versioned.py): каждый файл ещё и под именем с хешем содержимого
+(kpi.<sha>.csv) + public/data/manifest.json, подмена — rename; неизменившиеся файлы
+не переписываются, старые версии собираются. Лежащие прямо в public/data/ выходы
+других шагов (joined.csv, grid.json, kpi_stability.csv — GENERATED) версионируются на месте.
+- public/data/tiles/index.json -> tiles.json (если map_tiles.py уже строил тайлы): в индексе
+  хеш набора тайлов, так что новая версия тайлов — новая запись манифеста
+--in-place: источники — уже опубликованные public/data/<имя> (после pipeline.py).
+Новые версии сжимаются заранее в .gz/.br рядом (precompress.py), в отчёте "compress" —
+степень сжатия и время по файлам. Для kpi/geo/joined.csv — построчная дельта от прошлой
+версии по (Контрагент, Год) (delta.py), в отчёте "delta", цепочка — в манифесте.
+"timings": стадия на каждый публикуемый файл (см. instrument.py).
 """
-import shutil, json
+import argparse, shutil, json
 from pathlib import Path
 
+import instrument, keydict, versioned
+from columnar import artifact_paths
+
 ROOT = Path(__file__).resolve().parents[1]
 SRC = {
     "kpi.csv": ROOT / "data" / "cleaned_sample_kpi.csv",
     "geo.csv": ROOT / "data" / "cleaned_sample_geo.csv",
     "kpi_stats.csv": ROOT / "data" / "kpi_stats.csv",
 }
+OPTIONAL = {
+    "kpi_stability.csv": ROOT / "data" / "kpi_stability.csv",
+}
 PUB = ROOT / "public" / "data"
-PUB.mkdir(parents=True, exist_ok=True)
-
-out = {"copied": [], "missing": []}
+GENERATED = ["joined.csv", "grid.json", "kpi_stability.csv"]   # пишутся прямо в public/data/
+TILES_INDEX = PUB / "tiles" / "index.json"                       # см. map_tiles.py
 
-for dst_name, src_path in SRC.items():
+def publish(dst_name, src_path, out, pub):
+    """CSV (новой версией в pub: versioned.Publisher) и его колоночная копия -> public/data/<dst_name>."""
     if src_path.exists():
-        shutil.copy2(src_path, PUB / dst_name)
+        pub.add(dst_name, src_path)
         out["copied"].append(str(PUB / dst_name))
     else:
         out["missing"].append(str(src_path))
 
-print(json.dumps(out, ensure_ascii=False, indent=2))
+    # колоночные копии необязательны: публикуем тот формат, что есть, другой убираем
+    src_arrow, src_cols = artifact_paths(src_path)
+    dst_arrow, dst_cols = artifact_paths(PUB / dst_name)
+    if src_arrow.exists():
+        shutil.rmtree(dst_cols, ignore_errors=True)
+        shutil.copy2(src_arrow, dst_arrow)
+        out["copied"].append(str(dst_arrow))
+    elif src_cols.is_dir():
+        dst_arrow.unlink(missing_ok=True)
+        shutil.rmtree(dst_cols, ignore_errors=True)
+        shutil.copytree(src_cols, dst_cols)
+        out["copied"].append(str(dst_cols))
+
+def run(argv=None):
+    """-> (код выхода, отчёт) — то же, что печатает CLI."""
+    ap = argparse.ArgumentParser(description="Publish cleaned data to public/data/")
+    ap.add_argument("--in-place", action="store_true",
+                    help="только версионировать файлы, уже лежащие в public/data/ (после pipeline.py)")
+    args = ap.parse_args(argv)
+    PUB.mkdir(parents=True, exist_ok=True)
+    out = {"copied": [], "missing": []}
+    tr = instrument.Tracer("publish_data")
+    pub = versioned.Publisher(PUB)
+
+    if not args.in_place:
+        for dst_name, src_path in SRC.items():
+            with tr.stage(f"publish:{dst_name}"):
+                publish(dst_name, src_path, out, pub)
+
+        for dst_name, src_path in OPTIONAL.items():
+            if src_path.exists():
+                with tr.stage(f"publish:{dst_name}"):
+                    pub.add(dst_name, src_path)
+                out["copied"].append(str(PUB / dst_name))
+
+    if keydict.KEYS.exists():
+        with tr.stage("publish:keys.csv"):
+            pub.add("keys.csv", keydict.KEYS)
+        out["copied"].append(str(PUB / "keys.csv"))
+
+    if TILES_INDEX.exists():
+        with tr.stage("version:tiles.json"):
+            pub.add("tiles.json", TILES_INDEX)
+        out["copied"].append(str(PUB / "tiles.json"))
+
+    names = GENERATED if not args.in_place else [*SRC, *OPTIONAL, *GENERATED]
+    for name in dict.fromkeys(names):
+        if (PUB / name).exists() and name not in pub.sources:
+            with tr.stage(f"version:{name}"):
+                pub.add(name, PUB / name)
+    with tr.stage("delta"):
+        out["delta"] = pub.deltas()
+    with tr.stage("compress"):
+        out["compress"] = pub.compress()
+    with tr.stage("manifest"):
+        out.update(pub.commit())
+    return 0, tr.attach(out)
+
+def main():
+    code, out = instrument.profiled("publish_data", run)
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    return code
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Шардирование больших CSV для --workers N:
+- split(): режем файл по байтовым смещениям, выравнивая на границы строк
+  (заголовок остаётся главному процессу; многострочные значения в кавычках
+  не поддерживаются — в наших выгрузках их нет); заголовок декодируется как utf-8-sig —
+  BOM снимается так же, как в батче (fastcsv.read)
+- run(): шарды разбираются/проверяются в пуле процессов, результаты в порядке файла
+- merge_first_seen(): дедуп по ключу (Контрагент, Год) через границы шардов,
+  с глобальными номерами строк — итог совпадает с однопроцессным проходом
+"""
+import csv, os
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+DUPLICATE = object()
+
+def read_header(path, encoding="utf-8-sig"):
+    with open(path, "rb") as f:
+        return next(csv.reader([f.readline().decode(encoding)]), [])
+
+def split(path, n, encoding="utf-8-sig"):
+    """-> (header: list[str], [(start, end), ...]) — непустые байтовые диапазоны."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.readline()
+        body = f.tell()
+        cuts = [body]
+        for k in range(1, max(1, n)):
+            f.seek(body + (size - body) * k // n)
+            if f.tell() > body:
+                f.readline()  # дочитываем до конца текущей строки
+            cuts.append(max(cuts[-1], f.tell()))
+        cuts.append(size)
+    return read_header(path, encoding), [(a, b) for a, b in zip(cuts, cuts[1:]) if b > a]
+
+def read_lines(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line.decode("utf-8")
+
+def shard_rows(path, start, end):
+    """Непустые строки CSV из диапазона [start, end)."""
+    return (r for r in csv.reader(read_lines(path, start, end)) if r)
+
+def run(fn, path, ranges, extra, workers):
+    """fn((path, start, end, *extra)) в пуле процессов; результаты — в порядке шардов."""
+    jobs = [(path, a, b, *extra) for a, b in ranges]
+    if workers <= 1 or len(jobs) <= 1:
+        return [fn(j) for j in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(fn, jobs))
+
+def merge_first_seen(results, start=1):
+    """
+    results: [(n_rows, first, dups)] по шардам, где
+      first — [(i, key, payload)] первые вхождения ключа внутри шарда,
+      dups  — [(i, key)] повторы внутри шарда (i — номер строки в шарде с 1).
+    Отдаёт (row, key, payload) в порядке файла; для дублей payload is DUPLICATE.
+    """
+    seen = set()
+    offset = start - 1
+    for n, first, dups in results:
+        events = [(offset + i, key, DUPLICATE) for i, key in dups]
+        for i, key, payload in first:
+            if key in seen:
+                events.append((offset + i, key, DUPLICATE))
+            else:
+                seen.add(key)
+                events.append((offset + i, key, payload))
+        events.sort(key=itemgetter(0))
+        yield from events
+        offset += n
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+NumPy-движок для kpi_stats.csv (validate_kpi.py --engine numpy):
+- урожайности уже округлены до 0.1, поэтому считаем в целых десятых:
+  n, S = Σk, Q = Σk² — групповые reduceat по отсортированным кодам Контрагентов
+- Mean/SD/CV округляются как round01 в чистом Python; при точной (или почти точной)
+  «половинке» значение пересчитывается через statistics для этой группы,
+  поэтому результат побайтно совпадает с Python-путём
+- ранжирование WAASB_proxy — по точной дисперсии D/n², группы с равной
+  дисперсией упорядочиваются так же, как sorted((pstdev, idx)) в Python
+"""
+from statistics import mean, pstdev
+
+try:
+    import numpy as np
+except ImportError:  # движок необязательный
+    np = None
+
+EXACT_LIMIT = 2 ** 53  # n*Q, S*S и n² должны быть точно представимы во float64
+HALF_TOL = 1e-9        # относительная близость к .5, при которой считаем через statistics
+
+def available():
+    return np is not None
+
+def _near_half(x10):
+    return np.abs(x10 - np.floor(x10) - 0.5) < HALF_TOL * np.maximum(1.0, np.abs(x10))
+
+def stats_rows(names, codes, tenths):
+    """
+    names  — Контрагенты в порядке первого появления (код = индекс),
+    codes  — код Контрагента на каждую очищенную строку,
+    tenths — урожайность строки в десятых ц/га (int).
+    -> строки kpi_stats.csv (те же dict, что у validate_kpi.stats_rows) или None,
+       если значения слишком велики для точной арифметики во float64.
+    """
+    G = len(names)
+    if G == 0:
+        return []
+    codes = np.asarray(codes, dtype=np.int64)
+    k = np.asarray(tenths, dtype=np.int64)
+    order = np.argsort(codes, kind="stable")
+    ck, sk = codes[order], k[order]
+    starts = np.flatnonzero(np.r_[True, ck[1:] != ck[:-1]])
+    n = np.diff(np.r_[starts, len(sk)])
+    kmax, nmax = int(np.abs(sk).max()), int(n.max())
+    if (kmax * nmax) ** 2 >= EXACT_LIMIT:
+        return None
+    S = np.add.reduceat(sk, starts)
+    Q = np.add.reduceat(sk * sk, starts)
+    D = n * Q - S * S                     # n² · дисперсия в (десятых)²
+
+    def values(g):
+        a = starts[g]
+        return [v / 10 for v in sk[a:a + n[g]].tolist()]
+
+    # Mean: round(S/n) в целых; ровно .5 -> через statistics.mean
+    mean10 = (2 * S + n) // (2 * n)
+    mean_tie = 2 * np.mod(S, n) == n
+    # SD и CV во float; у «половинок» — через statistics.pstdev
+    sd10 = np.sqrt(D.astype(np.float64)) / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cv10 = np.where(S != 0, 1000.0 * sd10 / (S / n), 0.0)
+    # S == 0: во float сумма ±x может не обнулиться, и Python-путь получит огромный CV
+    hazard = mean_tie | (S == 0) | _near_half(sd10) | _near_half(cv10)
+
+    mean_out = (mean10 / 10.0).tolist()
+    sd_out = (np.rint(sd10) / 10.0 + 0.0).tolist()   # + 0.0: без "-0.0", как round() в Python
+    cv_out = (np.rint(cv10) / 10.0 + 0.0).tolist()
+    for g in np.flatnonzero(hazard).tolist():
+        ys = values(g)
+        m = mean(ys)
+        sd = pstdev(ys) if len(ys) > 1 else 0.0
+        cv = (sd / m * 100.0) if m else 0.0
+        mean_out[g] = round(m * 10) / 10.0
+        sd_out[g] = round(sd * 10) / 10.0
+        cv_out[g] = round(cv * 10) / 10.0
+
+    # Ранг по SD: ключ D/n² точен (целые < 2**53, деление корректно округлено),
+    # равные ключи с D > 0 Python различает по ulp-погрешности pstdev — повторяем её.
+    key = D.astype(np.float64) / (n * n).astype(np.float64)
+    idx = np.arange(G)
+    ranked = np.lexsort((idx, key))
+    skey = key[ranked]
+    run_start = np.flatnonzero(np.r_[True, skey[1:] != skey[:-1]])
+    run_len = np.diff(np.r_[run_start, G])
+    ranked = ranked.tolist()
+    for a, ln in zip(run_start.tolist(), run_len.tolist()):
+        if ln > 1 and skey[a] > 0:
+            members = ranked[a:a + ln]
+            ranked[a:a + ln] = sorted(members, key=lambda g: (pstdev(values(g)), g))
+    rank = np.empty(G, dtype=np.int64)
+    rank[np.asarray(ranked)] = np.arange(1, G + 1)
+    stability = 100.0 * (1.0 - (rank - 1) / max(1, G - 1))
+    waasb_out = (np.round(stability * 10) / 10.0).tolist()
+
+    return [
+        {"Контрагент": c, "Mean_ц_га": m, "SD_ц_га": sd, "CV_%": cv, "WAASB_proxy": w}
+        for c, m, sd, cv, w in zip(names, mean_out, sd_out, cv_out, waasb_out)
+    ]
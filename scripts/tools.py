@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Валидаторы и шаги публикации как функции — без bash -lc + python3 + импортов на каждый вызов:
+- у каждого инструмента есть run(argv) -> (код, отчёт), main() лишь печатает отчёт
+- call(tool, argv)        — в текущем процессе
+- call_subprocess(...)    — прежний путь через python3 scripts/<tool>.py (запасной)
+- Pool                    — тёплый пул процессов (модули импортированы заранее);
+                            сломался пул — вызов уходит в call_subprocess; изменились
+                            исходники (patch, checkout) — пул пересоздаётся, старый код не живёт;
+                            call(..., cancelled=f): f() истинна — воркеры убиваются, пул
+                            пересоздаётся (соседние вызовы уходят в call_subprocess)
+Все три отдают один конверт (RESULT_SCHEMA = 1):
+  {"schema", "tool", "argv", "code", "report", "elapsed_s", "via": inprocess|pool|subprocess,
+   "error"?: str, "fallback"?: str}
+profile="cprofile|sample|both" (или RAYAGRO_PROFILE) — вызов под профилировщиком, файлы в
+logs/profile-<tool>-*, пути — в report["profile"] (см. instrument.profiled).
+`python3 scripts/tools.py --bench N` — латентность цепочки валидаторов e2e: подпроцессы против пула.
+"""
+import argparse, importlib, importlib.util, json, os, subprocess, sys, threading, time, traceback, weakref
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parent
+ROOT = SCRIPTS.parent
+if str(SCRIPTS) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS))
+
+import instrument
+
+RESULT_SCHEMA = 1
+CANCEL_POLL_S = 0.2     # как часто Pool.call проверяет отмену задачи
+TOOLS = {
+    "validate_kpi":  SCRIPTS / "validate_kpi.py",
+    "geo_check":     SCRIPTS / "geo_check.py",
+    "join_check":    SCRIPTS / "join_check.py",
+    "kpi_stability": SCRIPTS / "kpi_stability.py",
+    "grid_pyramid":  SCRIPTS / "grid_pyramid.py",
+    "map_tiles":     SCRIPTS / "map_tiles.py",
+    "publish_data":  SCRIPTS / "publish_data.py",
+    "pipeline":      SCRIPTS / "pipeline.py",
+    "diagnostics":   ROOT / "diagnostics.py",   # корневой, не scripts/diagnostics.py
+}
+
+def enabled():
+    """RAYAGRO_INPROC=0 — всегда через подпроцессы, как раньше."""
+    return os.getenv("RAYAGRO_INPROC", "1") not in ("0", "false", "no")
+
+def load(tool):
+    path = TOOLS[tool]
+    if path.parent == SCRIPTS:
+        return importlib.import_module(path.stem)
+    name = f"rayagro_{path.stem}"
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, path)
+        mod = importlib.util.module_from_spec(spec)
+        sys.modules[name] = mod
+        spec.loader.exec_module(mod)
+    return sys.modules[name]
+
+def envelope(tool, argv, code, report, elapsed, via, **extra):
+    return {"schema": RESULT_SCHEMA, "tool": tool, "argv": list(argv), "code": code,
+            "report": report, "elapsed_s": round(elapsed, 4), "via": via, **extra}
+
+def call(tool, argv=(), profile=None):
+    t0 = time.perf_counter()
+    extra = {}
+    try:
+        code, report = instrument.profiled(tool, load(tool).run, list(argv), profile)
+    except SystemExit as e:          # argparse: неверные аргументы
+        code = e.code if isinstance(e.code, int) else 2
+        report = {"error": f"bad arguments: {list(argv)}"}
+    except Exception as e:
+        code, report = 1, {"error": repr(e)}
+        extra["error"] = traceback.format_exc()[-2000:]
+    return envelope(tool, argv, code, report, time.perf_counter() - t0, "inprocess", **extra)
+
+def call_subprocess(tool, argv=(), timeout=600, profile=None):
+    t0 = time.perf_counter()
+    cmd = [sys.executable, str(TOOLS[tool]), *argv, *([f"--profile={profile}"] if profile else [])]
+    try:
+        p = subprocess.run(cmd, cwd=os.getcwd(), capture_output=True, text=True, timeout=timeout)
+        code, out, err = p.returncode, p.stdout, p.stderr
+    except subprocess.TimeoutExpired as e:
+        code, out, err = 124, e.stdout or "", e.stderr or ""
+        out = out.decode("utf-8", "replace") if isinstance(out, bytes) else out
+        err = err.decode("utf-8", "replace") if isinstance(err, bytes) else err
+    try:
+        report = json.loads(out) if out.strip().startswith("{") else {"raw": out[-2000:]}
+    except ValueError:
+        report = {"raw": out[-2000:]}
+    extra = {"error": err[-2000:]} if err.strip() else {}
+    return envelope(tool, argv, code, report, time.perf_counter() - t0, "subprocess", **extra)
+
+def _warm():
+    for tool in TOOLS:
+        try:
+            load(tool)
+        except Exception:
+            pass    # инструмент без зависимостей поднимет ошибку уже при вызове
+
+def source_stamp():
+    """mtime всех исходников инструментов — признак, что тёплые модули устарели."""
+    paths = sorted(SCRIPTS.glob("*.py")) + [ROOT / "diagnostics.py"]
+    return tuple((p.name, p.stat().st_mtime_ns) for p in paths if p.exists())
+
+class Pool:
+    """Тёплый пул процессов для call(); создаётся лениво, после поломки пересоздаётся."""
+    def __init__(self, workers=2):
+        self.workers = max(1, workers)
+        self._ex = None
+        self._stamp = None
+        self._lock = threading.Lock()
+        self._retired = weakref.WeakKeyDictionary()   # сменённый пул -> его воркеры (shutdown их забывает)
+
+    def _executor(self):
+        with self._lock:
+            stamp = source_stamp()
+            if self._ex is not None and stamp != self._stamp:
+                self._reset_locked(kill=False)
+            if self._ex is None:
+                self._ex = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm)
+                self._stamp = stamp
+            return self._ex
+
+    def _reset(self, ex=None):
+        """Убить воркеры ex (по умолчанию — текущего пула); текущий пул пересоздастся при следующем вызове."""
+        with self._lock:
+            if ex is None or ex is self._ex:
+                self._reset_locked(kill=True)
+            else:
+                self._kill(ex)              # пул уже сменился — добиваем только старый
+
+    def _reset_locked(self, kill):
+        ex, self._ex = self._ex, None
+        if ex is not None and not kill:
+            self._retired[ex] = list((ex._processes or {}).values())
+            ex.shutdown(wait=False)    # начатые вызовы доработают на старом коде
+        elif ex is not None:
+            self._kill(ex)
+
+    def _kill(self, ex):
+        procs = self._retired.pop(ex, None) or list((getattr(ex, "_processes", None) or {}).values())
+        for p in procs:
+            p.kill()
+        ex.shutdown(wait=False, cancel_futures=True)
+
+    def warm(self):
+        """Поднять воркеры заранее, чтобы первый вызов не платил за старт."""
+        list(self._executor().map(int, range(self.workers)))
+
+    def call(self, tool, argv=(), timeout=600, profile=None, cancelled=None):
+        """
+        cancelled — функция без аргументов: стала истинной — воркер с вызовом убивается
+        (код 130), иначе отменённая задача держала бы его (и замок рабочего дерева) до конца.
+        """
+        t0 = time.perf_counter()
+        deadline = time.monotonic() + timeout
+        ex = None
+        try:
+            ex = self._executor()
+            fut = ex.submit(call, tool, list(argv), profile)
+            while True:
+                left = max(0, deadline - time.monotonic())
+                try:
+                    res = fut.result(timeout=min(left, CANCEL_POLL_S) if cancelled else left)
+                    break
+                except FutureTimeout:
+                    if cancelled is not None and cancelled():
+                        self._reset(ex)    # снятую задачу не дорабатываем
+                        return envelope(tool, argv, 130, {"error": "cancelled"}, time.perf_counter() - t0, "pool")
+                    if time.monotonic() >= deadline:
+                        self._reset(ex)    # зависший воркер не отдать обратно — пул пересоздаётся
+                        return envelope(tool, argv, 124, {"error": "timeout"}, time.perf_counter() - t0, "pool")
+        except (BrokenProcessPool, OSError) as e:
+            self._reset(ex)
+            return {**call_subprocess(tool, argv, timeout, profile), "fallback": repr(e)}
+        return {**res, "via": "pool"}
+
+    def shutdown(self):
+        if self._ex is not None:
+            self._ex.shutdown(wait=True)
+            self._ex = None
+
+# цепочка валидаторов e2e (без npm build / smoke) — для --bench;
+# validate_kpi + geo_check + join_check + publish_data — одним проходом pipeline.py
+E2E_TOOLS = [
+    ("pipeline", ["--columnar", "--no-commit", "--kpi", "data/sample_kpi.csv", "--geo", "data/sample_geo.csv"]),
+    ("kpi_stability", ["public/data/kpi.csv", "--out", "public/data/kpi_stability.csv"]),
+    ("grid_pyramid", []),
+    ("map_tiles", []),
+    ("publish_data", ["--in-place"]),    # одна версия manifest.json на всю цепочку
+]
+
+def bench(rounds):
+    def chain(fn):
+        t0 = time.perf_counter()
+        codes = [fn(tool, argv)["code"] for tool, argv in E2E_TOOLS]
+        return time.perf_counter() - t0, codes
+
+    pool = Pool(workers=1)
+    pool.warm()
+    out = {"rounds": rounds, "steps": [t for t, _ in E2E_TOOLS], "subprocess_s": [], "pool_s": []}
+    for _ in range(rounds):
+        dt, out["codes_subprocess"] = chain(call_subprocess)
+        out["subprocess_s"].append(round(dt, 3))
+        dt, out["codes_pool"] = chain(pool.call)
+        out["pool_s"].append(round(dt, 3))
+    pool.shutdown()
+    best_sub, best_pool = min(out["subprocess_s"]), min(out["pool_s"])
+    out["best_subprocess_s"], out["best_pool_s"] = best_sub, best_pool
+    out["speedup"] = round(best_sub / best_pool, 2) if best_pool else None
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description="In-process tool runner")
+    ap.add_argument("tool", nargs="?", choices=sorted(TOOLS))
+    ap.add_argument("args", nargs=argparse.REMAINDER)
+    ap.add_argument("--bench", type=int, metavar="N", help="N прогонов цепочки e2e: subprocess против пула")
+    ap.add_argument("--subprocess", action="store_true", help="вызвать инструмент через python3 (запасной путь)")
+    args = ap.parse_args()
+    if args.bench:
+        print(json.dumps(bench(args.bench), ensure_ascii=False, indent=2))
+        return 0
+    if not args.tool:
+        ap.error("tool or --bench is required")
+    res = (call_subprocess if args.subprocess else call)(args.tool, args.args)
+    print(json.dumps(res, ensure_ascii=False, indent=2))
+    return res["code"]
+
+if __name__ == "__main__":
+    raise SystemExit(main())
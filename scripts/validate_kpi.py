@@ -9,37 +9,46 @@ KPI validator:
 - additionally computes per-Контрагент stats across years and writes data/kpi_stats.csv:
   Mean (ц/га), SD (ц/га), CV% (%), WAASB_proxy (0..100, где 100 — стабильнее)
   rounding to 0.1 for Mean/SD/CV
+- --stream: читает построчно, пишет очищенный CSV по ходу и держит только
+  бегущие агрегаты по Контрагенту (n, Σx, Σx²), память ~ O(число ключей), а не строк
+- --workers N: файл режется на шарды по границам строк и разбирается в пуле
+  процессов; дубли между шардами снимаются при склейке (см. shards.py)
+- --incremental: разбираются только изменившиеся чанки файла, статистика
+  пересчитывается только для затронутых Контрагентов (см. incremental.py)
+- --engine numpy: Mean/SD/CV%/ранги через групповые редукции NumPy (см. stats_numpy.py),
+  результат побайтно совпадает с Python-путём
+- --columnar [--columnar-format auto|arrow|npy]: рядом с CSV пишутся колоночные копии (см. columnar.py)
+- батч читает файл колонками (fastcsv.py); очищенный CSV, статистика и ошибки — те же,
+  что у построчного пути
+- в батче Контрагент и Год интернируются в id словаря в памяти (keydict.py): дедуп идёт
+  по упакованному int-ключу, группировка статистики — по id Контрагента
+- "timings": время/CPU/пик RSS/rows/sec по стадиям режима (см. instrument.py)
 """
-import csv, json, math, sys
+import argparse, csv, json, math, operator
+from itertools import compress
 from pathlib import Path
+from fractions import Fraction
 from statistics import mean, pstdev
 
+import columnar, fastcsv, incremental, instrument, keydict, shards, stats_numpy
+from columns import ColumnResolver, KPI_FIELDS
+
 ROOT = Path(__file__).resolve().parents[1]
 OUT_CLEAN = ROOT / "data" / "cleaned_sample_kpi.csv"
 OUT_STATS = ROOT / "data" / "kpi_stats.csv"
+CLEAN_COLS = ["Контрагент","Год","Урожайность_ц_га"]
+STATS_COLS = ["Контрагент","Mean_ц_га","SD_ц_га","CV_%","WAASB_proxy"]
+FLIP = bytes([1, 0]) + bytes(254)   # маска отброшенных -> маска оставленных
 
 def to_float(val):
+    """Число или None (пусто, не число, nan/inf — как маска fastcsv в батче)."""
     if val is None or str(val).strip() == "":
         return None
     try:
-        return float(str(val).replace(",", "."))
+        x = float(str(val).replace(",", "."))
     except:
         return None
-
-def pick(row, names):
-    # case-insensitive pick
-    lower = {k.lower(): v for k, v in row.items()}
-    for n in names:
-        if n in row and row[n] != "":
-            return row[n]
-        if n.lower() in lower and lower[n.lower()] != "":
-            return lower[n.lower()]
-    return ""
-
-def load_rows(path):
-    with open(path, "r", encoding="utf-8") as f:
-        rdr = csv.DictReader(f)
-        return list(rdr)
+    return x if math.isfinite(x) else None
 
 def write_csv(path, rows, fieldnames):
     path.parent.mkdir(parents=True, exist_ok=True)
@@ -52,50 +61,317 @@ def write_csv(path, rows, fieldnames):
 def round01(x):
     return None if x is None or not math.isfinite(x) else round(x*10)/10.0
 
-def main():
-    if len(sys.argv) < 2:
-        print(json.dumps({"error": "usage: validate_kpi.py <csv>"}))
-        return 2
-    src = Path(sys.argv[1])
-    rows = load_rows(src)
-
-    key_dups = set()
-    seen = set()
-    cleaned = []
-    errors = []
+def dup_error(i, key):
+    return {"row": i, "msg": f"Дубликат ключа Контрагент+Год: { key }"}
+
+def zero_error(i):
+    return {"row": i, "msg": "Нулевая/пустая урожайность (скрыть/исключить)"}
 
+def parse_rows(rows, cols):
+    """(номер строки с 1, Контрагент, Год, урожайность 0.1 или None для нулевой/пустой)."""
+    get_contr = cols.getter("contragent")
+    get_year = cols.getter("year")
+    get_yield = cols.getter("yield")
     for i, r in enumerate(rows, start=1):
-        contr = pick(r, ["Контрагент", "contragent", "client", "Компания"]).strip()
-        year  = str(pick(r, ["Год", "year"])).strip()
-        yld   = to_float(pick(r, ["Урожайность_ц_га","Урожайность, ц/га","Yield_c_ha","Yield","yield","y"]))
+        contr = get_contr(r).strip()
+        year  = get_year(r).strip()
+        yld   = to_float(get_yield(r))
+        yield i, contr, year, (None if yld is None or yld == 0 else f"{round01(yld):.1f}")
 
+def check_rows(rows, cols, seen, errors):
+    """
+    Общая проверка для всех режимов: отдаёт (Контрагент, Год, урожайность 0.1)
+    для прошедших строк, ошибки дописывает в errors, ключи — в seen.
+    Колонки берутся по фиксированным индексам из cols (ColumnResolver).
+    """
+    for i, contr, year, yld in parse_rows(rows, cols):
         if (contr, year) in seen:
-            errors.append({"row": i, "msg": f"Дубликат ключа Контрагент+Год: { (contr, year) }"})
-            key_dups.add((contr, year))
+            errors.append(dup_error(i, (contr, year)))
             continue
         seen.add((contr, year))
 
-        if yld is None or yld == 0:
-            errors.append({"row": i, "msg": "Нулевая/пустая урожайность (скрыть/исключить)"})
+        if yld is None:
+            errors.append(zero_error(i))
             continue
 
-        cleaned.append({"Контрагент": contr, "Год": year, "Урожайность_ц_га": f"{round01(yld):.1f}"})
+        yield contr, year, yld
+
+def check_shard(job):
+    """Воркер --workers: разбор диапазона байт, дедуп только внутри шарда."""
+    src, start, end, cols = job
+    seen, first, dups = set(), [], []
+    n = 0
+    for n, contr, year, yld in parse_rows(shards.shard_rows(src, start, end), cols):
+        key = (contr, year)
+        if key in seen:
+            dups.append((n, key))
+        else:
+            seen.add(key)
+            first.append((n, key, yld))
+    return n, first, dups
+
+def _sqrt_of_frac(n, m):
+    """sqrt(n/m), корректно округлённый до float — как statistics.pstdev (3.11+)."""
+    q = (n.bit_length() - m.bit_length() - 109) // 2
+    if q >= 0:
+        a = math.isqrt(n // (m << 2 * q))
+        return (a | (a * a * (m << 2 * q) != n)) << q
+    a = math.isqrt((n << -2 * q) // m)
+    return (a | (a * a * m != (n << -2 * q))) / (1 << -q)
+
+class RunningMoments:
+    """
+    Бегущие n, Σx, Σx² по Контрагенту в точной арифметике (так же считают
+    statistics.mean/pstdev), поэтому --stream пишет тот же kpi_stats.csv, что и батч.
+    """
+    __slots__ = ("n", "sx", "sxx")
+
+    def __init__(self):
+        self.n = 0
+        self.sx = {}   # знаменатель (2**k) -> сумма числителей
+        self.sxx = {}
+
+    def add(self, x):
+        num, den = x.as_integer_ratio()
+        self.n += 1
+        self.sx[den] = self.sx.get(den, 0) + num
+        self.sxx[den] = self.sxx.get(den, 0) + num * num
+
+    def _sums(self):
+        sx = sum(Fraction(n, d) for d, n in self.sx.items())
+        sxx = sum(Fraction(n, d * d) for d, n in self.sxx.items())
+        return sx, sxx
+
+    def mean(self):
+        return float(self._sums()[0] / self.n)
+
+    def pstdev(self):
+        if self.n < 2:
+            return 0.0
+        sx, sxx = self._sums()
+        mss = (self.n * sxx - sx * sx) / (self.n * self.n)
+        return float(_sqrt_of_frac(mss.numerator, mss.denominator))
+
+def check_columns(t, keys=None):
+    """
+    check_rows для батча по колонкам fastcsv.Table: те же ошибки в том же порядке.
+    -> (Контрагенты, Годы, урожайности в десятых (int), ошибки, id Контрагентов) прошедших строк;
+    keys — keydict.KeyDict (по умолчанию — новый, в памяти).
+    """
+    keys = keys or keydict.KeyDict()
+    contr, year = t.text("contragent"), t.text("year")
+    y, mask = t.number("yield")
+    n = t.rows
+    cids = keys.ids("contragent", contr)
+    seen = {}
+    first = map(seen.setdefault, keys.pack(cids, keys.ids("year", year)), range(n))   # первая строка ключа
+    dup = bytes(map(operator.ne, first, range(n)))
+    iszero = map((0.0).__eq__, y)                               # пустые/нечисловые — NaN в y
+    bad = bytearray(map(operator.or_, mask, iszero)) if mask else bytearray(iszero)
+
+    errors = []
+    drop = bytearray(map(operator.or_, dup, bad))
+    for i in fastcsv.error_rows(drop):
+        errors.append(dup_error(i + 1, (contr[i], year[i])) if dup[i] else zero_error(i + 1))
+    if errors:
+        keep = drop.translate(FLIP)
+        contr, year, y = list(compress(contr, keep)), list(compress(year, keep)), list(compress(y, keep))
+        cids = list(compress(cids, keep))
+    tenths = {x: round(x * 10) for x in set(y)}                 # round01 в десятых
+    return contr, year, list(map(tenths.__getitem__, y)), errors, cids
+
+def format_tenths(tenths):
+    """Десятые -> "%.1f", как f"{round01(x):.1f}"; форматируется каждое различное значение один раз."""
+    text = {k: f"{k / 10.0:.1f}" for k in set(tenths)}
+    return map(text.__getitem__, tenths)
+
+def run_batch(src, tr, engine="python"):
+    with fastcsv.no_gc():   # миллион мелких объектов без циклов — сборщику тут делать нечего
+        return _run_batch(src, tr, engine)
+
+def _run_batch(src, tr, engine):
+    with tr.stage("read") as st:
+        t = fastcsv.read(src, "kpi")
+        st.rows = t.rows
+    keys = keydict.KeyDict()
+    with tr.stage("validate", rows=t.rows):
+        contr, year, tenths, errors, cids = check_columns(t, keys)
+    rows_out = len(contr)
+
+    with tr.stage("write_clean", rows=rows_out):
+        OUT_CLEAN.parent.mkdir(parents=True, exist_ok=True)
+        fastcsv.write(OUT_CLEAN, CLEAN_COLS, [contr, year, format_tenths(tenths)])
 
-    write_csv(OUT_CLEAN, cleaned, ["Контрагент","Год","Урожайность_ц_га"])
+    with tr.stage("stats", rows=rows_out):
+        table = batch_stats(contr, tenths, engine, cids, keys)
+    with tr.stage("write_stats", rows=len(table)):
+        write_stats_table(OUT_STATS, table)
+    return t.cols, errors, t.rows, rows_out
 
-    # === Перегруппируем по Контрагенту, считаем Mean/SD/CV% и WAASB proxy ===
+def batch_stats(contr, tenths, engine="python", cids=None, keys=None):
+    """
+    Перегруппировка по Контрагенту -> строки kpi_stats.csv (Mean/SD/CV% и WAASB proxy).
+    cids/keys (из check_columns) — группы по int id, а не по строкам.
+    """
+    if cids is not None:
+        names, codes = keys.groups(cids)
+    else:
+        index = {c: i for i, c in enumerate(dict.fromkeys(contr))}
+        names, codes = list(index), list(map(index.__getitem__, contr))
+    table = None
+    if engine == "numpy":
+        table = stats_numpy.stats_rows(names, codes, tenths)
+    if table is None:
+        group = {c: [] for c in names}
+        for i, k in zip(codes, tenths):
+            group[names[i]].append(k / 10)
+        table = stats_rows(python_moments(group))
+    return table
+
+def stats_columns(table):
+    """Строки kpi_stats.csv -> колонки строк в порядке STATS_COLS (как их пишет csv.writer)."""
+    return [[str(r[k]) for r in table] for k in STATS_COLS]
+
+def write_stats_table(path, table):
+    fastcsv.write(path, STATS_COLS, stats_columns(table))
+
+def python_moments(group):
+    # SD по генеральной совокупности (pstdev)
+    return [(c, mean(ys), pstdev(ys) if len(ys) > 1 else 0.0) for c, ys in group.items()]
+
+def run_stream(src, tr):
+    OUT_CLEAN.parent.mkdir(parents=True, exist_ok=True)
+    seen, errors = set(), []
     group = {}
-    for r in cleaned:
-        group.setdefault(r["Контрагент"], []).append(to_float(r["Урожайность_ц_га"]))
+    counter = {"rows_in": 0}
+
+    def counted(rows):
+        for r in rows:
+            if r:
+                counter["rows_in"] += 1
+                yield r
+
+    rows_out = 0
+    with tr.stage("stream") as st, \
+         open(src, "r", encoding="utf-8-sig", newline="") as fin, \
+         open(OUT_CLEAN, "w", encoding="utf-8", newline="") as f:
+        rdr = csv.reader(fin)
+        cols = ColumnResolver(next(rdr, []), KPI_FIELDS)
+        w = csv.writer(f)
+        w.writerow(CLEAN_COLS)
+        for contr, year, yld in check_rows(counted(rdr), cols, seen, errors):
+            w.writerow([contr, year, yld])
+            agg = group.get(contr)
+            if agg is None:
+                agg = group[contr] = RunningMoments()
+            agg.add(float(yld))
+            rows_out += 1
+        st.rows = counter["rows_in"]
+
+    with tr.stage("stats", rows=rows_out):
+        write_stats([(c, a.mean(), a.pstdev()) for c, a in group.items()])
+    return cols, errors, counter["rows_in"], rows_out
+
+def run_sharded(src, workers, tr):
+    with tr.stage("split"):
+        header, ranges = shards.split(src, workers)
+    cols = ColumnResolver(header, KPI_FIELDS)
+    with tr.stage("parse") as st:
+        results = shards.run(check_shard, src, ranges, (cols,), workers)
+        st.rows = sum(r[0] for r in results)
+    with tr.stage("merge") as st:
+        errors, rows_out, group = write_merged(results)
+        st.rows = rows_out
+    with tr.stage("stats", rows=rows_out):
+        write_stats([(c, a.mean(), a.pstdev()) for c, a in group.items()])
+    return cols, errors, sum(r[0] for r in results), rows_out
+
+def run_incremental(src, workers, tr):
+    """
+    Разбираются только чанки, которых нет в манифесте; статистика пересчитывается
+    лишь для Контрагентов, чьи ключи встречаются в новых или исчезнувших чанках.
+    """
+    with tr.stage("plan"):
+        header = shards.read_header(src)
+        cols = ColumnResolver(header, KPI_FIELDS)
+        ranges = incremental.chunk_ranges(src)
+        man = incremental.Manifest("kpi", src, header)
+        cached, fresh, removed, reordered = man.plan(ranges)
+    with tr.stage("parse") as st:
+        parsed = dict(zip(
+            [h for _, _, h in fresh],
+            shards.run(check_shard, src, [(a, b) for a, b, _ in fresh], (cols,), workers),
+        ))
+        st.rows = sum(r[0] for r in parsed.values())
+    results = [cached[h] if h in cached else parsed[h] for _, _, h in ranges]
 
-    # SD по генеральной совокупности (pstdev), CV% = SD/Mean*100
-    stats_rows = []
+    prev = man.extra.get("stats")
+    if prev is None or reordered:
+        prev, affected = {}, None
+    else:
+        touched = list(parsed.values()) + [man.chunks[h] for h in removed]
+        affected = {k[0] for k in incremental.keys_of(touched)}
+
+    with tr.stage("merge") as st:
+        errors, rows_out, group = write_merged(
+            results, lambda c: affected is None or c in affected or c not in prev)
+        st.rows = rows_out
+    with tr.stage("stats", rows=rows_out):
+        moments = [(c, a.mean(), a.pstdev()) if a is not None else (c, *prev[c])
+                   for c, a in group.items()]
+        write_stats(moments)
+    with tr.stage("manifest"):
+        man.save(ranges, results, {"stats": {c: [m, sd] for c, m, sd in moments}})
+
+    info = {
+        "manifest": str(man.path),
+        "chunks": len(ranges),
+        "reused": len(ranges) - len(fresh),
+        "parsed": len(fresh),
+        "stats_recomputed": sum(1 for a in group.values() if a is not None),
+        "stats_reused": sum(1 for a in group.values() if a is None),
+    }
+    return cols, errors, sum(r[0] for r in results), rows_out, info
+
+def write_merged(results, accumulate=None):
+    """
+    Склейка результатов шардов/чанков: пишет очищенный CSV, копит агрегаты.
+    accumulate(Контрагент) -> False — агрегат не нужен (в group будет None).
+    """
+    OUT_CLEAN.parent.mkdir(parents=True, exist_ok=True)
+    errors, group = [], {}
+    rows_out = 0
+    with open(OUT_CLEAN, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(CLEAN_COLS)
+        for i, key, yld in shards.merge_first_seen(results):
+            if yld is shards.DUPLICATE:
+                errors.append(dup_error(i, key))
+                continue
+            if yld is None:
+                errors.append(zero_error(i))
+                continue
+            w.writerow([key[0], key[1], yld])
+            rows_out += 1
+            contr = key[0]
+            if contr not in group:
+                group[contr] = RunningMoments() if accumulate is None or accumulate(contr) else None
+            agg = group[contr]
+            if agg is not None:
+                agg.add(float(yld))
+    return errors, rows_out, group
+
+def write_stats(moments):
+    write_csv(OUT_STATS, stats_rows(moments), STATS_COLS)
+
+def stats_rows(moments):
+    """moments: [(Контрагент, mean, sd)] в порядке первого появления."""
+    # CV% = SD/Mean*100
+    rows = []
     sds = []
-    for c, ys in group.items():
-        m = mean(ys) if ys else None
-        sd = pstdev(ys) if ys and len(ys) > 1 else 0.0
+    for c, m, sd in moments:
         cv = (sd / m * 100.0) if (m and m != 0) else 0.0
-        stats_rows.append({
+        rows.append({
             "Контрагент": c,
             "Mean_ц_га": round01(m) if m is not None else "",
             "SD_ц_га": round01(sd),
@@ -111,24 +387,79 @@ def main():
         pairs = sorted([(sd, i) for i, sd in enumerate(sds)])
         ranks = {i: rank for rank, (_, i) in enumerate(pairs, start=1)}
         N = len(sds)
-        for idx, row in enumerate(stats_rows):
+        for idx, row in enumerate(rows):
             r = ranks[idx]
             stability = 100.0 * (1.0 - (r - 1) / max(1, N - 1))  # от 100 до ~0
             row["WAASB_proxy"] = round01(stability)
 
-    write_csv(OUT_STATS, stats_rows, ["Контрагент","Mean_ц_га","SD_ц_га","CV_%","WAASB_proxy"])
+    return rows
 
-    out = {
+def report(src, mode, engine, cols, errors, rows_in, rows_out, clean_path=OUT_CLEAN, stats_path=OUT_STATS):
+    return {
         "source": str(src),
+        "mode": mode,
+        "engine": engine,
+        "columns": cols.report(),
         "errors": errors,
-        "warnings": [],
-        "clean_path": str(OUT_CLEAN),
-        "stats_path": str(OUT_STATS),
-        "rows_in": len(rows),
-        "rows_out": len(cleaned)
+        "warnings": cols.warnings(),
+        "clean_path": str(clean_path),
+        "stats_path": str(stats_path),
+        "rows_in": rows_in,
+        "rows_out": rows_out
     }
+
+def run(argv=None):
+    """-> (код выхода, отчёт) — то же, что печатает CLI; для вызова без подпроцесса (tools.py)."""
+    ap = argparse.ArgumentParser(description="KPI validator")
+    ap.add_argument("csv", nargs="?")
+    ap.add_argument("--stream", action="store_true",
+                    help="построчный режим: память ~ число ключей, а не строк")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="разбор шардов файла в N процессах (результат как у N=1)")
+    ap.add_argument("--incremental", action="store_true",
+                    help="разбирать только изменившиеся чанки (манифест в data/.cache/)")
+    ap.add_argument("--engine", choices=["python", "numpy", "auto"], default="python",
+                    help="движок kpi_stats.csv в батч-режиме (numpy — побайтно тот же результат)")
+    ap.add_argument("--columnar", action="store_true",
+                    help="также писать типизированную колоночную копию (Arrow IPC или .npy)")
+    ap.add_argument("--columnar-format", choices=columnar.FORMATS, default="auto")
+    args = ap.parse_args(argv)
+    if not args.csv:
+        return 2, {"error": "usage: validate_kpi.py [--stream] [--workers N] [--incremental] <csv>"}
+    src = Path(args.csv)
+    engine = args.engine
+    if engine == "auto" or (engine == "numpy" and not stats_numpy.available()):
+        engine = "numpy" if stats_numpy.available() else "python"
+    info = None
+    tr = instrument.Tracer("validate_kpi")
+    if args.incremental:
+        mode = "incremental"
+        cols, errors, rows_in, rows_out, info = run_incremental(src, args.workers, tr)
+    elif args.workers > 1:
+        mode = "sharded"
+        cols, errors, rows_in, rows_out = run_sharded(src, args.workers, tr)
+    else:
+        mode = "stream" if args.stream else "batch"
+        if args.stream:
+            cols, errors, rows_in, rows_out = run_stream(src, tr)
+        else:
+            cols, errors, rows_in, rows_out = run_batch(src, tr, engine)
+
+    out = report(src, mode, engine if mode == "batch" else "python", cols, errors, rows_in, rows_out)
+    if info:
+        out["incremental"] = info
+    if args.columnar:
+        with tr.stage("columnar", rows=rows_out):
+            out["columnar"] = {
+                "clean": columnar.export(OUT_CLEAN, "kpi", args.columnar_format),
+                "stats": columnar.export(OUT_STATS, "stats", args.columnar_format),
+            }
+    return (0 if not errors else 1), tr.attach(out)
+
+def main():
+    code, out = instrument.profiled("validate_kpi", run)
     print(json.dumps(out, ensure_ascii=False, indent=2))
-    return 0 if not errors else 1
+    return code
 
 if __name__ == "__main__":
     raise SystemExit(main())
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Версионированная публикация public/data/ (publish_data.py, pipeline.py):
+- файл кладётся под именем с хешем содержимого: kpi.csv -> kpi.<sha256[:12]>.csv; такой
+  файл больше не меняется — фронт и CDN кэшируют его навсегда (Cache-Control: immutable)
+- manifest.json — {имя: {path, sha256, bytes}} + номер версии; подменяется одним
+  os.replace, когда все файлы версии уже на месте: читатель видит либо старый набор
+  целиком, либо новый, без рваных чтений посреди публикации
+- тот же хеш, что в манифесте, — файл не пишется заново (unchanged), версия не растёт
+- прежние имена (kpi.csv, ...) остаются копиями текущей версии для скриптов, smoke и
+  фронта без манифеста; копии, а не жёсткие ссылки — инструменты пишут их через
+  open("w"), и ссылка испортила бы «неизменяемый» файл
+- сборка мусора: файлы с хешем, на которые не ссылаются KEEP_VERSIONS последних версий
+  (RAYAGRO_PUBLISH_KEEP, 3), удаляются — клиент с прошлым манифестом ещё догрузит свои
+- предсжатые копии (compress, см. precompress.py): <файл с хешем>.gz/.br, в манифесте —
+  "encodings": {кодировка: байт}; сжимается только новое содержимое, копии собираются
+  вместе со своим файлом
+- дельты (deltas, см. delta.py): для изменившихся kpi/geo/joined.csv — построчная разница с
+  прошлой версией по (Контрагент, Год); в манифесте "deltas" — цепочка шагов {from, to,
+  files: {имя: {path, from, to, key, ...}}} (from/to — sha256 версий файла, key — имена
+  ключевых колонок в заголовке файла, по ним клиент сопоставляет строки), последние DELTA_CHAIN
+  (RAYAGRO_DELTA_CHAIN, 10; 0 — дельты не считаются) шагов: клиент с версией файла N
+  догоняет текущую патчами
+- каталоги с хешем (HASHED_DIRS): тайлы map_tiles.py лежат в tiles/<хеш набора>/, индекс
+  (tiles.json в манифесте) называет свой каталог полем "hash"; каталог не переписывается,
+  собирается вместе с последней версией индекса, которая на него ссылается
+- stage() вместо commit(): версии с хешем и прежние имена пишутся, манифест — нет; цепочка
+  шагов (e2e: pipeline --no-commit -> kpi_stability/grid/tiles -> publish_data --in-place)
+  выходит одной версией, без промежуточного набора «новый kpi.csv + старые grid/tiles»
+Файлы, не переданные в этот запуск, переходят в новую версию из прошлой.
+"""
+import hashlib, json, os, re, shutil, time
+from pathlib import Path
+
+import delta, precompress
+
+MANIFEST = "manifest.json"
+SCHEMA = 1
+HASH_LEN = 12
+KEEP_VERSIONS = max(1, int(os.getenv("RAYAGRO_PUBLISH_KEEP", "3")))
+DELTA_CHAIN = max(0, int(os.getenv("RAYAGRO_DELTA_CHAIN", "10")))
+HASHED_DIRS = {"tiles.json": "tiles"}   # индекс -> каталог, подкаталоги которого — <hash> набора
+HASHED = re.compile(r"^(?P<base>(?P<stem>.+)\.[0-9a-f]{%d}(?P<ext>\.[^.]+))(?:\.gz|\.br)?$" % HASH_LEN)
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def hashed_name(name, digest):
+    """kpi.csv + sha256 -> kpi.<sha256[:HASH_LEN]>.csv"""
+    p = Path(name)
+    return f"{p.stem}.{digest[:HASH_LEN]}{p.suffix}"
+
+def tmp_path(path):
+    """Временный файл рядом с path (тот же каталог — rename атомарен)."""
+    path = Path(path)
+    return path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+def copy_atomic(src, dst):
+    tmp = tmp_path(dst)
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+def write_json_atomic(path, obj):
+    tmp = tmp_path(path)
+    tmp.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+def load_manifest(pub):
+    try:
+        m = json.loads((Path(pub) / MANIFEST).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        m = None
+    if not isinstance(m, dict) or m.get("schema") != SCHEMA:
+        return {"schema": SCHEMA, "version": 0, "files": {}, "history": [], "deltas": []}
+    m.setdefault("deltas", [])
+    return m
+
+class Publisher:
+    """
+    p = Publisher(PUB); p.add("kpi.csv", src); ...; p.deltas(); p.compress(); p.commit() -> отчёт.
+    add(..., move=True) — src (временный файл в каталоге публикации) переносится, а не копируется.
+    """
+    def __init__(self, pub):
+        self.pub = Path(pub)
+        self.pub.mkdir(parents=True, exist_ok=True)
+        self.prev = load_manifest(self.pub)
+        self.files = dict(self.prev["files"])
+        self.written, self.unchanged = [], []
+        self.sources = {}             # имя -> исходный файл (None — перенесён) в этом запуске
+        self.step = {}                # имя -> дельта от прошлой версии (шаг цепочки "deltas")
+
+    def store(self, name, src, move=False):
+        """Файл src под именем с хешем (уже есть — не пишется); -> {path, sha256, bytes}."""
+        src = Path(src)
+        digest = file_sha256(src)
+        entry = {"path": hashed_name(name, digest), "sha256": digest, "bytes": src.stat().st_size}
+        dst = self.pub / entry["path"]
+        if dst.exists():
+            if move:
+                src.unlink()
+        elif move:
+            os.replace(src, dst)
+        else:
+            copy_atomic(src, dst)
+        return entry
+
+    def add(self, name, src, move=False):
+        """Файл src как новая версия name; -> запись манифеста {path, sha256, bytes}."""
+        entry = self.store(name, src, move)
+        digest = entry["sha256"]
+        old = self.prev["files"].get(name)
+        (self.unchanged if old and old["sha256"] == digest else self.written).append(name)
+        self.files[name] = entry
+        self.sources[name] = None if move else Path(src)
+        return entry
+
+    def path(self, name):
+        """Текущая версия name (файл с хешем) или None."""
+        entry = self.files.get(name)
+        return self.pub / entry["path"] if entry else None
+
+    def deltas(self):
+        """Дельты изменившихся таблиц с ключом (delta.py) -> {имя: шаг или {"full": причина}}; до compress()."""
+        report = {}
+        for name in self.written if DELTA_CHAIN else ():
+            old = self.prev["files"].get(name)
+            if name not in delta.KEYED or not old or not (self.pub / old["path"]).is_file():
+                continue
+            new = self.files[name]
+            d, why = delta.diff(self.pub / old["path"], self.path(name), delta.KEYED[name])
+            if d is not None:
+                tmp = tmp_path(self.pub / delta.delta_name(name))
+                delta.write(tmp, d)
+                size = tmp.stat().st_size
+                if size > delta.MAX_RATIO * new["bytes"]:
+                    tmp.unlink()
+                    d, why = None, f"delta {size} B > {delta.MAX_RATIO} of file"
+            if d is None:
+                report[name] = {"full": why}
+                continue
+            entry = self.store(delta.delta_name(name), tmp, move=True)
+            self.step[name] = {"path": entry["path"], "bytes": entry["bytes"],
+                               "from": old["sha256"], "to": new["sha256"],
+                               "key": [d["header"][i] for i in d["key_idx"]],
+                               "delete": len(d["deleted"]),
+                               "replace": sum(op == "=" for (op, _), _ in d["changed"]),
+                               "insert": sum(op == "+" for (op, _), _ in d["changed"])}
+            report[name] = self.step[name]
+        return report
+
+    def compress(self):
+        """Предсжатые копии файлов и дельт этого запуска (precompress.py) -> отчёт; до commit()."""
+        names = [n for n in self.sources if n in self.files]
+        report = precompress.compress([self.path(n) for n in names] +
+                                      [self.pub / s["path"] for s in self.step.values()])
+        for name in names:
+            entry = {k: v for k, v in self.files[name].items() if k != "encodings"}
+            encs = self._encodings(self.path(name))
+            self.files[name] = {**entry, "encodings": encs} if encs else entry
+        for s in self.step.values():
+            encs = self._encodings(self.pub / s["path"])
+            if encs:
+                s["encodings"] = encs
+        return report
+
+    @staticmethod
+    def _encodings(path):
+        return {e: precompress.sibling(path, e).stat().st_size
+                for e in precompress.SUFFIX if precompress.sibling(path, e).exists()}
+
+    def commit(self):
+        """Манифест (если что-то изменилось), прежние имена, сборка мусора; -> отчёт."""
+        prev = self.prev
+        changed = bool(self.written) or self.files != prev["files"]
+        manifest = prev
+        if changed:
+            history = ([{"version": prev["version"], "files": {n: e["path"] for n, e in prev["files"].items()}}]
+                       if prev["files"] else []) + prev["history"]
+            manifest = {
+                "schema": SCHEMA,
+                "version": prev["version"] + 1,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "files": self.files,
+                "history": history[:KEEP_VERSIONS - 1],
+                "deltas": (([{"from": prev["version"], "to": prev["version"] + 1, "files": self.step}]
+                            if self.step else []) + prev["deltas"])[:DELTA_CHAIN],
+            }
+            write_json_atomic(self.pub / MANIFEST, manifest)
+
+        self._plain_copies()
+        removed = self.collect(manifest, prev)
+        return {"manifest": str(self.pub / MANIFEST), "version": manifest["version"],
+                "written": self.written, "unchanged": self.unchanged, "removed": removed}
+
+    def stage(self):
+        """
+        Версии уже лежат под именами с хешем — обновить только прежние имена; манифест,
+        дельты и сборку мусора делает следующий commit() (publish_data.py --in-place).
+        """
+        self._plain_copies()
+        return {"manifest": None, "version": self.prev["version"], "staged": True,
+                "written": self.written, "unchanged": self.unchanged, "removed": []}
+
+    def _plain_copies(self):
+        for name in self.sources:
+            plain, src = self.pub / name, self.sources[name]
+            if src is not None and src.resolve() == plain.resolve():
+                continue                         # версионировали файл на месте — он и есть копия
+            if name in self.written or not plain.exists():
+                copy_atomic(self.path(name), plain)
+
+    def collect(self, manifest, prev):
+        """
+        Удаляет файлы с хешем (и их .gz/.br), не упомянутые в текущей и KEEP_VERSIONS-1 прошлых
+        версиях, и дельты, выпавшие из цепочки.
+        """
+        keep = {e["path"] for e in manifest["files"].values()}
+        names = set(manifest["files"]) | set(prev["files"])
+        for h in prev["history"]:
+            names.update(h["files"])
+        for h in manifest["history"]:
+            keep.update(h["files"].values())
+        names.update(map(delta.delta_name, delta.KEYED))
+        for step in manifest["deltas"]:
+            keep.update(s["path"] for s in step["files"].values())
+        removed = []
+        for p in sorted(self.pub.iterdir()):
+            m = HASHED.match(p.name)
+            if m and m["base"] not in keep and m["stem"] + m["ext"] in names and p.is_file():
+                p.unlink()
+                removed.append(p.name)
+        for index, dirname in HASHED_DIRS.items():
+            removed += self._collect_dir(index, self.pub / dirname, keep)
+        return removed
+
+    def _collect_dir(self, index, base, keep):
+        """Подкаталоги <hash> в base, на которые не ссылается ни одна оставленная версия index."""
+        if not base.is_dir():
+            return []
+        stem, ext = os.path.splitext(index)
+        indexes = [self.pub / p for p in keep if re.fullmatch(r"%s\.[0-9a-f]{%d}%s" % (re.escape(stem), HASH_LEN, re.escape(ext)), p)]
+        indexes.append(base / "index.json")          # только что собранный, ещё не опубликованный
+        live = set()
+        for path in indexes:
+            try:
+                live.add(json.loads(path.read_text(encoding="utf-8")).get("hash"))
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, AttributeError):
+                return []                            # индекс не прочитать — ничего не трогаем
+        removed = []
+        for d in sorted(base.iterdir()):
+            if d.is_dir() and re.fullmatch(r"[0-9a-f]{%d}" % HASH_LEN, d.name) and d.name not in live:
+                shutil.rmtree(d, ignore_errors=True)
+                removed.append(f"{base.name}/{d.name}/")
+        return removed
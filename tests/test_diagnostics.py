@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+diagnostics.run_checks() в песочнице: копии data/sample_*.csv во временном корне, логи,
+профили и выходы валидаторов — туда же; data/ и logs/ репозитория не меняются.
+Запуск: python -m pytest -q tests
+"""
+import os, shutil, sys, tempfile, threading, unittest
+from pathlib import Path
+from unittest import mock
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO / "scripts"))
+sys.path.insert(0, str(REPO))
+
+import diagnostics, instrument, validate_kpi
+
+class DiagnosticsCase(unittest.TestCase):
+    def setUp(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        (root / "data").mkdir()
+        (root / "logs").mkdir()
+        (root / "scripts").symlink_to(REPO / "scripts")
+        for name in ("sample_kpi.csv", "sample_geo.csv"):
+            shutil.copy(REPO / "data" / name, root / "data" / name)
+        for target, attr, value in [
+            (diagnostics, "ROOT", root), (diagnostics, "LOGS", root / "logs"),
+            (diagnostics, "DIST", root / "dist"), (diagnostics, "PUBD", root / "public" / "data"),
+            (instrument, "LOGS", root / "logs"),
+            (validate_kpi, "OUT_CLEAN", root / "data" / "cleaned_sample_kpi.csv"),
+            (validate_kpi, "OUT_STATS", root / "data" / "kpi_stats.csv"),
+        ]:
+            patcher = mock.patch.object(target, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        env = mock.patch.dict(os.environ, {"RAYAGRO_INPROC": "1"})    # валидаторы функциями
+        env.start()
+        self.addCleanup(env.stop)
+        (root / "dist" / "assets").mkdir(parents=True)     # проверка сборки — зелёная
+        (root / "dist" / "index.html").write_text("<html></html>", encoding="utf-8")
+        self.root = root
+
+    def checks(self, report):
+        return {c["name"]: c["status"] for c in report["checks"]}
+
+    def issue(self, report, kind):
+        return next(i for i in report["issues"] if i["kind"] == kind)
+
+class ValidatorFailureTest(DiagnosticsCase):
+    def test_clean_run(self):
+        for name in ("sample_kpi.csv", "sample_geo.csv"):     # без ошибок данных
+            lines = (self.root / "data" / name).read_text(encoding="utf-8").splitlines()
+            (self.root / "data" / name).write_text("\n".join(lines[:2]) + "\n", encoding="utf-8")
+        code, report = diagnostics.run_checks(parallel=False)
+        self.assertEqual(code, 0, report["issues"])
+        self.assertEqual(self.issue(report, "kpi")["level"], "info")
+        self.assertIn("1→1", self.issue(report, "kpi")["msg"])
+
+    def test_crashed_validator_is_an_error(self):
+        def boom(argv=None):
+            raise RuntimeError("validator exploded")
+
+        with mock.patch.object(validate_kpi, "run", boom):
+            code, report = diagnostics.run_checks()
+        self.assertEqual(code, 1)
+        kpi = self.issue(report, "kpi")
+        self.assertEqual(kpi["level"], "error")
+        self.assertIn("validator exploded", kpi["msg"])
+        self.assertNotIn("None→None", kpi["msg"])
+
+    def test_pool_timeout_is_an_error(self):
+        class StuckPool:
+            def call(self, tool, argv, timeout=600, profile=None):
+                return diagnostics.tools.envelope(tool, argv, 124, {"error": "timeout"}, timeout, "pool")
+
+            def shutdown(self):
+                pass
+
+        with mock.patch.object(diagnostics, "PROC_MIN_BYTES", 0), \
+             mock.patch.object(diagnostics, "_pool", StuckPool):
+            code, report = diagnostics.run_checks()
+        self.assertEqual(code, 1)
+        for kind in ("kpi", "geo"):
+            self.assertEqual(self.issue(report, kind)["level"], "error")
+            self.assertIn("timeout", self.issue(report, kind)["msg"])
+
+    def test_subprocess_timeout_is_an_error(self):
+        with mock.patch.dict("os.environ", {"RAYAGRO_INPROC": "0"}), \
+             mock.patch.object(diagnostics, "run_cmd", lambda cmd, timeout=300: (124, "", "")):
+            code, report = diagnostics.run_checks()
+        self.assertEqual(code, 1)
+        self.assertIn("timeout", self.issue(report, "kpi")["msg"])
+
+class ProfiledDiagnosticsTest(DiagnosticsCase):
+    def test_checks_pass_under_profiler(self):
+        # diagnostics под cProfile, проверки в потоках идут через tools.call -> profiled
+        code, report = instrument.profiled("diagnostics", lambda argv: diagnostics.run_checks(), [], "cprofile")
+        statuses = self.checks(report)
+        self.assertEqual(statuses["kpi"], "ok")
+        self.assertEqual(statuses["geo"], "ok")
+        self.assertNotIn("Another profiling tool", str(report["issues"]))
+        self.assertIn("pstats", report["profile"])
+
+    def test_second_profile_in_other_thread_is_skipped(self):
+        inner = {}
+
+        def outer(argv):
+            t = threading.Thread(target=lambda: inner.update(
+                res=instrument.profiled("inner", lambda a: (0, {}), [], "cprofile")))
+            t.start()
+            t.join()
+            return 0, {}
+
+        instrument.profiled("outer", outer, [], "cprofile")
+        self.assertEqual(inner["res"], (0, {}))     # без "profile": второй профиль не ставился
+
+if __name__ == "__main__":
+    unittest.main()
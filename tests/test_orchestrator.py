@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Очередь и кэш результатов micro_orchestrator.py без HTTP-сервера: своя JobQueue,
+ResultCache и CACHEABLE во временном каталоге (тёплый пул выключен — RAYAGRO_INPROC=0);
+отмена шага в тёплом пуле — на своём Pool с инструментом-«соней» из временного каталога.
+Запуск: python -m pytest -q tests
+"""
+import os, shutil, sys, tempfile, threading, time, unittest
+from pathlib import Path
+from unittest import mock
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO / "scripts"))
+with mock.patch.dict(os.environ, {"RAYAGRO_INPROC": "0"}):    # без тёплого пула при импорте
+    import micro_orchestrator as mo
+import tools
+
+WAIT_S = 10
+
+class OrchestratorCase(unittest.TestCase):
+    def setUp(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.root = root
+        self.queue = mo.JobQueue()
+        for attr, value in [("REPO_DIR", str(root)), ("QUEUE", self.queue),
+                            ("CACHE", mo.ResultCache(root / "cache")), ("TOOL_SOURCES", []),
+                            ("CACHEABLE", {"upper": (["in.txt"], ["out.txt"])})]:
+            patcher = mock.patch.object(mo, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.write("in.txt", "a")
+        self.runs = 0
+
+    def write(self, name, text):
+        (self.root / name).write_text(text, encoding="utf-8")
+
+    def upper(self, job):
+        """Кэшируемая задача: out.txt = in.txt в верхнем регистре."""
+        self.runs += 1
+        text = (self.root / "in.txt").read_text(encoding="utf-8").upper()
+        self.write("out.txt", text)
+        return {"ok": True, "code": 0, "text": text}
+
+    def run_cached(self, nocache=False):
+        job, hit = mo.submit_cached("upper", self.upper, nocache)
+        self.assertTrue(job.done.wait(WAIT_S))
+        return job.result, hit
+
+class SubmitCachedTest(OrchestratorCase):
+    def test_miss_then_hit(self):
+        first, hit = self.run_cached()
+        self.assertFalse(hit)
+        self.assertFalse(first["cache"]["hit"])
+        second, hit = self.run_cached()
+        self.assertTrue(hit)
+        self.assertEqual(second["text"], "A")
+        self.assertEqual(self.runs, 1)
+
+    def test_changed_input_misses(self):
+        self.run_cached()
+        self.write("in.txt", "b")
+        res, hit = self.run_cached()
+        self.assertFalse(hit)
+        self.assertEqual(res["text"], "B")
+        self.assertEqual(self.runs, 2)
+
+    def test_nocache_reruns(self):
+        self.run_cached()
+        res, hit = self.run_cached(nocache=True)
+        self.assertFalse(hit)
+        self.assertEqual(self.runs, 2)
+
+    def test_key_taken_after_queued_writer(self):
+        # задача встала в очередь за писателем, который поменял её вход
+        release = threading.Event()
+
+        def writer(job):
+            release.wait(WAIT_S)
+            self.write("in.txt", "b")
+            return {"ok": True}
+
+        w = self.queue.submit("publish", writer)
+        job, hit = mo.submit_cached("upper", self.upper)
+        self.assertFalse(hit)
+        release.set()
+        self.assertTrue(w.done.wait(WAIT_S) and job.done.wait(WAIT_S))
+        self.assertEqual(job.result["text"], "B")
+
+        # результат для "b" не должен попасть под ключ входа "a"
+        self.write("in.txt", "a")
+        res, hit = self.run_cached()
+        self.assertFalse(hit)
+        self.assertEqual(res["text"], "A")
+
+SLEEPER = """
+import time
+def run(argv):
+    time.sleep(float(argv[0]))
+    return 0, {"slept": float(argv[0])}
+"""
+
+class PoolCancelTest(unittest.TestCase):
+    def setUp(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        (root / "sleeper.py").write_text(SLEEPER, encoding="utf-8")
+        patcher = mock.patch.dict(tools.TOOLS, {"sleeper": root / "sleeper.py"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = tools.Pool(workers=1)
+        self.addCleanup(self.pool.shutdown)
+
+    def test_cancel_kills_running_step(self):
+        flag = threading.Event()
+        threading.Timer(0.5, flag.set).start()
+        t0 = time.monotonic()
+        res = self.pool.call("sleeper", ["30"], timeout=60, cancelled=flag.is_set)
+        self.assertEqual(res["code"], 130)
+        self.assertLess(time.monotonic() - t0, WAIT_S)
+        self.assertEqual(self.pool.call("sleeper", ["0"], timeout=60)["code"], 0)   # пул пересоздан
+
+    def test_cancelled_job_stops_pool_steps(self):
+        job = mo.Job("e2e", None)
+        threading.Timer(0.5, job.cancel, args=("superseded by test",)).start()
+        t0 = time.monotonic()
+        with mock.patch.object(mo, "POOL", self.pool), mock.patch.object(job, "log", lambda *a: None):
+            _, _, _, steps, _ = mo.run_steps([("sleeper", ["30"]), ("sleeper", ["0"])], job, 60)
+        self.assertLess(time.monotonic() - t0, WAIT_S)
+        self.assertEqual([s["code"] for s in steps], [130])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+versioned.Publisher во временном каталоге публикации: версия с дельтой, которую клиент
+(components/delta.js, applyDelta) накатывает на прошлую версию, сборка мусора, stage()
+без манифеста и каталоги тайлов с хешем.
+Запуск: python -m pytest -q tests
+"""
+import json, shutil, subprocess, sys, tempfile, unittest
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO / "scripts"))
+
+import versioned
+
+HEADER = "Контрагент,Год,Урожайность_ц_га"
+NODE = shutil.which("node")
+
+# накатывает шаг дельты на прошлую версию так же, как loadTable во фронте
+APPLY_JS = """
+import { readFileSync } from "node:fs";
+import { parseCSV } from "%(repo)s/components/csv.js";
+import { applyDelta } from "%(repo)s/components/delta.js";
+const [oldPath, deltaPath, key] = process.argv.slice(2);
+const rows = applyDelta(parseCSV(readFileSync(oldPath, "utf8")).rows,
+                        parseCSV(readFileSync(deltaPath, "utf8")).rows, JSON.parse(key));
+process.stdout.write(JSON.stringify(rows));
+"""
+
+def kpi_rows(n, year=2023):
+    return [f"Хозяйство {i},{year},{40 + i}.5" for i in range(n)]
+
+class PublisherCase(unittest.TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.pub = self.root / "pub"
+
+    def publish(self, name, text, commit=True):
+        src = self.root / name
+        src.write_text(text, encoding="utf-8")
+        p = versioned.Publisher(self.pub)
+        p.add(name, src)
+        if not commit:
+            return p.stage()
+        p.deltas()
+        p.compress()
+        return p.commit()
+
+    def publish_rows(self, rows, **kw):
+        return self.publish("kpi.csv", "\n".join([HEADER, *rows]) + "\n", **kw)
+
+    def manifest(self):
+        return json.loads((self.pub / versioned.MANIFEST).read_text(encoding="utf-8"))
+
+class DeltaRoundTripTest(PublisherCase):
+    def test_delta_is_listed_in_manifest(self):
+        old = kpi_rows(20)
+        self.publish_rows(old)
+        new = old[:3] + ["Хозяйство 3,2023,99.0"] + old[5:] + ["Новое,2024,50.0"]
+        report = self.publish_rows(new)
+        self.assertEqual(report["version"], 2)
+        step = self.manifest()["deltas"][0]
+        self.assertEqual((step["from"], step["to"]), (1, 2))
+        d = step["files"]["kpi.csv"]
+        self.assertEqual(d["key"], ["Контрагент", "Год"])
+        self.assertEqual((d["delete"], d["replace"], d["insert"]), (1, 1, 1))
+        self.assertTrue((self.pub / d["path"]).is_file())
+
+    @unittest.skipUnless(NODE, "node не установлен")
+    def test_apply_delta_gives_new_file(self):
+        old = kpi_rows(20)
+        self.publish_rows(old)
+        old_path = self.pub / self.manifest()["files"]["kpi.csv"]["path"]
+        new = ["Первое,2022,10.0"] + old[:7] + ["Хозяйство 7,2023,1.5"] + old[8:15] + old[16:]
+        self.publish_rows(new)
+        m = self.manifest()
+        d = m["deltas"][0]["files"]["kpi.csv"]
+        script = self.root / "apply.mjs"
+        script.write_text(APPLY_JS % {"repo": REPO.as_posix()}, encoding="utf-8")
+        out = subprocess.run([NODE, str(script), str(old_path), str(self.pub / d["path"]), json.dumps(d["key"])],
+                             capture_output=True, text=True, timeout=60)
+        self.assertEqual(out.returncode, 0, out.stderr)
+        cols = HEADER.split(",")
+        self.assertEqual(json.loads(out.stdout), [dict(zip(cols, r.split(","))) for r in new])
+        self.assertEqual(d["to"], m["files"]["kpi.csv"]["sha256"])
+
+class CollectTest(PublisherCase):
+    def test_old_versions_removed(self):
+        paths = []
+        for i in range(versioned.KEEP_VERSIONS + 2):
+            self.publish_rows(kpi_rows(3, 2000 + i))
+            paths.append(self.manifest()["files"]["kpi.csv"]["path"])
+        gone, kept = paths[:2], paths[2:]
+        self.assertFalse(any((self.pub / p).exists() for p in gone))
+        self.assertTrue(all((self.pub / p).exists() for p in kept))
+        self.assertEqual(self.manifest()["version"], len(paths))
+
+    def test_tile_dirs_follow_index_versions(self):
+        tiles = self.pub / "tiles"
+        hashes = [f"{i:012x}" for i in range(versioned.KEEP_VERSIONS + 2)]
+        for h in hashes:
+            (tiles / h / "3").mkdir(parents=True)
+            (tiles / "index.json").write_text(json.dumps({"hash": h}), encoding="utf-8")
+            self.publish("tiles.json", (tiles / "index.json").read_text(encoding="utf-8"))
+        self.assertEqual(sorted(p.name for p in tiles.iterdir() if p.is_dir()), hashes[2:])
+
+class StageTest(PublisherCase):
+    def test_stage_does_not_touch_manifest(self):
+        self.publish_rows(kpi_rows(3))
+        before = self.manifest()
+        report = self.publish_rows(kpi_rows(4), commit=False)
+        self.assertTrue(report["staged"])
+        self.assertEqual(self.manifest(), before)
+        self.assertEqual((self.pub / "kpi.csv").read_text(encoding="utf-8").count("\n"), 5)
+        # следующий commit() выпускает одну новую версию с уже лежащим файлом
+        self.assertEqual(self.publish_rows(kpi_rows(4))["version"], before["version"] + 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Паритет движков kpi_stats.csv: --engine numpy (stats_numpy.py) и Python-путь
+(python_moments/stats_rows) должны давать побайтно один и тот же файл.
+Данные случайные, но с фиксированным seed: много групп с одинаковым набором
+урожайностей (равные SD — порядок рангов WAASB), пар, у которых среднее
+попадает ровно на «половинку» десятой (1.0 и 1.1 -> 1.05), и пар с CV% ровно
+на «половинке» (0.3 и 2.9 -> 81.25 %).
+Запуск: python -m pytest -q tests (без NumPy тест пропускается).
+"""
+import random, sys, tempfile, unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import stats_numpy, validate_kpi
+
+SEEDS = (1, 7, 42, 2024)
+# пары (a, b) десятых с CV% = 1000·(b - a)/(a + b) ровно на .x5 при целом среднем
+CV_HALVES = [(a, b) for b in range(2, 120) for a in range(1, b)
+             if (a + b) % 2 == 0 and 2000 * (b - a) % (a + b) == 0 and 2000 * (b - a) // (a + b) % 2]
+
+def sample(seed, groups=400):
+    """-> (Контрагенты, урожайности в десятых) очищенных строк в перемешанном порядке."""
+    rnd = random.Random(seed)
+    pool = [[rnd.randint(50, 400) for _ in range(rnd.randint(1, 6))] for _ in range(12)]
+    rows = []
+    for g in range(groups):
+        name = f"Хозяйство {g:04d}"
+        kind = rnd.random()
+        if kind < 0.4:      # общий набор значений -> совпадающие Mean/SD у многих групп
+            ks = list(pool[rnd.randrange(len(pool))])
+        elif kind < 0.6:    # соседние десятые: среднее на «половинке»
+            k = rnd.randint(1, 999)
+            ks = [k, k + 1] * rnd.randint(1, 3)
+        elif kind < 0.7:    # CV% на «половинке»; масштаб CV не меняет
+            a, b = rnd.choice(CV_HALVES)
+            c = rnd.randint(1, 20)
+            ks = [a * c, b * c] * rnd.randint(1, 2)
+        elif kind < 0.8:    # одна строка: SD = 0
+            ks = [rnd.randint(1, 999)]
+        else:
+            ks = [rnd.randint(1, 9999) for _ in range(rnd.randint(2, 8))]
+        rnd.shuffle(ks)
+        rows.extend((name, k) for k in ks)
+    rnd.shuffle(rows)
+    return [c for c, _ in rows], [k for _, k in rows]
+
+def stats_bytes(contr, tenths, engine):
+    table = validate_kpi.batch_stats(contr, tenths, engine)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "kpi_stats.csv"
+        validate_kpi.write_stats_table(path, table)
+        return path.read_bytes()
+
+@unittest.skipUnless(stats_numpy.available(), "NumPy не установлен")
+class StatsParityTest(unittest.TestCase):
+    def test_random_ties_and_halves(self):
+        for seed in SEEDS:
+            with self.subTest(seed=seed):
+                contr, tenths = sample(seed)
+                self.assertEqual(stats_bytes(contr, tenths, "numpy"),
+                                 stats_bytes(contr, tenths, "python"))
+
+    def test_numpy_engine_is_used(self):
+        contr, tenths = sample(SEEDS[0])
+        names = list(dict.fromkeys(contr))
+        index = {c: i for i, c in enumerate(names)}
+        table = stats_numpy.stats_rows(names, [index[c] for c in contr], tenths)
+        self.assertIsNotNone(table)     # иначе batch_stats молча ушёл бы в Python-путь
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+validate_kpi.run() во всех режимах (батч, --stream, --workers, --incremental) на одном файле:
+те же код, ошибки, очищенный CSV и kpi_stats.csv; geo_check.run() — батч, --workers и
+--incremental на файле со строками длиннее заголовка. Выходы и кэш чанков — во временном каталоге.
+Запуск: python -m pytest -q tests
+"""
+import csv, shutil, sys, tempfile, unittest
+from pathlib import Path
+from unittest import mock
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO / "scripts"))
+
+import geo_check, incremental, validate_kpi
+
+MODES = {"stream": ["--stream"], "workers": ["--workers", "2"], "incremental": ["--incremental"]}
+
+# nan/inf/1e309 — не урожайность: в любом режиме это ошибка строки, как пустое значение
+NON_FINITE = """Контрагент,Год,Урожайность_ц_га
+ООО «Ромашка»,2023,45.04
+ООО «Ромашка»,2024,nan
+ООО «Ромашка»,2025,47.2
+АО «Агро»,2023,inf
+АО «Агро»,2024,-Infinity
+АО «Агро»,2025,"51,2"
+АО «Агро»,2026,1e309
+ИП Полевой,2023,NaN
+ИП Полевой,2024,38.0
+ИП Полевой,2024,39.0
+ИП Полевой,2025,0
+"""
+
+class ModesCase(unittest.TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        for target, attr, value in [
+            (validate_kpi, "OUT_CLEAN", self.root / "clean.csv"),
+            (validate_kpi, "OUT_STATS", self.root / "stats.csv"),
+            (incremental, "CACHE_DIR", self.root / "cache"),
+        ]:
+            patcher = mock.patch.object(target, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def validate(self, src, flags):
+        code, out = validate_kpi.run([str(src), *flags])
+        return (code, out["errors"], out["rows_in"], out["rows_out"],
+                validate_kpi.OUT_CLEAN.read_bytes(), validate_kpi.OUT_STATS.read_bytes())
+
+class NonFiniteYieldTest(ModesCase):
+    def test_modes_match_batch(self):
+        src = self.root / "kpi.csv"
+        src.write_text(NON_FINITE, encoding="utf-8")
+        batch = self.validate(src, [])
+        self.assertEqual(batch[0], 1)
+        self.assertEqual(sorted(e["row"] for e in batch[1]), [2, 4, 5, 7, 8, 10, 11])
+        self.assertEqual(batch[3], 4)
+        for mode, flags in MODES.items():
+            with self.subTest(mode=mode):
+                self.assertEqual(self.validate(src, flags), batch)
+        self.assertEqual(self.validate(src, MODES["incremental"]), batch)    # из кэша чанков
+
+# лишние поля — мусор после координат; очищенный файл — по ширине заголовка
+RAGGED_GEO = """Контрагент,Год,Широта,Долгота
+ООО «Ромашка»,2023,55.7558,37.6173,лишнее
+АО «Агро»,2024,54.7065,20.5110
+ИП Полевой,2024,91.0,36.0,x,y
+ИП Полевой,2025, 45.1 ,39.2
+ООО «Ромашка»,2023,55.0,37.0,дубль
+"""
+
+class RaggedGeoTest(ModesCase):
+    def check(self, src, flags):
+        code, out = geo_check.run([str(src), *flags])
+        return code, out["errors"], out["rows_out"], Path(out["clean_path"]).read_bytes()
+
+    def test_rows_trimmed_to_header(self):
+        src = self.root / "geo.csv"
+        src.write_text(RAGGED_GEO, encoding="utf-8")
+        batch = self.check(src, [])
+        self.assertEqual(batch[0], 1)
+        self.assertEqual([e["row"] for e in batch[1]], [4, 6])
+        rows = list(csv.reader(batch[3].decode("utf-8").splitlines()))
+        self.assertEqual(rows[1:], [["ООО «Ромашка»", "2023", "55.755800", "37.617300"],
+                                    ["АО «Агро»", "2024", "54.706500", "20.511000"],
+                                    ["ИП Полевой", "2025", "45.100000", "39.200000"]])
+        for mode, flags in [("workers", ["--workers", "2"]), ("incremental", ["--incremental"])]:
+            with self.subTest(mode=mode):
+                self.assertEqual(self.check(src, flags), batch)
+
+if __name__ == "__main__":
+    unittest.main()